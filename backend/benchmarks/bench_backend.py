@@ -0,0 +1,407 @@
+"""
+Benchmarks the upload, listing, filter and export paths of the backend end to end through
+CsvUploaderService, and writes the results to a JSON file so runs can be compared with
+benchmarks.compare.
+
+For every --rows size a synthetic CSV shaped like dados_teste.csv is uploaded into an empty
+repository, then the following are measured:
+    upload   rows/s and peak RSS of CsvUploaderService.upload_csv
+    page     latency of /all at several page depths, by page number and by cursor
+    filter   latency of a set of /filter queries
+    search   latency of /search typeahead queries in each mode
+    export   throughput of /csv-file in every EXPORTS format and compression whose library is installed
+    write    writes/s and latency of a burst of concurrent /add-item calls, with and without group
+             commit (only for repositories that group commit, so not for --repository memory)
+
+--repository memory (the default) runs against an in-memory stand-in and measures the service
+code alone. --repository postgres uses the database configured by the usual DB_* variables;
+users_data must be empty or --reset given, which drops the datasets of previous uploads and
+TRUNCATEs it before each size. Any other value
+is read as "module:factory", a callable returning a repository.
+
+Run from the backend directory:
+    python -m benchmarks.bench_backend --rows 10000 100000
+    python -m benchmarks.bench_backend --repository postgres --reset --rows 1000000 --engine parallel
+"""
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import resource
+import asyncio
+import tempfile
+import threading
+import subprocess
+import importlib
+from datetime import datetime, timezone
+from statistics import mean
+from typing import Any, Callable, Dict, List
+
+# The query cache would turn every repeated read into a hit; it is enabled with --cache.
+os.environ.setdefault("QUERY_CACHE_BACKEND", "none")
+
+from fastapi import UploadFile
+
+from src.services.csv_parallel import shutdown_process_pool
+from src.services.csv_uploader_service import CsvUploaderService
+from src.services.export_formats import EXPORT_FORMATS, UnsupportedExportError, validate_compression
+from src.models.payloads.csv_uploader import AddItemPayload
+from src.infra.connection_pool import close_pool
+from src.infra.cv_uploader_data_base.threaded_repository import shutdown_executor
+from src.infra.cv_uploader_data_base.bulk_ingestion import ENGINE_NAMES
+from src.infra.cv_uploader_data_base.datasets import DEFAULT_DATASET_ID
+
+from .synthetic_csv import cached_csv, compressed_csv
+
+
+DEFAULT_PAGE_DEPTHS = (1, 10, 100, 1000, 10000)
+
+FILTERS = {
+    "nacionalidade_eq": [("nacionalidade", "Brasileiro")],
+    "genero_and_birth_range": [("genero", "Feminino"), ("data_nascimento__gte", "1980/01/01"), ("data_nascimento__lt", "1990/01/01")],
+    "nacionalidade_in": [("nacionalidade__in", "Italiano,Japonês")],
+    "created_after": [("data_criacao__gte", "2023/06/01")],
+}
+
+SEARCHES = {
+    "prefix": ("ana", "prefix"),
+    "prefix_accented": ("Letí", "prefix"),
+    "substring": ("silva", "substring"),
+    "fuzzy_typo": ("olivera", "fuzzy"),
+}
+
+# (format, compression) pairs measured by the export benchmark.
+EXPORTS = (
+    ("csv", None),
+    ("csv", "gzip"),
+    ("csv", "zstd"),
+    ("ndjson", None),
+    ("parquet", "snappy"),
+    ("parquet", "zstd"),
+    ("arrow", "lz4"),
+)
+
+MEGABYTE = 1024 * 1024
+
+
+class PeakRssSampler:
+    """
+    Samples the resident set size of this process in a background thread while a block runs.
+
+    The kernel only keeps the peak of the whole process lifetime, which cannot be reset between
+    stages, so the peak of each stage is sampled instead. Worker processes of the parallel
+    engine are not included.
+    """
+
+    def __init__(self, interval: float = 0.005) -> None:
+        self.interval = interval
+        self.peak_bytes = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @staticmethod
+    def current_rss() -> int:
+        try:
+            with open("/proc/self/statm", "rb") as statm:
+                return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError):
+            # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return peak if sys.platform == "darwin" else peak * 1024
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self.peak_bytes = max(self.peak_bytes, self.current_rss())
+            self._stop.wait(self.interval)
+
+    def __enter__(self) -> "PeakRssSampler":
+        self.peak_bytes = self.current_rss()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.peak_bytes = max(self.peak_bytes, self.current_rss())
+
+    @property
+    def peak_mb(self) -> float:
+        return self.peak_bytes / MEGABYTE
+
+
+def latency_summary(samples: List[float]) -> Dict[str, float]:
+    ordered = sorted(samples)
+
+    def percentile(fraction: float) -> float:
+        return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)] * 1000
+
+    return {
+        "mean_ms": mean(ordered) * 1000,
+        "p50_ms": percentile(0.50),
+        "p95_ms": percentile(0.95),
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+async def time_calls(func: Callable, repeats: int) -> Dict[str, float]:
+    samples = []
+    for _ in range(repeats):
+        started_at = time.perf_counter()
+        await func()
+        samples.append(time.perf_counter() - started_at)
+    return latency_summary(samples)
+
+
+def create_repository(name: str):
+    if name == "memory":
+        from .memory_repository import MemoryRepository
+        return MemoryRepository()
+    if name == "postgres":
+        from src.infra.cv_uploader_data_base.repository_factory import create_repository as create_db_repository
+        return create_db_repository()
+    module_name, _, factory_name = name.partition(":")
+    if not factory_name:
+        raise ValueError(f"Unknown repository '{name}'. Use memory, postgres or module:factory")
+    return getattr(importlib.import_module(module_name), factory_name)()
+
+
+async def reset_postgres(repository) -> None:
+    # Uploads made with new_dataset or replace fill datasets of their own
+    for dataset in await repository.get_datasets():
+        if dataset[0] != DEFAULT_DATASET_ID:
+            await repository.drop_dataset(dataset[0])
+    with repository.borrow_connection() as connection:
+        with connection.cursor() as cursor:
+            cursor.execute("TRUNCATE users_data RESTART IDENTITY")
+        connection.commit()
+    repository.cache.invalidate()
+
+
+async def bench_upload(service: CsvUploaderService, path: str, engine: str) -> Dict[str, Any]:
+    with open(path, "rb") as file, PeakRssSampler() as rss:
+        started_at = time.perf_counter()
+        response = await service.upload_csv(UploadFile(file=file, filename=os.path.basename(path)), engine, force=True)
+        elapsed = time.perf_counter() - started_at
+    return {
+        "rows": response.rows,
+        "rows_rejected": response.rows_rejected,
+        "elapsed_seconds": elapsed,
+        "rows_per_second": response.rows / elapsed if elapsed else 0.0,
+        "ingest_rows_per_second": response.rows_per_second,
+        "peak_rss_mb": rss.peak_mb,
+        "file_mb": os.path.getsize(path) / MEGABYTE,
+    }
+
+
+async def bench_pages(service: CsvUploaderService, total: int, page_size: int, depths, repeats: int) -> List[Dict[str, Any]]:
+    results = []
+    last_page = max((total + page_size - 1) // page_size, 1)
+    for depth in sorted({min(depth, last_page) for depth in depths}):
+        by_number = await time_calls(lambda: service.get_all_values_with_pagination(depth, page_size), repeats)
+        results.append({"params": {"depth": depth, "page_size": page_size, "mode": "page"}, "metrics": by_number})
+        page = await service.get_all_values_with_pagination(depth, page_size)
+        if page and page.next_cursor:
+            cursor = page.next_cursor
+            by_cursor = await time_calls(lambda: service.get_all_values_with_pagination(1, page_size, cursor), repeats)
+            results.append({"params": {"depth": depth + 1, "page_size": page_size, "mode": "cursor"}, "metrics": by_cursor})
+    return results
+
+
+async def bench_filters(service: CsvUploaderService, page_size: int, repeats: int) -> List[Dict[str, Any]]:
+    results = []
+    for name, filters in FILTERS.items():
+        metrics = await time_calls(lambda: service.filter_values(filters, 1, page_size), repeats)
+        results.append({"params": {"filter": name, "page_size": page_size}, "metrics": metrics})
+    return results
+
+
+async def bench_search(service: CsvUploaderService, repeats: int, limit: int = 10) -> List[Dict[str, Any]]:
+    results = []
+    for name, (text, mode) in SEARCHES.items():
+        metrics = await time_calls(lambda: service.search_values(text, mode, limit), repeats)
+        results.append({"params": {"search": name, "limit": limit}, "metrics": metrics})
+    return results
+
+
+async def bench_export(
+    service: CsvUploaderService, rows: int, export_format: str, compression: str | None
+) -> Dict[str, Any]:
+    with PeakRssSampler() as rss:
+        started_at = time.perf_counter()
+        response = await service.get_csv_file(compression, export_format)
+        size = 0
+        first_byte = None
+        async for chunk in response.body_iterator:
+            if first_byte is None:
+                first_byte = time.perf_counter() - started_at
+            size += len(chunk)
+        elapsed = time.perf_counter() - started_at
+    return {
+        "elapsed_seconds": elapsed,
+        "first_byte_ms": (first_byte or elapsed) * 1000,
+        "rows_per_second": rows / elapsed if elapsed else 0.0,
+        "mb_per_second": size / MEGABYTE / elapsed if elapsed else 0.0,
+        "output_mb": size / MEGABYTE,
+        "peak_rss_mb": rss.peak_mb,
+    }
+
+
+async def bench_write_burst(service: CsvUploaderService, writes: int, group_commit: bool) -> Dict[str, Any]:
+    service.repository.group_commit = group_commit
+    run_id = time.time_ns()
+    payloads = [
+        AddItemPayload(
+            nome=f"Burst {run_id} {index}",
+            data_nascimento="1990/01/01",
+            genero="Feminino",
+            nacionalidade="Brasileiro",
+            data_criacao="2024/01/01",
+            data_atualizacao="2024/01/01",
+        )
+        for index in range(writes)
+    ]
+    samples = []
+
+    async def add(payload: AddItemPayload) -> None:
+        started_at = time.perf_counter()
+        await service.add_item(payload)
+        samples.append(time.perf_counter() - started_at)
+
+    started_at = time.perf_counter()
+    await asyncio.gather(*(add(payload) for payload in payloads))
+    elapsed = time.perf_counter() - started_at
+    return {"elapsed_seconds": elapsed, "writes_per_second": writes / elapsed, **latency_summary(samples)}
+
+
+async def run_size(args: argparse.Namespace, rows: int) -> List[Dict[str, Any]]:
+    path = cached_csv(args.data_dir, rows, args.seed, args.invalid_ratio)
+    service = CsvUploaderService(create_repository(args.repository))
+    if args.reset:
+        await reset_postgres(service.repository)
+
+    def record(benchmark: str, metrics: Dict[str, Any], params: Dict[str, Any] | None = None) -> Dict[str, Any]:
+        return {"benchmark": benchmark, "rows": rows, "params": params or {}, "metrics": metrics}
+
+    results = []
+    upload_params = {"engine": args.engine}
+    if args.upload_compression != "none":
+        path = compressed_csv(path, args.upload_compression)
+        upload_params["compression"] = args.upload_compression
+    upload = await bench_upload(service, path, args.engine)
+    results.append(record("upload", upload, upload_params))
+    print(f"[{rows:,}] upload: {upload['rows_per_second']:,.0f} rows/s, peak RSS {upload['peak_rss_mb']:.0f} MB")
+
+    for result in await bench_pages(service, upload["rows"], args.page_size, args.page_depths, args.repeats):
+        results.append(record("page", result["metrics"], result["params"]))
+        print(f"[{rows:,}] page {result['params']['mode']} depth {result['params']['depth']}: p50 {result['metrics']['p50_ms']:.2f} ms")
+
+    for result in await bench_filters(service, args.page_size, args.repeats):
+        results.append(record("filter", result["metrics"], result["params"]))
+        print(f"[{rows:,}] filter {result['params']['filter']}: p50 {result['metrics']['p50_ms']:.2f} ms")
+
+    for result in await bench_search(service, args.repeats):
+        results.append(record("search", result["metrics"], result["params"]))
+        print(f"[{rows:,}] search {result['params']['search']}: p50 {result['metrics']['p50_ms']:.2f} ms")
+
+    for export_format, compression in EXPORTS:
+        try:
+            validate_compression(EXPORT_FORMATS[export_format], compression)
+        except UnsupportedExportError as error:
+            print(f"[{rows:,}] export {export_format} {compression or 'plain'}: skipped, {error}")
+            continue
+        export = await bench_export(service, upload["rows"], export_format, compression)
+        params = {"compression": compression or "none"}
+        if export_format != "csv":
+            params["format"] = export_format
+        results.append(record("export", export, params))
+        print(
+            f"[{rows:,}] export {export_format} {compression or 'plain'}: "
+            f"{export['rows_per_second']:,.0f} rows/s, {export['mb_per_second']:.1f} MB/s"
+        )
+
+    if args.write_burst and hasattr(service.repository, "group_commit"):
+        for group_commit in (False, True):
+            burst = await bench_write_burst(service, args.write_burst, group_commit)
+            results.append(record("write", burst, {"writes": args.write_burst, "group_commit": group_commit}))
+            print(
+                f"[{rows:,}] write burst, group commit {'on' if group_commit else 'off'}: "
+                f"{burst['writes_per_second']:,.0f} writes/s, p95 {burst['p95_ms']:.2f} ms"
+            )
+    return results
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def write_results(path: str, args: argparse.Namespace, results: List[Dict[str, Any]]) -> None:
+    document = {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "git_revision": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "repository": args.repository,
+            "engine": args.engine,
+            "seed": args.seed,
+            "cache": os.environ.get("QUERY_CACHE_BACKEND"),
+        },
+        "results": results,
+    }
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w", encoding="utf-8") as file:
+        json.dump(document, file, indent=2)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--repository", default="memory")
+    parser.add_argument("--engine", default="upsert", choices=ENGINE_NAMES)
+    parser.add_argument(
+        "--upload-compression", default="none", choices=("none", "gzip", "zstd"),
+        help="Upload a compressed copy of the synthetic CSV"
+    )
+    parser.add_argument("--reset", action="store_true", help="Drop the datasets and TRUNCATE users_data before each size (postgres only)")
+    parser.add_argument("--cache", action="store_true", help="Keep the query cache configured by QUERY_CACHE_BACKEND")
+    parser.add_argument("--page-size", type=int, default=10)
+    parser.add_argument("--page-depths", type=int, nargs="+", default=list(DEFAULT_PAGE_DEPTHS))
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--invalid-ratio", type=float, default=0.0)
+    parser.add_argument("--write-burst", type=int, default=500, help="Concurrent writes of the write benchmark, 0 to skip it")
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "csv_uploader_bench"))
+    parser.add_argument("--output", default=None, help="Defaults to benchmarks/results/<timestamp>.json")
+    args = parser.parse_args()
+    if args.reset and args.repository != "postgres":
+        parser.error("--reset only applies to --repository postgres")
+    if args.cache and os.environ["QUERY_CACHE_BACKEND"] == "none":
+        os.environ["QUERY_CACHE_BACKEND"] = "memory"
+
+    output = args.output or os.path.join(
+        os.path.dirname(__file__), "results", f"{datetime.now(timezone.utc):%Y%m%dT%H%M%SZ}.json"
+    )
+    results = []
+    try:
+        for rows in args.rows:
+            results.extend(asyncio.run(run_size(args, rows)))
+    finally:
+        shutdown_process_pool()
+        shutdown_executor()
+        close_pool()
+    write_results(output, args, results)
+    print(f"\nResults written to {output}")
+
+
+if __name__ == "__main__":
+    main()
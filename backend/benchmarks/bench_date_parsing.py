@@ -0,0 +1,66 @@
+"""
+Compares the date parsing used by the ingestion hot loop before and after src.date_parser.
+
+Run from the backend directory:
+    python -m benchmarks.bench_date_parsing --rows 200000
+"""
+import re
+import time
+import random
+import argparse
+from datetime import date, datetime, timedelta
+
+from src.date_parser import parse_date, parse_dates
+
+
+def legacy_format_date(value_data: str) -> date:
+    if re.search(r"\d{2}/\d{2}/\d{4}", value_data):
+        date_format = "%d/%m/%Y"
+    else:
+        date_format = "%Y/%m/%d"
+    return datetime.strptime(value_data, date_format).date()
+
+
+def synthetic_dates(rows: int, distinct: int, seed: int = 42) -> list:
+    randomizer = random.Random(seed)
+    start = date(1940, 1, 1)
+    pool = []
+    for _ in range(distinct):
+        value = start + timedelta(days=randomizer.randrange(365 * 80))
+        date_format = "%Y/%m/%d" if randomizer.random() < 0.5 else "%d/%m/%Y"
+        pool.append(value.strftime(date_format))
+    return [randomizer.choice(pool) for _ in range(rows)]
+
+
+def measure(label: str, func, values: list) -> float:
+    started_at = time.perf_counter()
+    func(values)
+    elapsed = time.perf_counter() - started_at
+    print(f"{label:<28} {elapsed:8.3f}s  {len(values) / elapsed:12,.0f} dates/s")
+    return elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--distinct", type=int, default=20_000)
+    args = parser.parse_args()
+
+    values = synthetic_dates(args.rows, args.distinct)
+    assert [legacy_format_date(value) for value in values[:1000]] == parse_dates(values[:1000])
+
+    baseline = measure("legacy regex + strptime", lambda items: [legacy_format_date(v) for v in items], values)
+    parse_date.cache_clear()
+    uncached = measure("fast parser, cold cache", lambda items: [parse_date.__wrapped__(v) for v in items], values)
+    parse_date.cache_clear()
+    cached = measure("fast parser + LRU cache", lambda items: [parse_date(v) for v in items], values)
+    parse_date.cache_clear()
+    column = measure("parse_dates (column)", parse_dates, values)
+
+    print()
+    for label, elapsed in (("fast parser", uncached), ("LRU cache", cached), ("column mode", column)):
+        print(f"{label:<28} {baseline / elapsed:6.1f}x faster than legacy")
+
+
+if __name__ == "__main__":
+    main()
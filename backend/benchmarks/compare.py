@@ -0,0 +1,65 @@
+"""
+Compares two result files written by benchmarks.bench_backend.
+
+Each measurement of the new run is matched with the baseline measurement of the same benchmark,
+size and parameters. Throughputs (per_second) are better when higher, everything else when lower.
+
+Run from the backend directory:
+    python -m benchmarks.compare benchmarks/results/before.json benchmarks/results/after.json
+"""
+import json
+import argparse
+from typing import Any, Dict, Tuple
+
+DEFAULT_METRICS = (
+    "rows_per_second", "writes_per_second", "peak_rss_mb", "p50_ms", "p95_ms", "mb_per_second", "first_byte_ms"
+)
+
+
+def load_results(path: str) -> Dict[Tuple, Dict[str, Any]]:
+    with open(path, encoding="utf-8") as file:
+        document = json.load(file)
+    return {
+        (result["benchmark"], result["rows"], json.dumps(result["params"], sort_keys=True)): result["metrics"]
+        for result in document["results"]
+    }
+
+
+def describe(key: Tuple) -> str:
+    benchmark, rows, params = key
+    labels = ", ".join(f"{name}={value}" for name, value in json.loads(params).items())
+    return f"{benchmark} [{rows:,}] {labels}".strip()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--metrics", nargs="+", default=list(DEFAULT_METRICS))
+    parser.add_argument("--threshold", type=float, default=0.05, help="Relative change reported as a regression")
+    args = parser.parse_args()
+
+    baseline = load_results(args.baseline)
+    candidate = load_results(args.candidate)
+    regressions = 0
+    for key in sorted(candidate.keys() & baseline.keys(), key=lambda item: (item[0], item[1], item[2])):
+        for metric in args.metrics:
+            before = baseline[key].get(metric)
+            after = candidate[key].get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            improvement = change if metric.endswith("per_second") else -change
+            flag = ""
+            if improvement < -args.threshold:
+                flag = "  REGRESSION"
+                regressions += 1
+            print(f"{describe(key):<60} {metric:<16} {before:14,.2f} -> {after:14,.2f}  {change:+7.1%}{flag}")
+    missing = baseline.keys() - candidate.keys()
+    for key in sorted(missing):
+        print(f"{describe(key):<60} missing from {args.candidate}")
+    print(f"\n{regressions} regression(s) above {args.threshold:.0%}")
+
+
+if __name__ == "__main__":
+    main()
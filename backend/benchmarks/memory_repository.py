@@ -0,0 +1,293 @@
+"""
+In-memory stand-in for the PostgreSQL repository, used by the benchmarks when no database is
+available. It implements the repository methods the upload, listing, filter and export paths
+call, so those benchmarks measure the service code (spooling, parsing, validation, encoding)
+without any database time.
+
+Every engine behaves like "upsert" here: rows are merged on the natural key within their dataset.
+"""
+import csv
+import time
+import difflib
+import operator
+import unicodedata
+from io import StringIO
+from bisect import bisect_left, bisect_right
+from datetime import date, datetime, timezone
+from typing import AsyncIterator, Callable, Dict, Iterable, List, Sequence, Tuple
+
+from src.infra.query_cache import NullQueryCache
+from src.infra.cv_uploader_data_base.bulk_ingestion import DEFAULT_BATCH_SIZE, IngestionStats, batched
+from src.infra.cv_uploader_data_base.datasets import DEFAULT_DATASET_ID
+from src.infra.cv_uploader_data_base.filters import Predicate
+from src.infra.cv_uploader_data_base.search import SEARCH_CANDIDATES, SEARCH_FUZZY_THRESHOLD
+from src.infra.cv_uploader_data_base.pagination import Cursor, Page, decode_cursor, encode_cursor
+from src.infra.cv_uploader_data_base.querys import USERS_DATA_COLUMNS
+
+
+COMPARISONS: Dict[str, Callable] = {
+    "eq": operator.eq,
+    "ne": operator.ne,
+    "gt": operator.gt,
+    "gte": operator.ge,
+    "lt": operator.lt,
+    "lte": operator.le,
+    "in": lambda value, values: value in values,
+}
+
+DATE_INDEXES = tuple(
+    index for index, column in enumerate(USERS_DATA_COLUMNS) if column.startswith("data_")
+)
+NATURAL_KEY_INDEXES = tuple(USERS_DATA_COLUMNS.index(column) for column in ("nome", "data_nascimento", "data_criacao"))
+
+
+def format_item(item_id: int, row: Sequence, dataset_id: int) -> Tuple:
+    """Formats a stored row like ITEM_SELECT_COLUMNS does."""
+    return (item_id,) + tuple(
+        value.strftime("%Y/%m/%d") if index in DATE_INDEXES else value for index, value in enumerate(row)
+    ) + (dataset_id,)
+
+
+def search_text(value: str | None) -> str:
+    """Lowercases and strips the accents of a name like users_data_search_text does."""
+    decomposed = unicodedata.normalize("NFKD", value or "")
+    return "".join(char for char in decomposed if not unicodedata.combining(char)).lower()
+
+
+class MemoryRepository:
+    def __init__(self) -> None:
+        self.cache = NullQueryCache(0, 0)
+        self.ids: List[int] = []
+        self.rows: Dict[int, Tuple] = {}
+        self.keys: Dict[Tuple, int] = {}
+        self.item_datasets: Dict[int, int] = {}
+        self.last_id = 0
+        self.last_dataset_id = DEFAULT_DATASET_ID
+        now = datetime.now(timezone.utc)
+        # Datasets in the order of DATASET_FIELDS, without their row count
+        self.datasets: Dict[int, List] = {DEFAULT_DATASET_ID: [DEFAULT_DATASET_ID, "ready", None, None, None, now, now]}
+
+    def _upsert(self, row: Tuple, dataset_id: int = DEFAULT_DATASET_ID) -> Tuple[int, int]:
+        key = (dataset_id, *(row[index] for index in NATURAL_KEY_INDEXES))
+        item_id = self.keys.get(key)
+        if item_id is None:
+            self.last_id += 1
+            item_id = self.last_id
+            self.ids.append(item_id)
+            self.keys[key] = item_id
+            self.item_datasets[item_id] = dataset_id
+            self.rows[item_id] = row
+            return 1, 0
+        if self.rows[item_id] != row:
+            self.rows[item_id] = row
+            return 0, 1
+        return 0, 0
+
+    def _write(self, stats: IngestionStats, rows: List[Tuple], dataset_id: int) -> None:
+        for row in rows:
+            inserted, updated = self._upsert(tuple(row), dataset_id)
+            stats.rows_inserted += inserted
+            stats.rows_updated += updated
+        stats.rows += len(rows)
+        stats.batches += 1
+
+    async def save_csv_file(
+        self,
+        rows: Iterable[Sequence],
+        engine: str = "upsert",
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        on_batch: Callable[[IngestionStats], None] | None = None,
+        dataset_id: int = DEFAULT_DATASET_ID
+    ) -> IngestionStats:
+        stats = IngestionStats(engine=engine)
+        started_at = time.perf_counter()
+        for batch in batched(rows, batch_size):
+            self._write(stats, batch, dataset_id)
+            if on_batch:
+                stats.elapsed_seconds = time.perf_counter() - started_at
+                on_batch(stats)
+        stats.elapsed_seconds = time.perf_counter() - started_at
+        return stats
+
+    async def save_csv_shards(
+        self,
+        payloads: Iterable[Tuple[int, str]],
+        connections: int = 1,
+        on_batch: Callable[[IngestionStats], None] | None = None,
+        dataset_id: int = DEFAULT_DATASET_ID
+    ) -> IngestionStats:
+        stats = IngestionStats(engine="parallel")
+        started_at = time.perf_counter()
+        for _, payload in payloads:
+            rows = [
+                tuple(date.fromisoformat(value) if index in DATE_INDEXES else value for index, value in enumerate(row))
+                for row in csv.reader(StringIO(payload))
+            ]
+            self._write(stats, rows, dataset_id)
+            if on_batch:
+                stats.elapsed_seconds = time.perf_counter() - started_at
+                on_batch(stats)
+        stats.elapsed_seconds = time.perf_counter() - started_at
+        return stats
+
+    def _item(self, item_id: int) -> Tuple:
+        return format_item(item_id, self.rows[item_id], self.item_datasets[item_id])
+
+    def _listing_key(self, item_id: int) -> Tuple[int, int]:
+        return self.item_datasets[item_id], item_id
+
+    def _page(self, ids: List[int], page_number: int, page_size: int, cursor: str | None, by_dataset: bool = False) -> Page:
+        key = self._listing_key if by_dataset else None
+        if cursor:
+            position = decode_cursor(cursor)
+            target = (position.dataset_id, position.last_id) if by_dataset else position.last_id
+            if position.direction == "next":
+                start = bisect_right(ids, target, key=key)
+            else:
+                start = max(bisect_left(ids, target, key=key) - page_size, 0)
+        else:
+            start = (page_number - 1) * page_size
+        page_ids = ids[start:start + page_size]
+        page = Page(items=[self._item(item_id) for item_id in page_ids], total_count=len(ids))
+        if page_ids and start + page_size < len(ids):
+            last_id = page_ids[-1]
+            page.next_cursor = encode_cursor(Cursor(last_id=last_id, dataset_id=self.item_datasets[last_id]))
+        if page_ids and start > 0:
+            first_id = page_ids[0]
+            page.prev_cursor = encode_cursor(
+                Cursor(last_id=first_id, direction="prev", dataset_id=self.item_datasets[first_id])
+            )
+        return page
+
+    async def get_all_values_with_pagination(
+        self,
+        page_number: int,
+        page_size: int,
+        cursor: str | None = None,
+        count_mode: str = "maintained",
+        dataset_id: int | None = None
+    ) -> Page:
+        if dataset_id is not None:
+            predicates = [Predicate(column="dataset_id", operator="eq", value=dataset_id)]
+            return self._page(self._matching_ids(predicates), page_number, page_size, cursor)
+        # The whole listing is ordered by dataset, then id, like the repository reads it
+        ids = self.ids if len(self.datasets) == 1 else sorted(self.ids, key=self._listing_key)
+        return self._page(ids, page_number, page_size, cursor, by_dataset=True)
+
+    def _value(self, item_id: int, column: str):
+        if column == "id":
+            return item_id
+        if column == "dataset_id":
+            return self.item_datasets[item_id]
+        return self.rows[item_id][USERS_DATA_COLUMNS.index(column)]
+
+    def _matching_ids(self, predicates: List[Predicate] | None) -> List[int]:
+        if not predicates:
+            return self.ids
+        checks = [(predicate.column, COMPARISONS[predicate.operator], predicate.value) for predicate in predicates]
+        return [
+            item_id for item_id in self.ids
+            if all(compare(self._value(item_id, column), value) for column, compare, value in checks)
+        ]
+
+    async def filter_values(self, predicates: List[Predicate], page: int, page_size: int, cursor: str | None = None) -> Page:
+        return self._page(self._matching_ids(predicates), page, page_size, cursor)
+
+    async def stream_all_values(
+        self, chunk_size: int = 5000, predicates: List[Predicate] | None = None
+    ) -> AsyncIterator[List[Tuple]]:
+        ids = self._matching_ids(predicates)
+        for start in range(0, len(ids), chunk_size):
+            yield [self.rows[item_id] for item_id in ids[start:start + chunk_size]]
+
+    async def search_values(self, text: str, mode: str, limit: int) -> List[Tuple]:
+        text = search_text(text)
+        nome = USERS_DATA_COLUMNS.index("nome")
+        names = ((item_id, search_text(self.rows[item_id][nome])) for item_id in self.ids)
+        if mode == "prefix":
+            matches = sorted((name, item_id) for item_id, name in names if name.startswith(text))[:limit]
+            return [self._item(item_id) for _, item_id in matches]
+        if mode == "substring":
+            score = lambda name: difflib.SequenceMatcher(None, text, name).ratio() if text in name else None
+        else:
+            score = lambda name: max(
+                (ratio for word in name.split() if (ratio := difflib.SequenceMatcher(None, text, word).ratio()) >= SEARCH_FUZZY_THRESHOLD),
+                default=None,
+            )
+        candidates = []
+        for item_id, name in names:
+            rank = score(name)
+            if rank is not None:
+                candidates.append((-rank, item_id))
+                if len(candidates) >= SEARCH_CANDIDATES:
+                    break
+        return [self._item(item_id) for _, item_id in sorted(candidates)[:limit]]
+
+    async def get_stats(self) -> Dict[str, Dict[str | None, int]]:
+        columns = {column: USERS_DATA_COLUMNS.index(column) for column in ("nacionalidade", "genero", "data_nascimento", "data_criacao")}
+        stats: Dict[str, Dict[str | None, int]] = {}
+        for row in self.rows.values():
+            birth_date, created_on = row[columns["data_nascimento"]], row[columns["data_criacao"]]
+            buckets = {
+                "nacionalidade": row[columns["nacionalidade"]],
+                "genero": row[columns["genero"]],
+                "birth_year": f"{birth_date.year:04d}" if birth_date else None,
+                "data_criacao": created_on.isoformat() if created_on else None,
+            }
+            for dimension, bucket in buckets.items():
+                counts = stats.setdefault(dimension, {})
+                counts[bucket] = counts.get(bucket, 0) + 1
+        return stats
+
+    async def rebuild_stats(self) -> int:
+        return len(self.rows)
+
+    async def warm_up(self) -> int:
+        return 0
+
+    async def create_dataset(self, upload_id: str, file_name: str | None, content_hash: str | None) -> int:
+        self.last_dataset_id += 1
+        dataset_id = self.last_dataset_id
+        now = datetime.now(timezone.utc)
+        self.datasets[dataset_id] = [dataset_id, "loading", file_name, content_hash, upload_id, now, now]
+        return dataset_id
+
+    def _dataset(self, dataset_id: int) -> Tuple:
+        rows = sum(1 for item_dataset in self.item_datasets.values() if item_dataset == dataset_id)
+        *fields, created_at, updated_at = self.datasets[dataset_id]
+        return (*fields, rows, created_at, updated_at)
+
+    async def get_datasets(self) -> List[Tuple]:
+        return [self._dataset(dataset_id) for dataset_id in sorted(self.datasets)]
+
+    async def get_dataset(self, dataset_id: int) -> Tuple | None:
+        return self._dataset(dataset_id) if dataset_id in self.datasets else None
+
+    async def set_dataset_status(self, dataset_id: int, status: str) -> None:
+        if dataset_id in self.datasets:
+            self.datasets[dataset_id][1] = status
+            self.datasets[dataset_id][-1] = datetime.now(timezone.utc)
+
+    async def drop_dataset(self, dataset_id: int) -> bool:
+        if self.datasets.pop(dataset_id, None) is None:
+            return False
+        dropped = {item_id for item_id, item_dataset in self.item_datasets.items() if item_dataset == dataset_id}
+        self.ids = [item_id for item_id in self.ids if item_id not in dropped]
+        self.keys = {key: item_id for key, item_id in self.keys.items() if item_id not in dropped}
+        for item_id in dropped:
+            del self.rows[item_id]
+            del self.item_datasets[item_id]
+        return True
+
+    async def get_ingested_file(self, content_hash: str) -> None:
+        return None
+
+    async def record_ingested_file(
+        self,
+        content_hash: str,
+        upload_id: str,
+        file_name: str | None,
+        rows_processed: int,
+        dataset_id: int = DEFAULT_DATASET_ID
+    ) -> None:
+        pass
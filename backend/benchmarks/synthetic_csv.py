@@ -0,0 +1,132 @@
+"""
+Generates synthetic CSV files shaped like dados_teste.csv, for the benchmarks.
+
+Dates mix the YYYY/MM/DD and DD/MM/YYYY formats like the sample file, and a share of the rows
+can be made invalid to exercise the reject path. The same arguments always produce the same file.
+
+Run from the backend directory:
+    python -m benchmarks.synthetic_csv --rows 1000000 --output /tmp/users_1m.csv
+"""
+import os
+import csv
+import gzip
+import random
+import shutil
+import argparse
+from datetime import date, timedelta
+
+from src.infra.cv_uploader_data_base.querys import USERS_DATA_COLUMNS
+
+
+FIRST_NAMES = (
+    "João", "Maria", "Pedro", "Ana", "Lucas", "Juliana", "Gabriel", "Fernanda", "Rafael", "Camila",
+    "Mateus", "Beatriz", "Gustavo", "Larissa", "Felipe", "Mariana", "Thiago", "Letícia", "Bruno", "Patrícia",
+)
+LAST_NAMES = (
+    "da Silva", "Oliveira", "Santos", "Souza", "Pereira", "Costa", "Rodrigues", "Almeida", "Nascimento", "Lima",
+    "Araújo", "Fernandes", "Carvalho", "Gomes", "Martins", "Rocha", "Ribeiro", "Alves", "Monteiro", "Mendes",
+)
+GENDERS = ("Masculino", "Feminino")
+NATIONALITIES = ("Brasileiro", "Português", "Espanhol", "Italiano", "Argentino", "Francês", "Alemão", "Japonês")
+INVALID_DATES = ("2023/13/01", "31/02/1990", "not a date", "")
+
+WRITE_BATCH_SIZE = 10_000
+
+
+def format_date(value: date, randomizer: random.Random) -> str:
+    return value.strftime("%Y/%m/%d" if randomizer.random() < 0.5 else "%d/%m/%Y")
+
+
+def synthetic_rows(rows: int, seed: int = 42, invalid_ratio: float = 0.0):
+    """
+    Yields synthetic rows in USERS_DATA_COLUMNS order.
+
+    Names carry a sequence number, so natural keys do not repeat however many rows are generated.
+    """
+    randomizer = random.Random(seed)
+    birth_start = date(1940, 1, 1)
+    created_start = date(2020, 1, 1)
+    for number in range(rows):
+        nome = f"{randomizer.choice(FIRST_NAMES)} {randomizer.choice(LAST_NAMES)} {number}"
+        data_nascimento = birth_start + timedelta(days=randomizer.randrange(365 * 65))
+        data_criacao = created_start + timedelta(days=randomizer.randrange(365 * 4))
+        data_atualizacao = data_criacao + timedelta(days=randomizer.randrange(365))
+        row = [
+            nome,
+            format_date(data_nascimento, randomizer),
+            randomizer.choice(GENDERS),
+            randomizer.choice(NATIONALITIES),
+            format_date(data_criacao, randomizer),
+            format_date(data_atualizacao, randomizer),
+        ]
+        if invalid_ratio and randomizer.random() < invalid_ratio:
+            row[USERS_DATA_COLUMNS.index("data_nascimento")] = randomizer.choice(INVALID_DATES)
+        yield row
+
+
+def write_csv(path: str, rows: int, seed: int = 42, invalid_ratio: float = 0.0) -> str:
+    """
+    Writes a synthetic CSV file with a header row and the given number of data rows.
+
+    Returns:
+        str: The path of the file.
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w", newline="", encoding="utf-8") as file:
+        writer = csv.writer(file)
+        writer.writerow(USERS_DATA_COLUMNS)
+        batch = []
+        for row in synthetic_rows(rows, seed, invalid_ratio):
+            batch.append(row)
+            if len(batch) == WRITE_BATCH_SIZE:
+                writer.writerows(batch)
+                batch.clear()
+        writer.writerows(batch)
+    return path
+
+
+def cached_csv(directory: str, rows: int, seed: int = 42, invalid_ratio: float = 0.0) -> str:
+    """
+    Returns the path of a synthetic CSV file in directory, generating it only if it does not exist yet.
+    """
+    path = os.path.join(directory, f"users_{rows}_{seed}_{invalid_ratio:g}.csv")
+    if not os.path.exists(path):
+        write_csv(path + ".tmp", rows, seed, invalid_ratio)
+        os.replace(path + ".tmp", path)
+    return path
+
+
+def compressed_csv(path: str, compression: str) -> str:
+    """
+    Returns the path of a gzip or zstd compressed copy of a CSV file, creating it only if it does not exist yet.
+    """
+    extension = {"gzip": "gz", "zstd": "zst"}[compression]
+    compressed_path = f"{path}.{extension}"
+    if os.path.exists(compressed_path):
+        return compressed_path
+    with open(path, "rb") as source, open(compressed_path + ".tmp", "wb") as target:
+        if compression == "gzip":
+            with gzip.GzipFile(fileobj=target, mode="wb", compresslevel=6) as writer:
+                shutil.copyfileobj(source, writer, 1024 * 1024)
+        else:
+            import zstandard
+            zstandard.ZstdCompressor().copy_stream(source, target)
+    os.replace(compressed_path + ".tmp", compressed_path)
+    return compressed_path
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--invalid-ratio", type=float, default=0.0)
+    args = parser.parse_args()
+    write_csv(args.output, args.rows, args.seed, args.invalid_ratio)
+    print(f"Wrote {args.rows:,} rows to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,39 @@
+import time
+
+# Taken before the other imports, so the startup time includes importing the app
+STARTED_AT = time.perf_counter()
+
+import os
+import asyncio
 import logging
-from fastapi import FastAPI
+from contextlib import asynccontextmanager, contextmanager, suppress
+from typing import Iterator
+from fastapi import FastAPI, HTTPException
 
-from .routers import csv_uploader
+from .routers import csv_uploader, health, metrics
+from .middlewares.request_metrics import RequestMetricsMiddleware
+
+from .infra.connection_pool import close_pool, get_pool
+from .infra.metrics import STARTUP_SECONDS
+from .infra.query_cache import close_query_cache, get_query_cache
+from .infra.cv_uploader_data_base.csv_uploader_repository import ResumeConnectionHandler
+from .infra.cv_uploader_data_base.repository_factory import create_repository
+from .infra.cv_uploader_data_base.threaded_repository import shutdown_executor
+from .services.chunked_uploads import sweep_expired_sessions
+from .services.csv_parallel import shutdown_process_pool
+from .services.csv_uploader_service import CsvUploaderService
+from .services.ingestion_jobs import INGESTION_DRAIN_TIMEOUT, start_job_manager, stop_job_manager
 
 from fastapi.middleware.cors import CORSMiddleware
 
+WARM_UP_RETRY_INTERVAL = float(os.environ.get("WARM_UP_RETRY_INTERVAL", "5"))
+
 
 def add_routes(app: FastAPI) -> None:
     prefix = "/csv-uploader/api"
     app.include_router(csv_uploader.router, prefix=prefix)
+    app.include_router(health.router)
+    app.include_router(metrics.router)
 
 def add_middlewares(app: FastAPI) -> None:
     app.add_middleware(
@@ -17,7 +42,70 @@ def add_middlewares(app: FastAPI) -> None:
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
+        expose_headers=["next_cursor", "prev_cursor", "x-profile-file", "upload-offset"],
     )
+    app.add_middleware(RequestMetricsMiddleware)
+
+@contextmanager
+def startup_phase(name: str) -> Iterator[None]:
+    """
+    Logs the duration of a startup phase and exports it in STARTUP_SECONDS.
+    """
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started_at
+        STARTUP_SECONDS.set(elapsed, phase=name)
+        logging.info("Startup phase %s took %.3fs", name, elapsed)
+
+async def warm_up(app: FastAPI, repository: ResumeConnectionHandler) -> None:
+    """
+    Opens and warms up the database connections, then starts the ingestion workers and marks the
+    app as ready. Runs in the background, so the server accepts connections meanwhile and
+    /health/ready tells when it is worth sending it traffic.
+    """
+    with startup_phase("warm_up"):
+        while True:
+            try:
+                connections = await repository.warm_up()
+                break
+            except HTTPException as error:
+                logging.error("Failed to warm up, retrying in %ss. Error: %s", WARM_UP_RETRY_INTERVAL, error.detail)
+                await asyncio.sleep(WARM_UP_RETRY_INTERVAL)
+    logging.info("Warmed up %s database connections", connections)
+    with startup_phase("ingestion_workers"):
+        app.state.ingestion_jobs = await start_job_manager(repository)
+    app.state.status = "ready"
+    STARTUP_SECONDS.set(time.perf_counter() - STARTED_AT, phase="ready")
+    logging.info("Ready to serve in %.3fs", time.perf_counter() - STARTED_AT)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    STARTUP_SECONDS.set(time.perf_counter() - STARTED_AT, phase="import")
+    app.state.status = "starting"
+    with startup_phase("services"):
+        app.state.db_pool = get_pool()
+        app.state.query_cache = get_query_cache()
+        repository = create_repository()
+        app.state.csv_uploader_service = CsvUploaderService(repository)
+    warm_up_task = asyncio.create_task(warm_up(app, repository))
+    sweep_task = asyncio.create_task(sweep_expired_sessions())
+    STARTUP_SECONDS.set(time.perf_counter() - STARTED_AT, phase="serving")
+    yield
+    # The server has stopped accepting connections and finished the in-flight requests by now
+    app.state.status = "stopping"
+    for task in (warm_up_task, sweep_task):
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
+    logging.info("Draining ingestion workers")
+    await stop_job_manager(INGESTION_DRAIN_TIMEOUT)
+    shutdown_process_pool()
+    logging.info("Closing database connection pool")
+    shutdown_executor()
+    close_pool()
+    close_query_cache()
 
 def create_app() -> FastAPI:
     app = FastAPI(
@@ -25,6 +113,7 @@ def create_app() -> FastAPI:
         version="1.0.0",
         description="Upload your CSV with ease",
         docs_url="/docs",
+        lifespan=lifespan,
     )
     logging.info("Adding routes")
     add_routes(app)
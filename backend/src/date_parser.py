@@ -0,0 +1,75 @@
+import os
+from datetime import date, datetime
+from functools import lru_cache
+from typing import Iterable, List
+
+
+DATE_PARSE_CACHE_SIZE = int(os.environ.get("DATE_PARSE_CACHE_SIZE", "65536"))
+
+# Formats accepted for CSV and payload dates, in the order they are tried.
+DATE_FORMATS = ("%Y/%m/%d", "%d/%m/%Y")
+
+
+def _parse_date_slow(value: str) -> date:
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format).date()
+        except ValueError:
+            continue
+    raise ValueError(f"time data {value!r} does not match any of the formats {', '.join(DATE_FORMATS)}")
+
+
+@lru_cache(maxsize=DATE_PARSE_CACHE_SIZE)
+def parse_date(value: str) -> date:
+    """
+    Parses a date in the YYYY/MM/DD or DD/MM/YYYY format.
+
+    Zero-padded dates are sliced directly instead of going through strptime, other spellings
+    (e.g. "1985/3/5") fall back to strptime. Results are memoized, since birth and creation
+    dates repeat a lot within a file.
+
+    Args:
+        value (str): The date to be parsed.
+
+    Returns:
+        date: The parsed date.
+
+    Raises:
+        ValueError: If the value is not a valid date in one of the DATE_FORMATS.
+    """
+    if len(value) == 10 and value.isascii():
+        if value[4] == "/" and value[7] == "/":
+            year, month, day = value[:4], value[5:7], value[8:]
+        elif value[2] == "/" and value[5] == "/":
+            day, month, year = value[:2], value[3:5], value[6:]
+        else:
+            return _parse_date_slow(value)
+        if year.isdigit() and month.isdigit() and day.isdigit():
+            return date(int(year), int(month), int(day))
+    return _parse_date_slow(value)
+
+
+def parse_dates(values: Iterable[str]) -> List[date]:
+    """
+    Parses a whole column of dates, parsing each distinct value only once.
+
+    Args:
+        values (Iterable[str]): The dates to be parsed.
+
+    Returns:
+        List[date]: The parsed dates, in the same order.
+
+    Raises:
+        ValueError: If any of the values is not a valid date.
+    """
+    values = list(values)
+    parsed = {value: parse_date(value) for value in set(values)}
+    return [parsed[value] for value in values]
+
+
+def is_valid_date(value: str) -> bool:
+    try:
+        parse_date(value)
+    except (ValueError, TypeError):
+        return False
+    return True
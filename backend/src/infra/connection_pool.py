@@ -0,0 +1,394 @@
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterator, List
+
+import psycopg2
+from psycopg2 import extensions, sql
+
+from .metrics import DB_POOL_ACQUIRE_SECONDS, DB_POOL_EVENTS, DB_QUERIES, REGISTRY, CallbackGauge, stage
+
+STATEMENT_TYPES = frozenset(
+    ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "COPY", "CREATE", "DROP", "TRUNCATE", "BEGIN", "COMMIT", "ROLLBACK")
+)
+
+
+class PoolTimeoutError(Exception):
+    """Raised when no connection becomes available within the acquire timeout."""
+
+
+def connection_params() -> dict:
+    """
+    Returns the psycopg2 connection parameters taken from the environment variables.
+    """
+    return {
+        "host": os.environ.get("DB_HOST", "localhost"),
+        "database": os.environ.get("POSTGRES_DB"),
+        "user": os.environ.get("POSTGRES_USER"),
+        "password": os.environ.get("POSTGRES_PASSWORD"),
+        "port": os.environ.get("DB_PORT"),
+    }
+
+
+def statement_type(query) -> str:
+    """
+    Returns the leading keyword of a statement, used as a low-cardinality metrics label.
+    """
+    while isinstance(query, sql.Composed):
+        query = query.seq[0] if query.seq else ""
+    if isinstance(query, sql.SQL):
+        query = query.string
+    elif isinstance(query, bytes):
+        query = query[:64].decode("utf-8", "replace")
+    elif not isinstance(query, str):
+        query = str(query)
+    words = query.split(None, 1)
+    keyword = words[0].upper() if words else ""
+    return keyword if keyword in STATEMENT_TYPES else "OTHER"
+
+
+class InstrumentedCursor(extensions.cursor):
+    """
+    Cursor that counts statements in DB_QUERIES and times them as the "db.execute" stage.
+    Fetches of named (server-side) cursors go to the database and are timed as "db.fetch".
+    """
+
+    def execute(self, query, vars=None):
+        outcome = "error"
+        try:
+            with stage("db.execute"):
+                result = super().execute(query, vars)
+            outcome = "ok"
+            return result
+        finally:
+            DB_QUERIES.inc(statement=statement_type(query), outcome=outcome)
+
+    def copy_expert(self, sql, file, size=8192):
+        outcome = "error"
+        try:
+            with stage("db.execute"):
+                result = super().copy_expert(sql, file, size)
+            outcome = "ok"
+            return result
+        finally:
+            DB_QUERIES.inc(statement="COPY", outcome=outcome)
+
+    def fetchmany(self, size=None):
+        if not self.name:
+            return super().fetchmany(size) if size is not None else super().fetchmany()
+        with stage("db.fetch"):
+            return super().fetchmany(size) if size is not None else super().fetchmany()
+
+
+class InstrumentedConnection(extensions.connection):
+    """Connection whose cursors are InstrumentedCursors and whose commits are timed as "db.commit"."""
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.cursor_factory = InstrumentedCursor
+
+    def commit(self) -> None:
+        with stage("db.commit"):
+            super().commit()
+
+
+@dataclass
+class _ConnectionInfo:
+    created_at: float = field(default_factory=time.monotonic)
+    last_used_at: float = field(default_factory=time.monotonic)
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of psycopg2 connections.
+
+    Idle connections are health-checked with a "SELECT 1" before being handed out when they
+    have been idle for longer than health_check_after seconds, and connections older than
+    max_lifetime seconds are closed and replaced instead of being reused.
+    """
+
+    def __init__(
+        self,
+        min_size: int = 1,
+        max_size: int = 10,
+        acquire_timeout: float = 30.0,
+        max_lifetime: float = 3600.0,
+        health_check_after: float = 30.0,
+    ) -> None:
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ValueError("Pool sizes must satisfy 0 <= min_size <= max_size and max_size >= 1")
+        self.min_size = min_size
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self.max_lifetime = max_lifetime
+        self.health_check_after = health_check_after
+        self._idle: List = []
+        self._info: Dict = {}
+        self._opening = 0
+        self._condition = threading.Condition()
+        self._closed = False
+
+    @property
+    def size(self) -> int:
+        return len(self._info) + self._opening
+
+    def open(self) -> None:
+        """
+        Opens min_size connections up front.
+
+        The connections are opened concurrently, so opening the pool takes about as long as
+        opening a single connection.
+
+        Raises:
+            Exception: The error of the first connection that could not be opened, once the
+                others are in the pool.
+        """
+        with self._condition:
+            missing = max(self.min_size - self.size, 0)
+            self._opening += missing
+        if not missing:
+            return
+        with ThreadPoolExecutor(max_workers=missing, thread_name_prefix="db-open") as executor:
+            futures = [executor.submit(self._open_reserved) for _ in range(missing)]
+        errors = [future.exception() for future in futures if future.exception() is not None]
+        for future in futures:
+            if future.exception() is None:
+                self.release(future.result())
+        if errors:
+            raise errors[0]
+
+    def warm_up(self, prepare: Callable[..., None]) -> int:
+        """
+        Runs prepare on every idle connection, concurrently.
+
+        Connections on which prepare raises are closed instead of being put back in the pool.
+
+        Args:
+            prepare (Callable[..., None]): Called with each connection, in a separate thread.
+
+        Returns:
+            int: The number of connections prepared successfully.
+        """
+        with self._condition:
+            connections = list(self._idle)
+            self._idle.clear()
+        if not connections:
+            return 0
+        with ThreadPoolExecutor(max_workers=len(connections), thread_name_prefix="db-warm-up") as executor:
+            futures = [executor.submit(prepare, connection) for connection in connections]
+        prepared = 0
+        for connection, future in zip(connections, futures):
+            error = future.exception()
+            if error is None:
+                prepared += 1
+                self.release(connection)
+                continue
+            logging.warning("Discarding pooled connection that failed to warm up. Error: %s", error)
+            with self._condition:
+                self._discard(connection)
+                self._condition.notify()
+        return prepared
+
+    def _discard(self, connection) -> None:
+        DB_POOL_EVENTS.inc(event="discarded")
+        self._info.pop(connection, None)
+        try:
+            connection.close()
+        except Exception as error:
+            logging.warning("Failed to close pooled connection. Error: %s", error)
+
+    def _is_expired(self, connection) -> bool:
+        info = self._info[connection]
+        return connection.closed or time.monotonic() - info.created_at > self.max_lifetime
+
+    def _is_healthy(self, connection) -> bool:
+        info = self._info[connection]
+        if time.monotonic() - info.last_used_at < self.health_check_after:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            connection.rollback()
+        except Exception as error:
+            logging.warning("Discarding unhealthy pooled connection. Error: %s", error)
+            return False
+        return True
+
+    def acquire(self, timeout: float | None = None):
+        """
+        Borrows a connection from the pool, opening a new one if the pool is not full.
+
+        Args:
+            timeout (float | None, optional): Seconds to wait for a free connection. Defaults to acquire_timeout.
+
+        Returns:
+            connection: An open psycopg2 connection that must be given back with release().
+
+        Raises:
+            PoolTimeoutError: If no connection becomes available in time.
+        """
+        timeout = self.acquire_timeout if timeout is None else timeout
+        with DB_POOL_ACQUIRE_SECONDS.time():
+            deadline = time.monotonic() + timeout
+            while True:
+                connection = self._take_idle_or_reserve(deadline, timeout)
+                if connection is None:
+                    return self._open_reserved()
+                if not self._is_expired(connection) and self._is_healthy(connection):
+                    return connection
+                with self._condition:
+                    self._discard(connection)
+                    self._condition.notify()
+
+    def _take_idle_or_reserve(self, deadline: float, timeout: float):
+        """
+        Pops an idle connection, or reserves a slot for a new one and returns None.
+        """
+        with self._condition:
+            while True:
+                if self._closed:
+                    raise PoolTimeoutError("Connection pool is closed")
+                if self._idle:
+                    return self._idle.pop()
+                if self.size < self.max_size:
+                    self._opening += 1
+                    return None
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    DB_POOL_EVENTS.inc(event="timeout")
+                    raise PoolTimeoutError(
+                        f"Timed out after {timeout}s waiting for a database connection"
+                    )
+                self._condition.wait(remaining)
+
+    def _open_reserved(self):
+        try:
+            connection = psycopg2.connect(connection_factory=InstrumentedConnection, **connection_params())
+        except Exception:
+            with self._condition:
+                self._opening -= 1
+                self._condition.notify()
+            raise
+        with self._condition:
+            self._opening -= 1
+            self._info[connection] = _ConnectionInfo()
+        DB_POOL_EVENTS.inc(event="opened")
+        return connection
+
+    def release(self, connection) -> None:
+        """
+        Gives a borrowed connection back to the pool.
+
+        Any open transaction is rolled back, and broken or expired connections are closed
+        instead of being kept. A connection this pool does not know, e.g. one borrowed from a
+        pool replaced since by close_pool(), is closed so that it does not leak.
+
+        Args:
+            connection: The connection returned by acquire().
+        """
+        with self._condition:
+            known = connection in self._info
+        if not known:
+            logging.warning("Closing a connection released to a pool that did not open it")
+            DB_POOL_EVENTS.inc(event="discarded")
+            try:
+                connection.close()
+            except Exception as error:
+                logging.warning("Failed to close released connection. Error: %s", error)
+            return
+        reusable = True
+        try:
+            if not connection.closed and connection.get_transaction_status() != extensions.TRANSACTION_STATUS_IDLE:
+                connection.rollback()
+        except Exception as error:
+            logging.warning("Failed to reset pooled connection. Error: %s", error)
+            reusable = False
+        with self._condition:
+            if not reusable or self._closed or self._is_expired(connection):
+                self._discard(connection)
+            else:
+                self._info[connection].last_used_at = time.monotonic()
+                self._idle.append(connection)
+            self._condition.notify()
+
+    @contextmanager
+    def connection(self, timeout: float | None = None) -> Iterator:
+        connection = self.acquire(timeout)
+        try:
+            yield connection
+        finally:
+            self.release(connection)
+
+    def close(self) -> None:
+        """
+        Closes the idle connections and makes the pool refuse new acquisitions.
+        Borrowed connections are closed when they are released.
+        """
+        with self._condition:
+            self._closed = True
+            while self._idle:
+                self._discard(self._idle.pop())
+            self._condition.notify_all()
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {
+                "size": len(self._info),
+                "idle": len(self._idle),
+                "in_use": len(self._info) - len(self._idle),
+                "max_size": self.max_size,
+            }
+
+
+_pool: ConnectionPool | None = None
+_pool_lock = threading.Lock()
+
+
+def create_pool_from_env() -> ConnectionPool:
+    return ConnectionPool(
+        min_size=int(os.environ.get("DB_POOL_MIN_SIZE", "1")),
+        max_size=int(os.environ.get("DB_POOL_MAX_SIZE", "10")),
+        acquire_timeout=float(os.environ.get("DB_POOL_ACQUIRE_TIMEOUT", "30")),
+        max_lifetime=float(os.environ.get("DB_POOL_MAX_LIFETIME", "3600")),
+        health_check_after=float(os.environ.get("DB_POOL_HEALTH_CHECK_AFTER", "30")),
+    )
+
+
+def get_pool() -> ConnectionPool:
+    """
+    Returns the process-wide connection pool, creating it on first use.
+    """
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = create_pool_from_env()
+    return _pool
+
+
+def _pool_connections() -> Dict[tuple, float]:
+    pool = _pool
+    if pool is None:
+        return {}
+    stats = pool.stats()
+    return {(state,): stats[state] for state in ("size", "idle", "in_use", "max_size")}
+
+
+REGISTRY.register(CallbackGauge(
+    "csv_uploader_db_pool_connections",
+    "Connections of the pool by state: all open ones (size), idle, in use and the maximum.",
+    ("state",),
+    _pool_connections,
+))
+
+
+def close_pool() -> None:
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
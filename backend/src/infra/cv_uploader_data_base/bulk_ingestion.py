@@ -0,0 +1,446 @@
+import csv
+import time
+import logging
+from io import StringIO
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from uuid import uuid4
+from itertools import islice
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Iterable, Iterator, List, Sequence, Tuple
+
+from psycopg2 import sql
+from psycopg2.extras import execute_values
+
+from ..metrics import stage
+from .datasets import DEFAULT_DATASET_ID
+from .querys import (
+    COPY_STAGING_QUERY,
+    COPY_USERS_DATA_QUERY,
+    CREATE_TEMP_STAGING_TABLE_QUERY,
+    CREATE_UNLOGGED_STAGING_TABLE_QUERY,
+    DROP_STAGING_TABLE_QUERY,
+    INSERT_USERS_DATA_VALUES_QUERY,
+    LOCK_STAGING_TABLE_QUERY,
+    SELECT_STAGING_TABLES_QUERY,
+    STAGING_BUCKET_CONDITION,
+    TRUNCATE_STAGING_TABLE_QUERY,
+    TRY_LOCK_STAGING_TABLE_QUERY,
+    UNLOCK_STAGING_TABLE_QUERY,
+    UPSERT_USERS_DATA_FROM_STAGING_QUERY,
+)
+
+
+DEFAULT_BATCH_SIZE = 10_000
+
+
+class IngestionCancelled(Exception):
+    """Raised by an on_batch callback to stop an ingestion and roll it back."""
+
+
+@dataclass
+class IngestionStats:
+    engine: str
+    rows: int = 0
+    batches: int = 0
+    elapsed_seconds: float = 0.0
+    rows_rejected: int = 0
+    rows_inserted: int = 0
+    rows_updated: int = 0
+
+    @property
+    def rows_unchanged(self) -> int:
+        return self.rows - self.rows_inserted - self.rows_updated
+
+    @property
+    def rows_per_second(self) -> float:
+        if not self.elapsed_seconds:
+            return float(self.rows)
+        return self.rows / self.elapsed_seconds
+
+
+def batched(rows: Iterable[Sequence], batch_size: int) -> Iterator[List[Sequence]]:
+    """
+    Splits an iterable of rows into lists of at most batch_size rows.
+
+    Args:
+        rows (Iterable[Sequence]): The rows to be split.
+        batch_size (int): The maximum number of rows per batch.
+
+    Returns:
+        Iterator[List[Sequence]]: The batches, in the order the rows were given.
+    """
+    iterator = iter(rows)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+class IngestionEngine(ABC):
+    name = ""
+
+    def __init__(self, batch_size: int = DEFAULT_BATCH_SIZE, dataset_id: int = DEFAULT_DATASET_ID) -> None:
+        if batch_size < 1:
+            raise ValueError("batch_size must be greater than zero")
+        self.batch_size = batch_size
+        self.dataset_id = dataset_id
+
+    def prepare(self, cursor) -> None:
+        """Runs once in the ingestion transaction before the first batch."""
+
+    @abstractmethod
+    def write_batch(self, cursor, rows: List[Sequence]) -> Tuple[int, int]:
+        """
+        Writes one batch of rows and returns the number of rows inserted and updated.
+        """
+        raise NotImplementedError("Should implement write_batch()")
+
+    def ingest(
+        self,
+        connection,
+        rows: Iterable[Sequence],
+        on_batch: Callable[[IngestionStats], None] | None = None
+    ) -> IngestionStats:
+        """
+        Writes all rows into the dataset_id partition of the 'users_data' table inside a single transaction.
+
+        The rows are sent in batches of batch_size, and the transaction is committed once
+        after the last batch. If any batch fails the whole transaction is rolled back.
+
+        Reading a batch from rows is timed as the "parse.csv" stage and writing it as "ingest.write";
+        the decoding, date parsing and database stages nested in them are timed on their own.
+
+        Args:
+            connection: An open psycopg2 connection.
+            rows (Iterable[Sequence]): The rows to be inserted, in the order of USERS_DATA_COLUMNS.
+            on_batch (Callable[[IngestionStats], None] | None, optional): Called with the running stats after
+                each batch. It may raise IngestionCancelled to abort the ingestion. Defaults to None.
+
+        Returns:
+            IngestionStats: The number of rows and batches written and the elapsed time.
+        """
+        stats = IngestionStats(engine=self.name)
+        started_at = time.perf_counter()
+        try:
+            with connection.cursor() as cursor:
+                self.prepare(cursor)
+                batches = batched(rows, self.batch_size)
+                while True:
+                    with stage("parse.csv"):
+                        batch = next(batches, None)
+                    if batch is None:
+                        break
+                    with stage("ingest.write"):
+                        inserted, updated = self.write_batch(cursor, batch)
+                    stats.rows += len(batch)
+                    stats.rows_inserted += inserted
+                    stats.rows_updated += updated
+                    stats.batches += 1
+                    if on_batch:
+                        stats.elapsed_seconds = time.perf_counter() - started_at
+                        on_batch(stats)
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        stats.elapsed_seconds = time.perf_counter() - started_at
+        logging.info(
+            "Ingested %s rows in %s batches with engine '%s' (%.0f rows/s)",
+            stats.rows, stats.batches, self.name, stats.rows_per_second
+        )
+        return stats
+
+
+def encode_rows(rows: List[Sequence]) -> StringIO:
+    buffer = StringIO()
+    csv.writer(buffer).writerows(rows)
+    buffer.seek(0)
+    return buffer
+
+
+def with_dataset(dataset_id: int, rows: List[Sequence]) -> List[Sequence]:
+    """
+    Puts the dataset of the rows in front of their values, as COPY_USERS_DATA_QUERY and
+    INSERT_USERS_DATA_VALUES_QUERY expect them.
+    """
+    return [(dataset_id, *row) for row in rows]
+
+
+def upsert_from_staging(cursor, table: str, dataset_id: int, bucket: Tuple[int, int] | None = None) -> Tuple[int, int]:
+    """
+    Merges a staging table into a dataset of 'users_data' on the natural key.
+
+    Args:
+        cursor: A cursor of the connection running the merge.
+        table (str): The name of the staging table.
+        dataset_id (int): The dataset the rows are merged into.
+        bucket (Tuple[int, int] | None, optional): The number of buckets and the bucket of natural keys
+            to merge, see STAGING_BUCKET_CONDITION. Defaults to None, which merges every row.
+
+    Returns:
+        Tuple[int, int]: The number of rows inserted and updated.
+    """
+    condition = sql.SQL(STAGING_BUCKET_CONDITION if bucket else "true")
+    cursor.execute(
+        sql.SQL(UPSERT_USERS_DATA_FROM_STAGING_QUERY).format(table=sql.Identifier(table), condition=condition),
+        (dataset_id, *(bucket or ()))
+    )
+    inserted, updated = cursor.fetchone()
+    return inserted, updated
+
+
+class CopyIngestionEngine(IngestionEngine):
+    """
+    Streams each batch to PostgreSQL with COPY FROM STDIN in CSV format.
+
+    Rows are appended as they are, so a row whose natural key already exists in the dataset
+    fails the whole upload.
+    """
+    name = "copy"
+
+    def write_batch(self, cursor, rows: List[Sequence]) -> Tuple[int, int]:
+        cursor.copy_expert(COPY_USERS_DATA_QUERY, encode_rows(with_dataset(self.dataset_id, rows)))
+        return len(rows), 0
+
+
+class UpsertIngestionEngine(IngestionEngine):
+    """
+    Copies each batch into a temporary staging table and merges it into its dataset of 'users_data'
+    on the natural key: new rows are inserted, changed rows are updated and unchanged rows are skipped.
+    """
+    name = "upsert"
+    staging_table = "users_data_staging"
+
+    def prepare(self, cursor) -> None:
+        cursor.execute(sql.SQL(CREATE_TEMP_STAGING_TABLE_QUERY).format(table=sql.Identifier(self.staging_table)))
+
+    def write_batch(self, cursor, rows: List[Sequence]) -> Tuple[int, int]:
+        table = sql.Identifier(self.staging_table)
+        cursor.copy_expert(sql.SQL(COPY_STAGING_QUERY).format(table=table).as_string(cursor), encode_rows(rows))
+        counts = upsert_from_staging(cursor, self.staging_table, self.dataset_id)
+        cursor.execute(sql.SQL(TRUNCATE_STAGING_TABLE_QUERY).format(table=table))
+        return counts
+
+
+class InsertIngestionEngine(IngestionEngine):
+    """Sends each batch as a single multi-row INSERT statement."""
+    name = "insert"
+
+    def write_batch(self, cursor, rows: List[Sequence]) -> Tuple[int, int]:
+        execute_values(cursor, INSERT_USERS_DATA_VALUES_QUERY, with_dataset(self.dataset_id, rows), page_size=len(rows))
+        return len(rows), 0
+
+
+class ParallelCopyIngestion:
+    """
+    Streams pre-encoded CSV payloads to PostgreSQL with COPY over several connections at once,
+    then merges them into a dataset of 'users_data' on the natural key, over the same connections.
+
+    Each payload is a (row count, CSV text) pair, typically one shard of a file parsed in another
+    process. Payloads are handed to whichever connection is free and copied into an unlogged
+    staging table shared by all connections, so parsing, encoding and the database writes of
+    different shards overlap. The staging table is then split in one bucket of natural keys per
+    connection and the buckets are merged concurrently: every copy of a key is in the same bucket,
+    so the merges never wait on each other's unique keys.
+    """
+    name = "parallel"
+
+    def __init__(self, staging_table: str | None = None, dataset_id: int = DEFAULT_DATASET_ID) -> None:
+        self.staging_table = staging_table or f"users_data_staging_{uuid4().hex}"
+        self.dataset_id = dataset_id
+
+    def ingest(
+        self,
+        connections: List,
+        payloads: Iterable[Tuple[int, str]],
+        on_batch: Callable[[IngestionStats], None] | None = None
+    ) -> IngestionStats:
+        """
+        Copies all payloads into the staging table, then upserts it into the dataset_id partition of 'users_data'.
+
+        Each connection merges its bucket in a transaction of its own, and the merges are committed
+        only once all of them succeeded; if any fails, all are rolled back. The commits themselves
+        are not atomic: if a connection is lost between two of them, the buckets committed before it
+        stay merged. Uploading the file again merges the rest, since unchanged rows are skipped.
+
+        The staging table is always dropped. While it exists, the first connection holds an advisory
+        lock on its name, which drop_orphaned_staging_tables uses to tell tables left behind by a
+        process that died apart from the ones in use.
+
+        Args:
+            connections (List): Open psycopg2 connections, one writer thread each. The first one also
+                creates, locks and drops the staging table.
+            payloads (Iterable[Tuple[int, str]]): The row counts and CSV texts, in USERS_DATA_COLUMNS order.
+            on_batch (Callable[[IngestionStats], None] | None, optional): Called with the running stats after
+                each payload. It may raise IngestionCancelled to abort the ingestion. Defaults to None.
+
+        Returns:
+            IngestionStats: The number of rows copied, inserted and updated, and the elapsed time.
+        """
+        stats = IngestionStats(engine=self.name)
+        started_at = time.perf_counter()
+        main_connection = connections[0]
+        table = sql.Identifier(self.staging_table)
+        with main_connection.cursor() as cursor:
+            cursor.execute(LOCK_STAGING_TABLE_QUERY, (self.staging_table,))
+        main_connection.commit()
+
+        cursors = []
+        pending = {}
+
+        def collect(done) -> None:
+            for future in done:
+                free_cursors.append(pending.pop(future))
+                stats.rows += future.result()
+                stats.batches += 1
+                if on_batch:
+                    stats.elapsed_seconds = time.perf_counter() - started_at
+                    on_batch(stats)
+
+        try:
+            with main_connection.cursor() as cursor:
+                cursor.execute(sql.SQL(CREATE_UNLOGGED_STAGING_TABLE_QUERY).format(table=table))
+            main_connection.commit()
+            copy_query = sql.SQL(COPY_STAGING_QUERY).format(table=table).as_string(main_connection)
+            cursors = [connection.cursor() for connection in connections]
+            free_cursors = list(cursors)
+            with ThreadPoolExecutor(max_workers=len(cursors), thread_name_prefix="copy") as executor:
+                try:
+                    for rows, payload in payloads:
+                        if not free_cursors:
+                            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                            collect(done)
+                        cursor = free_cursors.pop()
+                        pending[executor.submit(self._copy, cursor, copy_query, rows, payload)] = cursor
+                    while pending:
+                        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        collect(done)
+                finally:
+                    wait(pending)
+                with stage("ingest.merge"):
+                    merges = [
+                        executor.submit(
+                            upsert_from_staging, cursor, self.staging_table, self.dataset_id, (len(cursors), bucket)
+                        )
+                        for bucket, cursor in enumerate(cursors)
+                    ]
+                    wait(merges)
+            for merge in merges:
+                inserted, updated = merge.result()
+                stats.rows_inserted += inserted
+                stats.rows_updated += updated
+            for connection in connections:
+                connection.commit()
+        except Exception:
+            for connection in connections:
+                connection.rollback()
+            raise
+        finally:
+            for cursor in cursors:
+                cursor.close()
+            self._release_staging_table(main_connection)
+        stats.elapsed_seconds = time.perf_counter() - started_at
+        logging.info(
+            "Ingested %s rows in %s shards over %s connections (%.0f rows/s)",
+            stats.rows, stats.batches, len(connections), stats.rows_per_second
+        )
+        return stats
+
+    @staticmethod
+    def _copy(cursor, copy_query: str, rows: int, payload: str) -> int:
+        cursor.copy_expert(copy_query, StringIO(payload))
+        cursor.connection.commit()
+        return rows
+
+    def _release_staging_table(self, connection) -> None:
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(sql.SQL(DROP_STAGING_TABLE_QUERY).format(table=sql.Identifier(self.staging_table)))
+            connection.commit()
+        except Exception as error:
+            connection.rollback()
+            logging.error("Failed to drop staging table %s. Error: %s", self.staging_table, error)
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(UNLOCK_STAGING_TABLE_QUERY, (self.staging_table,))
+            connection.commit()
+        except Exception as error:
+            connection.rollback()
+            logging.error("Failed to unlock staging table %s. Error: %s", self.staging_table, error)
+
+
+def drop_orphaned_staging_tables(connection) -> List[str]:
+    """
+    Drops the staging tables of ParallelCopyIngestion left behind by a process that died while
+    ingesting, i.e. the ones whose advisory lock is not held by any session.
+
+    Args:
+        connection: An open psycopg2 connection.
+
+    Returns:
+        List[str]: The names of the tables dropped.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(SELECT_STAGING_TABLES_QUERY)
+        tables = [row[0] for row in cursor.fetchall()]
+    connection.commit()
+    dropped = []
+    for table in tables:
+        with connection.cursor() as cursor:
+            cursor.execute(TRY_LOCK_STAGING_TABLE_QUERY, (table,))
+            locked = cursor.fetchone()[0]
+        connection.commit()
+        if not locked:
+            continue
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(sql.SQL(DROP_STAGING_TABLE_QUERY).format(table=sql.Identifier(table)))
+            connection.commit()
+            dropped.append(table)
+        finally:
+            connection.rollback()
+            with connection.cursor() as cursor:
+                cursor.execute(UNLOCK_STAGING_TABLE_QUERY, (table,))
+            connection.commit()
+    return dropped
+
+
+INGESTION_ENGINES = {
+    UpsertIngestionEngine.name: UpsertIngestionEngine,
+    CopyIngestionEngine.name: CopyIngestionEngine,
+    InsertIngestionEngine.name: InsertIngestionEngine,
+}
+
+# Every engine name accepted for an upload. The parallel engine reads a spooled file instead of a row iterator.
+ENGINE_NAMES = (*INGESTION_ENGINES, ParallelCopyIngestion.name)
+
+
+
+def get_ingestion_engine(
+    name: str,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    dataset_id: int = DEFAULT_DATASET_ID
+) -> IngestionEngine:
+    """
+    Returns an ingestion engine instance by name.
+
+    Args:
+        name (str): The engine name, one of INGESTION_ENGINES.
+        batch_size (int, optional): The number of rows sent per batch. Defaults to DEFAULT_BATCH_SIZE.
+        dataset_id (int, optional): The dataset the rows are written to. Defaults to DEFAULT_DATASET_ID.
+
+    Returns:
+        IngestionEngine: The requested engine.
+
+    Raises:
+        ValueError: If the engine name is unknown.
+    """
+    try:
+        engine_class = INGESTION_ENGINES[name]
+    except KeyError as error:
+        raise ValueError(
+            f"Unknown ingestion engine '{name}'. Available engines: {', '.join(INGESTION_ENGINES)}"
+        ) from error
+    return engine_class(batch_size, dataset_id)
@@ -1,32 +1,140 @@
-import os
 import logging
-import psycopg2
-from typing import List, Tuple
+from contextlib import contextmanager
+from uuid import uuid4
+from typing import AsyncIterator, Callable, Dict, Iterable, Iterator, List, Sequence, Tuple, TypeVar
 from fastapi import HTTPException
+import psycopg2
+from psycopg2 import errors, sql
+from psycopg2.extras import execute_values
 
 from ...models.payloads.csv_uploader import AddItemPayload
 
 from ..db_connection_handler import DbConnectionHandler
+from ..connection_pool import ConnectionPool, PoolTimeoutError, get_pool
+from ..query_cache import QueryCache, get_query_cache
+
+from .bulk_ingestion import (
+    DEFAULT_BATCH_SIZE,
+    IngestionCancelled,
+    IngestionStats,
+    ParallelCopyIngestion,
+    drop_orphaned_staging_tables,
+    get_ingestion_engine,
+)
+from .search import SEARCH_FUZZY_THRESHOLD, build_search_query
+from .datasets import (
+    DATASET_DROP_LOCK_TIMEOUT,
+    DATASET_MAX_COUNT,
+    DEFAULT_DATASET_ID,
+    lock_timeout,
+    partition_name,
+    partition_table,
+)
+from .group_commit import GROUP_COMMIT_ENABLED, WriteCoalescer
+from .filters import (
+    InvalidFilterError,
+    Predicate,
+    build_page_query,
+    build_range_query,
+    build_where_clause,
+    make_predicate,
+)
+from .pagination import COUNT_MODES, Cursor, InvalidCursorError, Page, decode_cursor, encode_cursor
+from .querys import (
+    BULK_DELETE_USERS_DATA_QUERY,
+    BULK_INSERT_USERS_DATA_QUERY,
+    BULK_UPDATE_USERS_DATA_QUERY,
+    COMPACT_USERS_DATA_ROW_COUNT_QUERY,
+    COUNT_DATASETS_QUERY,
+    COUNT_DATASET_ESTIMATE_QUERY,
+    COUNT_DATASET_EXACT_QUERY,
+    COUNT_DATASET_MAINTAINED_QUERY,
+    COUNT_USERS_DATA_ESTIMATE_QUERY,
+    COUNT_USERS_DATA_EXACT_QUERY,
+    COUNT_USERS_DATA_MAINTAINED_QUERY,
+    COMPACT_USERS_DATA_STATS_QUERY,
+    CANCEL_INGESTION_JOB_QUERY,
+    CLAIM_INGESTION_JOB_QUERY,
+    CREATE_DATASET_PARTITION_QUERIES,
+    DELETE_DATASET_QUERY,
+    DELETE_DATASET_RECORDS_QUERIES,
+    DELETE_USERS_DATA_QUERY,
+    DROP_DATASET_PARTITION_QUERY,
+    FINISH_INGESTION_JOB_QUERY,
+    INSERT_DATASET_QUERY,
+    INSERT_INGESTED_FILE_QUERY,
+    INSERT_INGESTION_JOB_QUERY,
+    LOCK_DATASET_CREATION_QUERY,
+    NATURAL_KEY_COLUMNS,
+    REBUILD_USERS_DATA_STATS_QUERIES,
+    RENEW_INGESTION_JOB_LEASE_QUERY,
+    SELECT_DATASETS_QUERY,
+    SELECT_DATASET_IDS_BY_STATUS_QUERY,
+    SELECT_INGESTED_FILE_QUERY,
+    REQUEUE_INGESTION_JOB_QUERY,
+    REQUEUE_STALE_INGESTION_JOBS_QUERY,
+    SELECT_INGESTION_JOB_QUERY,
+    UPDATE_INGESTION_JOB_PROGRESS_QUERY,
+    SELECT_USERS_DATA_EXPORT_QUERY,
+    SELECT_USERS_DATA_STATS_QUERY,
+    SET_FUZZY_SEARCH_THRESHOLD_QUERY,
+    SET_LOCK_TIMEOUT_QUERY,
+    UPDATE_DATASET_STATUS_QUERY,
+)
+
+T = TypeVar("T")
+
+# Number of delta rows in users_data_row_count above which they are folded into one
+ROW_COUNT_COMPACTION_THRESHOLD = 1000
+
+# Number of delta rows in users_data_stats above which they are folded into one per bucket
+STATS_COMPACTION_THRESHOLD = 5000
 
-from ...utils import format_date
+EXPORT_CHUNK_SIZE = 5000
+
+DEFAULT_PAGE_SIZE = 10
+
+DEFAULT_PARALLEL_CONNECTIONS = 4
 
 
 class ResumeConnectionHandler(DbConnectionHandler):
-    def __init__(self):
+    def __init__(self, pool: ConnectionPool | None = None, cache: QueryCache | None = None):
         super().__init__()
+        self.pool = pool if pool is not None else get_pool()
+        self.cache = cache if cache is not None else get_query_cache()
+        self.group_commit = GROUP_COMMIT_ENABLED
+        self.insert_coalescer = WriteCoalescer("add_item", self._write_inserts, is_row_error=self.is_row_error)
+        self.update_coalescer = WriteCoalescer(
+            "update_item", self._write_updates, key=lambda row: row[:2], is_row_error=self.is_row_error
+        )
         self.cursor = None
         self.connection = None
 
+    async def _write_inserts(self, rows: List[Tuple]) -> List[Tuple | None]:
+        return await self._run(self._add_values_to_db, rows)
+
+    async def _write_updates(self, rows: List[Tuple]) -> List[Tuple | None]:
+        return await self._run(self._update_values_in_db, rows)
+
     async def __call__(self):
         await self.get_connection()
 
+    async def _run(self, func: Callable[..., T], *args) -> T:
+        """
+        Runs one of the blocking repository operations.
+
+        This handler runs it inline on the event loop; ThreadedResumeConnectionHandler overrides
+        it to run the operation in a worker thread instead.
+        """
+        return func(*args)
+
     async def get_connection(self) -> None:
         """
-        Asynchronously establishes a connection to the database.
+        Asynchronously borrows a connection from the connection pool and keeps it until close_connection is called.
 
-        This method attempts to connect to the database using the provided environment variables.
-        If a connection cannot be established, an HTTPException with a status code of 500 and
-        an error message is raised.
+        If no connection is available before the pool acquire timeout, an HTTPException with a status
+        code of 503 is raised. If a connection cannot be established, an HTTPException with a status
+        code of 500 and an error message is raised.
 
         Parameters:
             self (ResumeConnectionHandler): The instance of the ResumeConnectionHandler class.
@@ -38,27 +146,68 @@ class ResumeConnectionHandler(DbConnectionHandler):
             HTTPException: If a connection to the database cannot be established.
         """
         logging.info("Getting connection to database")
+        self.connection = await self._run(self.acquire_connection)
+        self.cursor = self.connection.cursor()
+
+    def acquire_connection(self):
+        """
+        Borrows a connection from the pool, translating pool errors into HTTPExceptions.
+
+        Raises:
+            HTTPException: 503 if the pool is exhausted, 500 if a connection cannot be established.
+        """
         try:
-            self.connection = psycopg2.connect(
-                host=os.environ.get("DB_HOST", "localhost"),
-                database=os.environ.get("POSTGRES_DB"),
-                user=os.environ.get("POSTGRES_USER"),
-                password=os.environ.get("POSTGRES_PASSWORD"),
-                port=os.environ.get("DB_PORT")
-            )
+            return self.pool.acquire()
+        except PoolTimeoutError as error:
+            logging.error("No database connection available.  Error: %s", error)
+            raise HTTPException(
+                    status_code=503,
+                    detail=f"No database connection available.  Error: {error}") from error
         except Exception as error:
-            logging.error("Failed to connect to database.  Error: %s", error)           
+            logging.error("Failed to connect to database.  Error: %s", error)
             raise HTTPException(
-                    status_code=500, 
+                    status_code=500,
                     detail=f"Failed to connect to database.  Error: {error}") from error
 
-        self.cursor = self.connection.cursor()
+    @contextmanager
+    def borrow_connection(self) -> Iterator:
+        """
+        Borrows a connection from the pool for the duration of a with block and gives it back afterwards.
+        """
+        connection = self.acquire_connection()
+        try:
+            yield connection
+        finally:
+            self.pool.release(connection)
+
+    @contextmanager
+    def borrow_connections(self, count: int) -> Iterator[List]:
+        """
+        Borrows up to count connections from the pool for the duration of a with block.
+
+        Only the first connection is waited for; the others are taken if the pool can provide them
+        right away, so a busy pool yields fewer connections instead of blocking other requests.
+        """
+        connections = [self.acquire_connection()]
+        try:
+            while len(connections) < count:
+                try:
+                    connections.append(self.pool.acquire(timeout=0))
+                except PoolTimeoutError:
+                    break
+                except Exception as error:
+                    logging.warning("Failed to open an extra database connection. Error: %s", error)
+                    break
+            yield connections
+        finally:
+            for connection in connections:
+                self.pool.release(connection)
 
     async def close_connection(self) -> None:
         """
-        Close the connection to the database.
+        Give the borrowed connection back to the connection pool.
 
-        This method closes the connection to the database and sets the connection and cursor attributes to None.
+        This method closes the cursor, releases the connection to the pool and sets the connection and cursor attributes to None.
 
         Parameters:
             self (ResumeConnectionHandler): The instance of the ResumeConnectionHandler class.
@@ -66,88 +215,371 @@ class ResumeConnectionHandler(DbConnectionHandler):
         Returns:
             None: This method does not return anything.
         """
-        if self.connection:
-            self.connection.close()
-            self.connection = None
-
         if self.cursor:
             self.cursor.close()
             self.cursor = None
 
-    async def save_csv_file(self, data) -> None:
+        if self.connection:
+            await self._run(self.pool.release, self.connection)
+            self.connection = None
+
+    async def warm_up(self) -> int:
         """
-        Asynchronously saves a CSV file into the 'users_data' table in the database.
+        Asynchronously opens the minimum connections of the pool and plans the most frequent
+        queries on each of them.
 
-        Args:
-            data (List[List[str]]): The data to be inserted into the table. Each row should be a list of values in the order: nome, data_nascimento, genero, nacionalidade, data_criacao, data_atualizacao.
+        Planning a query loads the catalog entries of its tables, indexes and functions into the
+        caches of the server process behind the connection, which the first query of each new
+        connection otherwise pays for while a client waits.
 
         Returns:
-            None: This function does not return anything.
+            int: The number of connections warmed up.
 
         Raises:
-            HTTPException: If there is an error while saving the CSV file.
+            HTTPException: If the connections cannot be opened.
+        """
+        return await self._run(self._warm_up)
+
+    def _warm_up(self) -> int:
+        try:
+            self.pool.open()
+        except Exception as error:
+            logging.error("Failed to open database connections.  Error: %s", error)
+            raise HTTPException(
+                    status_code=500,
+                    detail=f"Failed to open database connections.  Error: {error}") from error
+        return self.pool.warm_up(self._plan_hot_queries)
 
+    @staticmethod
+    def _plan_hot_queries(connection) -> None:
+        default_dataset = [Predicate(column="dataset_id", operator="eq", value=DEFAULT_DATASET_ID)]
+        statements = [
+            (sql.SQL(SELECT_DATASETS_QUERY).format(where=sql.SQL("TRUE")), None),
+            build_page_query(default_dataset, 1, DEFAULT_PAGE_SIZE),
+            build_page_query(default_dataset, 1, DEFAULT_PAGE_SIZE, Cursor(last_id=0)),
+            (COUNT_USERS_DATA_MAINTAINED_QUERY, None),
+            (SELECT_USERS_DATA_STATS_QUERY, None),
+            (SELECT_INGESTED_FILE_QUERY, ("",)),
+            build_search_query("a", "prefix", DEFAULT_PAGE_SIZE),
+            build_search_query("a", "substring", DEFAULT_PAGE_SIZE),
+        ]
+        with connection.cursor() as cursor:
+            for query, params in statements:
+                if isinstance(query, str):
+                    query = sql.SQL(query)
+                try:
+                    cursor.execute(sql.SQL("EXPLAIN {}").format(query), params)
+                except errors.Error as error:
+                    if connection.closed:
+                        raise
+                    # A missing migration only leaves its queries cold
+                    logging.warning("Failed to plan query while warming up. Error: %s", error)
+                connection.rollback()
+
+    async def save_csv_file(
+        self,
+        rows: Iterable[Sequence],
+        engine: str = "upsert",
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        on_batch: Callable[[IngestionStats], None] | None = None,
+        dataset_id: int = DEFAULT_DATASET_ID
+    ) -> IngestionStats:
         """
-        logging.info("Saving CSV file into DataBase")
-        insert_query = """
-            INSERT INTO users_data (nome, data_nascimento, genero, nacionalidade, data_criacao, data_atualizacao)
-            VALUES (%s, %s, %s, %s, %s, %s)
+        Asynchronously saves a CSV file into a dataset of the 'users_data' table in the database.
+
+        The rows are consumed lazily, written in batches by the selected ingestion engine and
+        committed in a single transaction, so a failure leaves the table untouched.
+
+        Args:
+            rows (Iterable[Sequence]): The normalized rows to be inserted into the table. Each row should hold the values in the order: nome, data_nascimento, genero, nacionalidade, data_criacao, data_atualizacao.
+            engine (str, optional): The ingestion engine, "upsert", "copy" or "insert". Defaults to "upsert".
+            batch_size (int, optional): The number of rows sent to the database per batch. Defaults to DEFAULT_BATCH_SIZE.
+            on_batch (Callable[[IngestionStats], None] | None, optional): Called with the running stats after each batch,
+                in the thread running the ingestion. Defaults to None.
+            dataset_id (int, optional): The dataset the rows are written to. Defaults to DEFAULT_DATASET_ID.
+
+        Returns:
+            IngestionStats: The number of rows written, the elapsed time and the throughput.
+
+        Raises:
+            IngestionCancelled: If on_batch cancelled the ingestion.
+            HTTPException: If the engine is unknown or there is an error while saving the CSV file.
+
         """
+        return await self._run(self._save_csv_file, rows, engine, batch_size, on_batch, dataset_id)
+
+    def _save_csv_file(
+        self,
+        rows: Iterable[Sequence],
+        engine: str,
+        batch_size: int,
+        on_batch: Callable[[IngestionStats], None] | None,
+        dataset_id: int
+    ) -> IngestionStats:
+        logging.info("Saving CSV file into dataset %s", dataset_id)
         try:
-            for row in data[1:]:
-                nome, data_nascimento, genero, nacionalidade, data_criacao, data_atualizacao = row
-                data_nascimento = format_date(data_nascimento)
-                self.cursor.execute(insert_query, (nome, data_nascimento, genero, nacionalidade, data_criacao, data_atualizacao))
-                self.connection.commit()
-        except Exception as error:
-            raise HTTPException(status_code=500, detail=f"Failed to save CSV file. Error: {error}") from error
-        return None
+            ingestion_engine = get_ingestion_engine(engine, batch_size, dataset_id)
+        except ValueError as error:
+            raise HTTPException(status_code=400, detail=str(error)) from error
 
-    async def get_all_values_with_pagination(self, page_number: int, page_size: int) -> List[Tuple] | int:
+        with self.borrow_connection() as connection:
+            try:
+                stats = ingestion_engine.ingest(connection, rows, on_batch)
+                self.cache.invalidate([dataset_id])
+            except IngestionCancelled:
+                logging.info("CSV file ingestion cancelled")
+                raise
+            except Exception as error:
+                logging.error("Failed to save CSV file. Error: %s", error)
+                raise HTTPException(status_code=500, detail=f"Failed to save CSV file. Error: {error}") from error
+        return stats
+
+    async def save_csv_shards(
+        self,
+        payloads: Iterable[Tuple[int, str]],
+        connections: int = DEFAULT_PARALLEL_CONNECTIONS,
+        on_batch: Callable[[IngestionStats], None] | None = None,
+        dataset_id: int = DEFAULT_DATASET_ID
+    ) -> IngestionStats:
         """
-        Asynchronously retrieves all values from the 'users_data' table in the database with pagination.
-        Also retrieves the total number of items in the table.
+        Asynchronously saves pre-encoded CSV shards into a dataset of the 'users_data' table over several connections.
 
         Args:
-            page_number (int): The page number to retrieve values from.
-            page_size (int): The number of items per page.
+            payloads (Iterable[Tuple[int, str]]): The row count and COPY-ready CSV text of each shard.
+            connections (int, optional): The maximum number of connections written to at once. Defaults to DEFAULT_PARALLEL_CONNECTIONS.
+            on_batch (Callable[[IngestionStats], None] | None, optional): Called with the running stats after each shard,
+                in the thread running the ingestion. Defaults to None.
+            dataset_id (int, optional): The dataset the rows are written to. Defaults to DEFAULT_DATASET_ID.
 
         Returns:
-            dict: A dictionary containing:
-                - 'total_count': The total number of items in the table.
-                - 'items': A list of tuples representing the rows of the 'users_data' table for the requested page.
+            IngestionStats: The number of rows written, the elapsed time and the throughput.
 
         Raises:
-            HTTPException: If there is an error while retrieving the values.
+            IngestionCancelled: If on_batch cancelled the ingestion.
+            HTTPException: If there is an error while saving the shards.
         """
-        offset = (page_number - 1) * page_size
-        
-        select_query = """
-            SELECT * FROM users_data
-            OFFSET %s
-            LIMIT %s
+        return await self._run(self._save_csv_shards, payloads, connections, on_batch, dataset_id)
+
+    def _save_csv_shards(
+        self,
+        payloads: Iterable[Tuple[int, str]],
+        connections: int,
+        on_batch: Callable[[IngestionStats], None] | None,
+        dataset_id: int
+    ) -> IngestionStats:
+        logging.info("Saving CSV file into dataset %s in parallel", dataset_id)
+        with self.borrow_connections(connections) as borrowed:
+            try:
+                stats = ParallelCopyIngestion(dataset_id=dataset_id).ingest(borrowed, payloads, on_batch)
+                self.cache.invalidate([dataset_id])
+            except IngestionCancelled:
+                logging.info("CSV file ingestion cancelled")
+                raise
+            except Exception as error:
+                logging.error("Failed to save CSV file. Error: %s", error)
+                raise HTTPException(status_code=500, detail=f"Failed to save CSV file. Error: {error}") from error
+        return stats
+
+    async def drop_orphaned_staging_tables(self) -> List[str]:
         """
-        
-        count_query = """
-            SELECT COUNT(*) FROM users_data
+        Asynchronously drops the staging tables of parallel ingestions whose process died before dropping them.
+
+        Returns:
+            List[str]: The names of the tables dropped.
+
+        Raises:
+            HTTPException: If there is an error while dropping the tables.
         """
-        
+        return await self._run(self._drop_orphaned_staging_tables)
+
+    def _drop_orphaned_staging_tables(self) -> List[str]:
+        with self.borrow_connection() as connection:
+            try:
+                return drop_orphaned_staging_tables(connection)
+            except Exception as error:
+                logging.error("Failed to drop orphaned staging tables. Error: %s", error)
+                raise HTTPException(
+                    status_code=500, detail=f"Failed to drop orphaned staging tables. Error: {error}"
+                ) from error
+
+    async def get_all_values_with_pagination(
+        self,
+        page_number: int,
+        page_size: int,
+        cursor: str | None = None,
+        count_mode: str = "maintained",
+        dataset_id: int | None = None
+    ) -> Page:
+        """
+        Asynchronously retrieves all values from the 'users_data' table in the database with pagination, ordered by
+        dataset and then by id. Also retrieves the total number of items in the table.
+
+        With a dataset_id only the partition of that dataset is read, and counted. Otherwise the datasets are
+        read one after the other, each with a query pruned to its partition, so a page does not read every
+        partition however many datasets there are.
+
+        When a cursor is given the page is read with a keyset condition on id, so its cost does not depend
+        on how deep the page is. Without a cursor the page_number is used with OFFSET, which is cheap for
+        the first pages only.
+
+        Args:
+            page_number (int): The page number to retrieve values from. Ignored when a cursor is given.
+            page_size (int): The number of items per page.
+            cursor (str | None, optional): An opaque cursor taken from a previous Page. Defaults to None.
+            count_mode (str, optional): How the total is computed: "maintained" reads the trigger-maintained
+                counter, "estimate" reads the planner statistics and "exact" runs COUNT(*). Defaults to "maintained".
+            dataset_id (int | None, optional): Only list the items of this dataset. Defaults to None.
+
+        Returns:
+            Page: The rows of the requested page, the total number of items and the cursors of the next and previous pages.
+
+        Raises:
+            HTTPException: If the cursor or count mode is invalid, or there is an error while retrieving the values.
+        """
+        if count_mode not in COUNT_MODES:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Invalid count mode '{count_mode}'. Available modes: {', '.join(COUNT_MODES)}"
+            )
+        decoded_cursor = self._decode_cursor(cursor)
+        return await self._run(
+            self._get_all_values_with_pagination, page_number, page_size, decoded_cursor, count_mode, dataset_id
+        )
+
+    def _get_all_values_with_pagination(
+        self,
+        page_number: int,
+        page_size: int,
+        cursor: Cursor | None,
+        count_mode: str,
+        dataset_id: int | None
+    ) -> Page:
+        # The page and the total are cached separately, so every page of the listing shares one count
+        generation = self.cache.generation(dataset_id)
+        count_key = repr(("count", count_mode, dataset_id))
+        page_key = repr(("all", page_number, page_size, cursor, dataset_id))
+        predicates = [Predicate(column="dataset_id", operator="eq", value=dataset_id)] if dataset_id is not None else []
+        total_count = self.cache.get(count_key)
+        page = self.cache.get(page_key)
+        if total_count is None or page is None:
+            with self.borrow_connection() as connection:
+                try:
+                    with connection.cursor() as db_cursor:
+                        if total_count is None:
+                            # Retrieve the total number of items
+                            total_count = self._count_values(connection, db_cursor, count_mode, dataset_id)
+                            self.cache.set(count_key, total_count, generation, dataset_id)
+
+                        if page is None:
+                            # Retrieve the paginated data
+                            if dataset_id is None:
+                                page = self._fetch_dataset_page(db_cursor, page_number, page_size, cursor)
+                            else:
+                                page = self._fetch_page(db_cursor, predicates, page_number, page_size, cursor)
+                            self.cache.set(page_key, page, generation, dataset_id)
+
+                except Exception as error:
+                    logging.error("Failed to get all values. Error: %s", error)
+                    raise HTTPException(status_code=500, detail=f"Failed to get all values. Error: {error}") from error
+
+        page.total_count = total_count
+        return page
+
+    @staticmethod
+    def _decode_cursor(cursor: str | None) -> Cursor | None:
         try:
-            # Retrieve the total number of items
-            self.cursor.execute(count_query)
-            total_count = self.cursor.fetchone()[0]
-            
-            # Retrieve the paginated data
-            self.cursor.execute(select_query, (offset, page_size))
-            items = self.cursor.fetchall()
-            
-        except Exception as error:
-            logging.error("Failed to get all values. Error: %s", error)
-            raise HTTPException(status_code=500, detail=f"Failed to get all values. Error: {error}") from error
+            return decode_cursor(cursor) if cursor else None
+        except InvalidCursorError as error:
+            raise HTTPException(status_code=400, detail=str(error)) from error
 
-        return items, total_count
+    @classmethod
+    def _fetch_page(cls, db_cursor, predicates: List[Predicate], page_number: int, page_size: int, cursor: Cursor | None) -> Page:
+        """
+        Reads one page of rows ordered by id and builds the cursors of the neighbouring pages.
+        """
+        query, params = build_page_query(predicates, page_number, page_size, cursor)
+        db_cursor.execute(query, params)
+        return cls._build_page(db_cursor.fetchall(), page_number, page_size, cursor)
 
-    
+    @classmethod
+    def _fetch_dataset_page(cls, db_cursor, page_number: int, page_size: int, cursor: Cursor | None) -> Page:
+        """
+        Reads one page of the rows of every dataset, ordered by dataset and then by id. Each dataset the
+        page reaches is read with a query of its own, whose dataset_id is a literal so only its partition
+        is planned and read. Without a cursor, the datasets before the page are skipped by their
+        maintained row counts.
+        """
+        descending = cursor is not None and cursor.direction == "prev"
+        db_cursor.execute(sql.SQL(SELECT_DATASETS_QUERY).format(where=sql.SQL("TRUE")))
+        datasets = [(dataset[0], dataset[5]) for dataset in db_cursor.fetchall()]
+        if descending:
+            datasets = [dataset for dataset in reversed(datasets) if dataset[0] <= cursor.dataset_id]
+        elif cursor is not None:
+            datasets = [dataset for dataset in datasets if dataset[0] >= cursor.dataset_id]
+
+        offset = 0 if cursor is not None else (page_number - 1) * page_size
+        items = []
+        for dataset_id, rows in datasets:
+            if offset and offset >= rows:
+                offset -= rows
+                continue
+            bound_id = cursor.last_id if cursor is not None and dataset_id == cursor.dataset_id else None
+            query, params = build_range_query(
+                [Predicate(column="dataset_id", operator="eq", value=dataset_id)],
+                page_size + 1 - len(items), offset, bound_id, descending
+            )
+            db_cursor.execute(query, params)
+            items.extend(db_cursor.fetchall())
+            offset = 0
+            if len(items) > page_size:
+                break
+        return cls._build_page(items, page_number, page_size, cursor)
+
+    @staticmethod
+    def _build_page(items: List[Tuple], page_number: int, page_size: int, cursor: Cursor | None) -> Page:
+        """
+        Builds a page from its rows, read with one extra row to tell whether there is another page,
+        and the cursors of the neighbouring pages. An item ends with its dataset_id.
+        """
+        has_more = len(items) > page_size
+        items = items[:page_size]
+        if cursor is not None and cursor.direction == "prev":
+            items.reverse()
+            has_next, has_prev = True, has_more
+        else:
+            has_next, has_prev = has_more, cursor is not None or page_number > 1
+
+        page = Page(items=items)
+        if items and has_next:
+            page.next_cursor = encode_cursor(Cursor(last_id=items[-1][0], direction="next", dataset_id=items[-1][-1]))
+        if items and has_prev:
+            page.prev_cursor = encode_cursor(Cursor(last_id=items[0][0], direction="prev", dataset_id=items[0][-1]))
+        return page
+
+    @staticmethod
+    def _count_values(connection, cursor, count_mode: str, dataset_id: int | None = None) -> int:
+        if count_mode == "exact":
+            if dataset_id is None:
+                cursor.execute(COUNT_USERS_DATA_EXACT_QUERY)
+            else:
+                cursor.execute(COUNT_DATASET_EXACT_QUERY, (dataset_id,))
+            return cursor.fetchone()[0]
+        if count_mode == "estimate":
+            if dataset_id is None:
+                cursor.execute(COUNT_USERS_DATA_ESTIMATE_QUERY)
+            else:
+                cursor.execute(COUNT_DATASET_ESTIMATE_QUERY, (partition_name(dataset_id),))
+            return cursor.fetchone()[0]
+
+        if dataset_id is None:
+            cursor.execute(COUNT_USERS_DATA_MAINTAINED_QUERY)
+        else:
+            cursor.execute(COUNT_DATASET_MAINTAINED_QUERY, (dataset_id,))
+        total_count, delta_rows = cursor.fetchone()
+        if delta_rows > ROW_COUNT_COMPACTION_THRESHOLD:
+            cursor.execute(COMPACT_USERS_DATA_ROW_COUNT_QUERY)
+            connection.commit()
+        return total_count
 
     async def get_all_values(self) -> List[Tuple]:
         """
@@ -159,125 +591,864 @@ class ResumeConnectionHandler(DbConnectionHandler):
         Raises:
             HTTPException: If there is an error while retrieving the values.
         """
+        return await self._run(self._get_all_values)
+
+    def _get_all_values(self) -> List[Tuple]:
         select_query = """
             SELECT * FROM users_data
         """
-        try:
-            self.cursor.execute(select_query)
-            result = self.cursor.fetchall()
-        except Exception as error:
-            logging.error("Failed to get all values. Error: %s", error)
-            raise HTTPException(status_code=500, detail=f"Failed to get all values. Error: {error}") from error
+        with self.borrow_connection() as connection:
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute(select_query)
+                    result = cursor.fetchall()
+            except Exception as error:
+                logging.error("Failed to get all values. Error: %s", error)
+                raise HTTPException(status_code=500, detail=f"Failed to get all values. Error: {error}") from error
         return result
-    
-  
-    async def get_filtered_value(self, field_name: str, field_value: str, page: int = 1) -> List[Tuple]:
+
+    async def stream_all_values(
+        self,
+        chunk_size: int = EXPORT_CHUNK_SIZE,
+        predicates: List[Predicate] | None = None
+    ) -> AsyncIterator[List[Tuple]]:
+        """
+        Asynchronously streams all values from the 'users_data' table through a named server-side cursor.
+
+        Only chunk_size rows are held in memory at a time, and the borrowed connection is given back
+        to the pool when the iteration ends or is abandoned.
+
+        Args:
+            chunk_size (int, optional): The number of rows fetched per round trip. Defaults to EXPORT_CHUNK_SIZE.
+            predicates (List[Predicate] | None, optional): Only stream the rows matching all of them. Defaults to None.
+
+        Returns:
+            AsyncIterator[List[Tuple]]: Lists of at most chunk_size rows, without the 'id' column.
+
+        Raises:
+            HTTPException: If there is an error while retrieving the values.
+        """
+        connection = await self._run(self.acquire_connection)
+        try:
+            try:
+                db_cursor = connection.cursor(name=f"export_{uuid4().hex}")
+                db_cursor.itersize = chunk_size
+                where, params = build_where_clause(predicates or [])
+                query = sql.SQL(SELECT_USERS_DATA_EXPORT_QUERY).format(where=where)
+                await self._run(db_cursor.execute, query, params)
+                while True:
+                    rows = await self._run(db_cursor.fetchmany, chunk_size)
+                    if not rows:
+                        break
+                    yield rows
+                await self._run(db_cursor.close)
+            except Exception as error:
+                logging.error("Failed to stream all values. Error: %s", error)
+                raise HTTPException(status_code=500, detail=f"Failed to stream all values. Error: {error}") from error
+        finally:
+            await self._run(self.pool.release, connection)
+
+    async def get_filtered_value(
+        self,
+        field_name: str,
+        field_value: str,
+        page: int = 1,
+        page_size: int = DEFAULT_PAGE_SIZE,
+        cursor: str | None = None,
+        dataset_id: int | None = None
+    ) -> Page:
         """
         Asynchronously retrieves filtered values from the repository based on the given field name and value, with pagination.
 
         Args:
-            field_name (str): The name of the field to filter by.
+            field_name (str): The name of the field to filter by, one of FILTERABLE_COLUMNS.
             field_value (str): The value to filter by.
-            page (int, optional): The page number to retrieve. Defaults to 1.
-            limit (int, optional): The maximum number of items per page. Defaults to 5.
+            page (int, optional): The page number to retrieve. Ignored when a cursor is given. Defaults to 1.
+            page_size (int, optional): The maximum number of items per page. Defaults to DEFAULT_PAGE_SIZE.
+            cursor (str | None, optional): An opaque cursor taken from a previous Page. Defaults to None.
+            dataset_id (int | None, optional): Only read the partition of this dataset. Defaults to None, every
+                dataset, except for an id, which is looked up in the default dataset like the other id routes.
 
         Returns:
-            List[Tuple]: A list of tuples representing the filtered rows from the 'users_data' table, paginated.
+            Page: The filtered rows from the 'users_data' table for the requested page, and the page cursors.
+
+        Raises:
+            HTTPException: If the filter or cursor is invalid, or there is an error while retrieving the values.
         """
-        select_query = f"""
-            SELECT * FROM users_data
-            WHERE {field_name} = '{field_value}'
+        if dataset_id is None and field_name == "id":
+            dataset_id = DEFAULT_DATASET_ID
+        try:
+            predicates = [make_predicate(field_name, "eq", field_value)]
+            if dataset_id is not None:
+                predicates.append(make_predicate("dataset_id", "eq", dataset_id))
+        except InvalidFilterError as error:
+            raise HTTPException(status_code=400, detail=str(error)) from error
+        return await self.filter_values(predicates, page, page_size, cursor)
+
+    async def filter_values(
+        self,
+        predicates: List[Predicate],
+        page: int = 1,
+        page_size: int = DEFAULT_PAGE_SIZE,
+        cursor: str | None = None
+    ) -> Page:
         """
-        try: 
-            self.cursor.execute(select_query)
-            result = self.cursor.fetchall()
-        except Exception as error:
-            logging.error("Failed to get filtered value. Error: %s", error)
-            raise HTTPException(status_code=500, detail=f"Failed to get filtered value. Error: {error}") from error
+        Asynchronously retrieves the values matching all the predicates, ordered by id and paginated.
+
+        The predicates are validated against FILTERABLE_COLUMNS and their values are sent as query
+        parameters, so the filters can use the indexes on the filterable columns.
+
+        Args:
+            predicates (List[Predicate]): The conditions, combined with AND.
+            page (int, optional): The page number to retrieve. Ignored when a cursor is given. Defaults to 1.
+            page_size (int, optional): The maximum number of items per page. Defaults to DEFAULT_PAGE_SIZE.
+            cursor (str | None, optional): An opaque cursor taken from a previous Page. Defaults to None.
+
+        Returns:
+            Page: The matching rows for the requested page, and the page cursors.
+
+        Raises:
+            HTTPException: If the cursor is invalid or there is an error while retrieving the values.
+        """
+        decoded_cursor = self._decode_cursor(cursor)
+        return await self._run(self._cached_filter_values, predicates, page, page_size, decoded_cursor)
+
+    def _cached_filter_values(self, predicates: List[Predicate], page: int, page_size: int, cursor: Cursor | None) -> Page:
+        # Filters on a single dataset are only invalidated by the writes to that dataset
+        dataset_id = next(
+            (predicate.value for predicate in predicates if predicate.column == "dataset_id" and predicate.operator == "eq"),
+            None
+        )
+        generation = self.cache.generation(dataset_id)
+        key = repr(("filter", predicates, page, page_size, cursor))
+        result = self.cache.get(key)
+        if result is None:
+            result = self._filter_values(predicates, page, page_size, cursor)
+            self.cache.set(key, result, generation, dataset_id)
+        return result
+
+    def _filter_values(self, predicates: List[Predicate], page: int, page_size: int, cursor: Cursor | None) -> Page:
+        with self.borrow_connection() as connection:
+            try:
+                with connection.cursor() as db_cursor:
+                    result = self._fetch_page(db_cursor, predicates, page, page_size, cursor)
+            except Exception as error:
+                logging.error("Failed to get filtered value. Error: %s", error)
+                raise HTTPException(status_code=500, detail=f"Failed to get filtered value. Error: {error}") from error
+        return result
+
+    async def search_values(self, text: str, mode: str, limit: int) -> List[Tuple]:
+        """
+        Asynchronously searches users_data by nome, ignoring case and accents, with the trigram
+        and prefix indexes of database/migrations/01_name_search.sql.
+
+        Args:
+            text (str): The text to search for.
+            mode (str): One of SEARCH_MODES: "prefix", "substring" or "fuzzy".
+            limit (int): The maximum number of results.
+
+        Returns:
+            List[Tuple]: The matching items, best matches first.
+
+        Raises:
+            HTTPException: If there is an error while searching.
+        """
+        return await self._run(self._cached_search_values, text, mode, limit)
+
+    def _cached_search_values(self, text: str, mode: str, limit: int) -> List[Tuple]:
+        generation = self.cache.generation()
+        key = repr(("search", text, mode, limit))
+        result = self.cache.get(key)
+        if result is None:
+            result = self._search_values(text, mode, limit)
+            self.cache.set(key, result, generation)
+        return result
+
+    def _search_values(self, text: str, mode: str, limit: int) -> List[Tuple]:
+        query, params = build_search_query(text, mode, limit)
+        with self.borrow_connection() as connection:
+            try:
+                with connection.cursor() as cursor:
+                    if mode == "fuzzy":
+                        cursor.execute(SET_FUZZY_SEARCH_THRESHOLD_QUERY, (str(SEARCH_FUZZY_THRESHOLD),))
+                    cursor.execute(query, params)
+                    result = cursor.fetchall()
+            except Exception as error:
+                logging.error("Failed to search values. Error: %s", error)
+                raise HTTPException(status_code=500, detail=f"Failed to search values. Error: {error}") from error
+        return result
+
+    async def get_stats(self) -> Dict[str, Dict[str | None, int]]:
+        """
+        Asynchronously retrieves the row counts of users_data by dimension and bucket from the
+        trigger-maintained users_data_stats table, folding its deltas when they pile up.
+
+        Returns:
+            Dict[str, Dict[str | None, int]]: The count of every non-empty bucket, by dimension
+                (nacionalidade, genero, birth_year and data_criacao).
+
+        Raises:
+            HTTPException: If there is an error while retrieving the stats.
+        """
+        return await self._run(self._cached_stats)
+
+    def _cached_stats(self) -> Dict[str, Dict[str | None, int]]:
+        generation = self.cache.generation()
+        key = repr(("stats",))
+        result = self.cache.get(key)
+        if result is None:
+            result = self._get_stats()
+            self.cache.set(key, result, generation)
         return result
-    
+
+    def _get_stats(self) -> Dict[str, Dict[str | None, int]]:
+        stats: Dict[str, Dict[str | None, int]] = {}
+        with self.borrow_connection() as connection:
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute(SELECT_USERS_DATA_STATS_QUERY)
+                    delta_rows = 0
+                    for dimension, bucket, count, rows in cursor.fetchall():
+                        delta_rows += rows
+                        if count:
+                            stats.setdefault(dimension, {})[bucket] = count
+                    if delta_rows > STATS_COMPACTION_THRESHOLD:
+                        cursor.execute(COMPACT_USERS_DATA_STATS_QUERY)
+                        connection.commit()
+            except Exception as error:
+                logging.error("Failed to get stats. Error: %s", error)
+                raise HTTPException(status_code=500, detail=f"Failed to get stats. Error: {error}") from error
+        return stats
+
+    async def rebuild_stats(self) -> int:
+        """
+        Asynchronously recomputes users_data_stats and users_data_row_count from users_data in one
+        transaction. Writes to users_data wait until it finishes; reads are not blocked.
+
+        Returns:
+            int: The number of rows in users_data.
+
+        Raises:
+            HTTPException: If there is an error while rebuilding the stats.
+        """
+        return await self._run(self._rebuild_stats)
+
+    def _rebuild_stats(self) -> int:
+        with self.borrow_connection() as connection:
+            try:
+                with connection.cursor() as cursor:
+                    for query in REBUILD_USERS_DATA_STATS_QUERIES:
+                        cursor.execute(query)
+                    cursor.execute(COUNT_USERS_DATA_MAINTAINED_QUERY)
+                    rows = cursor.fetchone()[0]
+                connection.commit()
+                self.cache.invalidate()
+            except Exception as error:
+                logging.error("Failed to rebuild stats. Error: %s", error)
+                raise HTTPException(status_code=500, detail=f"Failed to rebuild stats. Error: {error}") from error
+        return rows
+
+    @staticmethod
+    def is_row_error(error: Exception) -> bool:
+        """
+        Tells whether a failed write was caused by the values of one of its rows, a duplicate natural
+        key or an invalid value, rather than by the database, so writing the rows one by one isolates it.
+        """
+        if isinstance(error, HTTPException) and error.status_code == 409:
+            return True
+        row_errors = (errors.UniqueViolation, psycopg2.DataError)
+        return isinstance(error, row_errors) or isinstance(error.__cause__, row_errors)
+
+    @staticmethod
+    def duplicate_item_error(error: Exception | str) -> HTTPException:
+        logging.error("Item already exists. Error: %s", error)
+        return HTTPException(
+            status_code=409,
+            detail=f"An item with the same {', '.join(NATURAL_KEY_COLUMNS)} already exists"
+        )
 
     async def add_value_to_db(self, data: AddItemPayload) -> List[Tuple]:
-        insert_query = """
-            INSERT INTO users_data (nome, data_nascimento, genero, nacionalidade, data_criacao, data_atualizacao)
-            VALUES (%s, %s, %s, %s, %s, %s)
-            RETURNING id
         """
-        inserted_id = None
-        try:
-            self.cursor.execute(
-                insert_query,
-                (data.nome,
-                format_date(data.data_nascimento),
-                 data.genero,
-                 data.nacionalidade,
-                 format_date(data.data_criacao),
-                 format_date(data.data_atualizacao))
-            )
-            inserted_id = self.cursor.fetchone()[0]
-            self.connection.commit()
-        except Exception as error:
-            logging.error("Failed to add value to DB. Error: %s", error)
-            raise HTTPException(status_code=500, detail=f"Failed to add value to DB. Error: {error}") from error
+        Asynchronously inserts a row into the 'users_data' table and returns it.
+
+        Concurrent calls are group committed: they are inserted together, with a single statement
+        and a single commit, and each call returns once the row it inserted is committed.
+
+        Args:
+            data (AddItemPayload): The values of the row.
+
+        Returns:
+            List[Tuple]: A list holding the inserted row, with the 'id' field as the first element.
+
+        Raises:
+            HTTPException: 409 if an item with the same natural key exists, or if there is an
+                error while inserting the value.
+        """
+        row = data.to_row()
+        if self.group_commit:
+            item = await self.insert_coalescer.submit(row)
+        else:
+            item = (await self._run(self._add_values_to_db, [row]))[0]
+        if item is None:
+            raise self.duplicate_item_error(f"{data.nome} was skipped on conflict")
         logging.info("Value added to DB")
-        return await self.get_filtered_value("id", inserted_id)
-    
+        return [item]
 
-    async def update_value_in_db(self, data: AddItemPayload, item_id: int) -> List[Tuple]:
+    async def update_value_in_db(
+        self,
+        data: AddItemPayload,
+        item_id: int,
+        dataset_id: int = DEFAULT_DATASET_ID
+    ) -> List[Tuple]:
         """
         Asynchronously updates a value in the 'users_data' table in the database.
 
+        Concurrent calls are group committed like add_value_to_db, except that updates of the same
+        row are committed one after the other.
+
         Args:
             data (AddItemPayload): The data containing the updated values for the row.
             item_id (int): The ID of the row to be updated.
+            dataset_id (int, optional): The dataset of the row. Defaults to DEFAULT_DATASET_ID.
 
         Returns:
-            List[Tuple]: A list of tuples containing the updated row, with the 'id' field as the first element.
+            List[Tuple]: A list of tuples containing the updated row, with the 'id' field as the
+                first element, or an empty list if the row does not exist.
 
         Raises:
             HTTPException: If there is an error while updating the value in the database.
 
         """
-        update_query = """
-            UPDATE users_data
-            SET nome = %s, data_nascimento = %s, genero = %s, nacionalidade = %s, data_criacao = %s, data_atualizacao = %s
-            WHERE id = %s
-        """
-        try:
-            self.cursor.execute(
-                update_query,
-                (data.nome,
-                 format_date(data.data_nascimento),
-                 data.genero,
-                 data.nacionalidade,
-                 format_date(data.data_criacao),
-                 format_date(data.data_atualizacao),
-                 item_id)
-            )
-            self.connection.commit()
-        except Exception as error:
-            logging.error("Failed to update value in DB. Error: %s", error)
-            raise HTTPException(status_code=500, detail=f"Failed to update value in DB. Error: {error}") from error
+        row = (dataset_id, item_id, *data.to_row())
+        if self.group_commit:
+            item = await self.update_coalescer.submit(row)
+        else:
+            item = (await self._run(self._update_values_in_db, [row]))[0]
         logging.info("Value updated in DB")
-        return await self.get_filtered_value("id", item_id)
+        return [item] if item is not None else []
 
-
-    async def delete_value_from_db(self, item_id: int) -> None:
+    async def delete_value_from_db(self, item_id: int, dataset_id: int = DEFAULT_DATASET_ID) -> None:
         """
         Asynchronously deletes a value from the 'users_data' table in the database.
 
         Args:
             item_id (int): The ID of the row to be deleted.
+            dataset_id (int, optional): The dataset of the row. Defaults to DEFAULT_DATASET_ID.
 
         Raises:
             HTTPException: If there is an error while deleting the value from the database.
 
         """
-        delete_query = "DELETE FROM users_data WHERE id = %s"
-        try:
-            self.cursor.execute(delete_query, (item_id,))
-            self.connection.commit()
-        except Exception as error:
-            logging.error("Failed to delete value from DB. Error: %s", error)
-            raise HTTPException(status_code=500, detail=f"Failed to delete value from DB. Error: {error}") from error
-        logging.info("Value deleted from DB")
\ No newline at end of file
+        return await self._run(self._delete_value_from_db, item_id, dataset_id)
+
+    def _delete_value_from_db(self, item_id: int, dataset_id: int) -> None:
+        with self.borrow_connection() as connection:
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute(DELETE_USERS_DATA_QUERY, (dataset_id, item_id))
+                    deleted = cursor.rowcount
+                connection.commit()
+                if deleted:
+                    self.cache.invalidate([dataset_id])
+            except Exception as error:
+                logging.error("Failed to delete value from DB. Error: %s", error)
+                raise HTTPException(status_code=500, detail=f"Failed to delete value from DB. Error: {error}") from error
+        logging.info("Value deleted from DB")
+
+    async def add_values_to_db(self, rows: List[Tuple]) -> List[Tuple | None]:
+        """
+        Asynchronously inserts a batch of rows into the 'users_data' table with a single statement
+        and a single commit.
+
+        Rows whose natural key already exists, in the table or earlier in the batch, are skipped.
+
+        Args:
+            rows (List[Tuple]): The rows to be inserted, in the order of USERS_DATA_COLUMNS.
+
+        Returns:
+            List[Tuple | None]: For each row, in order, the inserted item or None if it was skipped.
+
+        Raises:
+            HTTPException: If there is an error while inserting the rows.
+        """
+        return await self._run(self._add_values_to_db, rows)
+
+    def _add_values_to_db(self, rows: List[Tuple]) -> List[Tuple | None]:
+        values = [(position, *row) for position, row in enumerate(rows)]
+        returned = self._execute_bulk_write("add values to DB", BULK_INSERT_USERS_DATA_QUERY, values)
+        if returned:
+            # Items added one by one go to the default dataset
+            self.cache.invalidate([DEFAULT_DATASET_ID])
+        items: List[Tuple | None] = [None] * len(rows)
+        inserted_ids = set()
+        for position, *item in returned:
+            # Rows repeating a key of the batch join the single row inserted for it; only the first one created it.
+            if item[0] not in inserted_ids:
+                inserted_ids.add(item[0])
+                items[position] = tuple(item)
+        logging.info("%s of %s values added to DB", len(inserted_ids), len(rows))
+        return items
+
+    async def update_values_in_db(self, rows: List[Tuple]) -> List[Tuple | None]:
+        """
+        Asynchronously updates a batch of rows of the 'users_data' table with a single statement
+        and a single commit.
+
+        Args:
+            rows (List[Tuple]): The dataset and id of each row followed by its new values in the order
+                of USERS_DATA_COLUMNS. A row must not be updated twice.
+
+        Returns:
+            List[Tuple | None]: For each row, in order, the updated item or None if the id does not exist.
+
+        Raises:
+            HTTPException: If an update would duplicate the natural key of another item, in which
+                case nothing is updated, or if there is an error while updating the rows.
+        """
+        return await self._run(self._update_values_in_db, rows)
+
+    def _update_values_in_db(self, rows: List[Tuple]) -> List[Tuple | None]:
+        values = [(position, *row) for position, row in enumerate(rows)]
+        query = sql.SQL(BULK_UPDATE_USERS_DATA_QUERY).format(
+            dataset_ids=sql.SQL(", ").join(sql.Literal(dataset_id) for dataset_id in {row[0] for row in rows})
+        )
+        returned = self._execute_bulk_write("update values in DB", query, values)
+        items: List[Tuple | None] = [None] * len(rows)
+        for position, *item in returned:
+            items[position] = tuple(item)
+        if returned:
+            # An item ends with its dataset_id
+            self.cache.invalidate({item[-1] for item in returned})
+        logging.info("%s of %s values updated in DB", len(returned), len(rows))
+        return items
+
+    async def delete_values_from_db(self, item_ids: List[int], dataset_id: int = DEFAULT_DATASET_ID) -> List[int]:
+        """
+        Asynchronously deletes a batch of rows from the 'users_data' table with a single statement
+        and a single commit.
+
+        Args:
+            item_ids (List[int]): The IDs of the rows to be deleted.
+            dataset_id (int, optional): The dataset of the rows. Defaults to DEFAULT_DATASET_ID.
+
+        Returns:
+            List[int]: The IDs that existed and were deleted.
+
+        Raises:
+            HTTPException: If there is an error while deleting the rows.
+        """
+        return await self._run(self._delete_values_from_db, item_ids, dataset_id)
+
+    def _delete_values_from_db(self, item_ids: List[int], dataset_id: int) -> List[int]:
+        with self.borrow_connection() as connection:
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute(BULK_DELETE_USERS_DATA_QUERY, (dataset_id, list(item_ids)))
+                    deleted_ids = [row[0] for row in cursor.fetchall()]
+                connection.commit()
+                if deleted_ids:
+                    self.cache.invalidate([dataset_id])
+            except Exception as error:
+                logging.error("Failed to delete values from DB. Error: %s", error)
+                raise HTTPException(status_code=500, detail=f"Failed to delete values from DB. Error: {error}") from error
+        logging.info("%s of %s values deleted from DB", len(deleted_ids), len(item_ids))
+        return deleted_ids
+
+    def _execute_bulk_write(self, action: str, query: str | sql.Composable, values: List[Tuple]) -> List[Tuple]:
+        with self.borrow_connection() as connection:
+            try:
+                with connection.cursor() as cursor:
+                    returned = execute_values(cursor, query, values, page_size=len(values), fetch=True)
+                connection.commit()
+            except errors.UniqueViolation as error:
+                raise self.duplicate_item_error(error) from error
+            except Exception as error:
+                logging.error("Failed to %s. Error: %s", action, error)
+                raise HTTPException(status_code=500, detail=f"Failed to {action}. Error: {error}") from error
+        return returned
+
+    async def create_dataset(self, upload_id: str, file_name: str | None, content_hash: str | None) -> int:
+        """
+        Asynchronously registers the dataset of an upload and creates its empty partition of 'users_data'.
+
+        The dataset starts "loading" and is marked "ready" with set_dataset_status once its rows are stored.
+        At most DATASET_MAX_COUNT datasets exist at once, since every partition adds to the cost of
+        planning the queries that are not routed to a single dataset.
+
+        Args:
+            upload_id (str): The upload or job ID the rows come from.
+            file_name (str | None): The name of the uploaded file.
+            content_hash (str | None): The SHA-256 of the file.
+
+        Returns:
+            int: The ID of the new dataset.
+
+        Raises:
+            HTTPException: 409 if DATASET_MAX_COUNT datasets exist, or if there is an error while creating the dataset.
+        """
+        return await self._run(self._create_dataset, upload_id, file_name, content_hash)
+
+    @staticmethod
+    def dataset_limit_error() -> HTTPException:
+        return HTTPException(
+            status_code=409,
+            detail=f"The limit of {DATASET_MAX_COUNT} datasets is reached, delete a dataset or upload into an existing one"
+        )
+
+    def _create_dataset(self, upload_id: str, file_name: str | None, content_hash: str | None) -> int:
+        with self.borrow_connection() as connection:
+            try:
+                with connection.cursor() as cursor:
+                    # Creations wait for each other, so concurrent uploads cannot go past the limit together
+                    cursor.execute(LOCK_DATASET_CREATION_QUERY)
+                    cursor.execute(COUNT_DATASETS_QUERY)
+                    full = cursor.fetchone()[0] >= DATASET_MAX_COUNT
+                    if not full:
+                        cursor.execute(INSERT_DATASET_QUERY, (file_name, content_hash, upload_id))
+                        dataset_id = cursor.fetchone()[0]
+                        for query in CREATE_DATASET_PARTITION_QUERIES:
+                            cursor.execute(
+                                sql.SQL(query).format(table=partition_table(dataset_id), dataset_id=sql.Literal(dataset_id))
+                            )
+                # Ending the transaction also releases the creation lock
+                connection.commit()
+            except Exception as error:
+                logging.error("Failed to create dataset. Error: %s", error)
+                raise HTTPException(status_code=500, detail=f"Failed to create dataset. Error: {error}") from error
+        if full:
+            raise self.dataset_limit_error()
+        logging.info("Created dataset %s for upload %s", dataset_id, upload_id)
+        return dataset_id
+
+    async def get_datasets(self) -> List[Tuple]:
+        """
+        Asynchronously retrieves every dataset, oldest first.
+
+        Returns:
+            List[Tuple]: The datasets, with their columns in the order of DATASET_FIELDS.
+
+        Raises:
+            HTTPException: If there is an error while retrieving the datasets.
+        """
+        return await self._run(self._get_datasets, None)
+
+    async def get_dataset(self, dataset_id: int) -> Tuple | None:
+        """
+        Asynchronously retrieves a dataset.
+
+        Args:
+            dataset_id (int): The dataset ID.
+
+        Returns:
+            Tuple | None: The dataset columns in the order of DATASET_FIELDS, or None if the dataset does not exist.
+
+        Raises:
+            HTTPException: If there is an error while retrieving the dataset.
+        """
+        datasets = await self._run(self._get_datasets, dataset_id)
+        return datasets[0] if datasets else None
+
+    def _get_datasets(self, dataset_id: int | None) -> List[Tuple]:
+        if dataset_id is None:
+            where, params = sql.SQL("TRUE"), None
+        else:
+            where, params = sql.SQL("datasets.id = %s"), (dataset_id,)
+        with self.borrow_connection() as connection:
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute(sql.SQL(SELECT_DATASETS_QUERY).format(where=where), params)
+                    result = cursor.fetchall()
+            except Exception as error:
+                logging.error("Failed to get datasets. Error: %s", error)
+                raise HTTPException(status_code=500, detail=f"Failed to get datasets. Error: {error}") from error
+        return result
+
+    async def get_dataset_ids_by_status(self, status: str) -> List[int]:
+        """
+        Asynchronously retrieves the IDs of the datasets with a status, e.g. "pending_drop".
+
+        Raises:
+            HTTPException: If there is an error while retrieving the datasets.
+        """
+        rows = await self._run(
+            self._execute_job_query, "get datasets by status", SELECT_DATASET_IDS_BY_STATUS_QUERY, (status,), "all"
+        )
+        return [row[0] for row in rows]
+
+    async def set_dataset_status(self, dataset_id: int, status: str) -> None:
+        """
+        Asynchronously stores the status of a dataset, e.g. "ready" once its upload is ingested.
+        """
+        await self._run(
+            self._execute_job_query, "set dataset status", UPDATE_DATASET_STATUS_QUERY, (status, dataset_id)
+        )
+
+    async def drop_dataset(self, dataset_id: int) -> bool:
+        """
+        Asynchronously deletes a dataset and all its rows by dropping its partition of 'users_data'.
+
+        Dropping the partition takes the same time whatever the number of rows, but it needs an
+        exclusive lock on 'users_data' for an instant. The drop waits at most DATASET_DROP_LOCK_TIMEOUT
+        seconds for the running queries, so it never holds back the queries behind it for longer.
+        The record of the ingested file is deleted as well, so the same file can be uploaded again.
+
+        Args:
+            dataset_id (int): The dataset ID.
+
+        Returns:
+            bool: True if the dataset existed and was dropped.
+
+        Raises:
+            HTTPException: 409 if users_data stayed busy for DATASET_DROP_LOCK_TIMEOUT seconds, or
+                500 if there is an error while dropping the dataset.
+        """
+        return await self._run(self._drop_dataset, dataset_id)
+
+    def _drop_dataset(self, dataset_id: int) -> bool:
+        with self.borrow_connection() as connection:
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute(SET_LOCK_TIMEOUT_QUERY, (lock_timeout(DATASET_DROP_LOCK_TIMEOUT),))
+                    cursor.execute(DELETE_DATASET_QUERY, (dataset_id,))
+                    dataset = cursor.fetchone()
+                    if dataset is None:
+                        return False
+                    cursor.execute(sql.SQL(DROP_DATASET_PARTITION_QUERY).format(table=partition_table(dataset_id)))
+                    for query in DELETE_DATASET_RECORDS_QUERIES:
+                        cursor.execute(query, {"dataset_id": dataset_id, "upload_id": dataset[0]})
+                connection.commit()
+                self.cache.invalidate([dataset_id])
+            except errors.LockNotAvailable as error:
+                logging.error("Timed out dropping dataset %s. Error: %s", dataset_id, error)
+                raise HTTPException(
+                    status_code=409, detail=f"Dataset {dataset_id} is in use, try again later"
+                ) from error
+            except Exception as error:
+                logging.error("Failed to drop dataset. Error: %s", error)
+                raise HTTPException(status_code=500, detail=f"Failed to drop dataset. Error: {error}") from error
+        logging.info("Dropped dataset %s", dataset_id)
+        return True
+
+    async def create_ingestion_job(
+        self,
+        job_id: str,
+        file_name: str,
+        file_path: str,
+        engine: str,
+        content_hash: str | None = None,
+        dataset_id: int | None = None,
+        replaces_dataset_id: int | None = None,
+        append: bool = False
+    ) -> None:
+        """
+        Asynchronously registers a queued ingestion job for a spooled CSV file.
+
+        Args:
+            job_id (str): The job ID.
+            file_name (str): The name of the uploaded file.
+            file_path (str): The path of the spooled copy of the file.
+            engine (str): The ingestion engine to be used.
+            content_hash (str | None, optional): The SHA-256 of the file, recorded once the job succeeds. Defaults to None.
+            dataset_id (int | None, optional): The dataset created for the file. Defaults to None, the default dataset.
+            replaces_dataset_id (int | None, optional): The dataset dropped once the job succeeds. Defaults to None.
+            append (bool, optional): Whether dataset_id is an existing dataset the job appends to, which is
+                kept if the job fails or is cancelled. Defaults to False.
+
+        Raises:
+            HTTPException: If there is an error while creating the job.
+        """
+        await self._run(
+            self._execute_job_query,
+            "create ingestion job",
+            INSERT_INGESTION_JOB_QUERY,
+            (job_id, file_name, file_path, engine, content_hash, dataset_id, replaces_dataset_id, append)
+        )
+
+    async def get_ingestion_job(self, job_id: str) -> Tuple | None:
+        """
+        Asynchronously retrieves an ingestion job.
+
+        Args:
+            job_id (str): The job ID.
+
+        Returns:
+            Tuple | None: The job columns in the order of INGESTION_JOB_FIELDS, or None if the job does not exist.
+        """
+        return await self._run(self._execute_job_query, "get ingestion job", SELECT_INGESTION_JOB_QUERY, (job_id,), True)
+
+    async def claim_ingestion_job(self, worker_id: str) -> Tuple | None:
+        """
+        Asynchronously marks the oldest queued ingestion job as running under the lease of a worker and returns it.
+
+        Jobs locked by another worker are skipped, so several processes can share the queue.
+
+        Args:
+            worker_id (str): The worker claiming the job, which must renew its lease with renew_ingestion_job_lease.
+
+        Returns:
+            Tuple | None: The job ID, file name, spooled file path, engine, content hash, dataset, replaced dataset
+                and whether the job appends to its dataset, or None if no job is queued.
+        """
+        return await self._run(
+            self._execute_job_query, "claim ingestion job", CLAIM_INGESTION_JOB_QUERY, (worker_id,), True
+        )
+
+    def report_ingestion_job_progress(
+        self,
+        job_id: str,
+        worker_id: str,
+        rows_processed: int,
+        rows_rejected: int,
+        rows_per_second: float
+    ) -> str | None:
+        """
+        Stores the progress of a running job, which also renews its lease, and returns its current status.
+
+        This method blocks; it is meant to be called from the thread running the ingestion.
+
+        Returns:
+            str | None: The job status, e.g. "cancelling" when a cancellation was requested, or None if the
+                worker lost the lease of the job.
+        """
+        result = self._execute_job_query(
+            "report ingestion job progress",
+            UPDATE_INGESTION_JOB_PROGRESS_QUERY,
+            (rows_processed, rows_rejected, rows_per_second, job_id, worker_id),
+            True
+        )
+        return result[0] if result else None
+
+    def renew_ingestion_job_lease(self, job_id: str, worker_id: str) -> str | None:
+        """
+        Renews the lease a worker holds on a running job and returns the job status.
+
+        This method blocks; it is meant to be called from the heartbeat thread of the job.
+
+        Returns:
+            str | None: The job status, e.g. "cancelling" when a cancellation was requested, or None if the
+                worker lost the lease of the job.
+        """
+        result = self._execute_job_query(
+            "renew ingestion job lease", RENEW_INGESTION_JOB_LEASE_QUERY, (job_id, worker_id), True
+        )
+        return result[0] if result else None
+
+    async def finish_ingestion_job(
+        self,
+        job_id: str,
+        worker_id: str,
+        status: str,
+        rows_processed: int = 0,
+        rows_rejected: int = 0,
+        rows_inserted: int = 0,
+        rows_updated: int = 0,
+        rows_per_second: float | None = None,
+        error: str | None = None
+    ) -> None:
+        """
+        Asynchronously stores the final status and stats of an ingestion job, unless the worker lost its lease.
+        """
+        await self._run(
+            self._execute_job_query,
+            "finish ingestion job",
+            FINISH_INGESTION_JOB_QUERY,
+            (status, rows_processed, rows_rejected, rows_inserted, rows_updated, rows_per_second, error, job_id, worker_id)
+        )
+
+    async def cancel_ingestion_job(self, job_id: str) -> Tuple | None:
+        """
+        Asynchronously requests the cancellation of an ingestion job.
+
+        Queued jobs are cancelled at once; running jobs are marked "cancelling" and stop at their next batch.
+
+        Returns:
+            Tuple | None: The new status, spooled file path, dataset and append flag of the job, or None if the
+                job does not exist or is already finished.
+        """
+        return await self._run(
+            self._execute_job_query, "cancel ingestion job", CANCEL_INGESTION_JOB_QUERY, (job_id,), True
+        )
+
+    async def requeue_ingestion_job(self, job_id: str, worker_id: str) -> None:
+        """
+        Asynchronously puts a running job back in the queue, e.g. when its worker is shutting down.
+        """
+        await self._run(
+            self._execute_job_query, "requeue ingestion job", REQUEUE_INGESTION_JOB_QUERY, (job_id, worker_id)
+        )
+
+    async def requeue_stale_ingestion_jobs(self, lease_seconds: float) -> List[Tuple]:
+        """
+        Asynchronously puts back in the queue the running jobs whose lease was not renewed for lease_seconds,
+        e.g. because their worker crashed or was restarted. Their partial work was rolled back with the
+        worker's transaction. Stale jobs that were being cancelled are marked cancelled instead.
+
+        Returns:
+            List[Tuple]: The ID, new status, spooled file path, dataset and append flag of every job put back or cancelled.
+        """
+        return await self._run(
+            self._execute_job_query,
+            "requeue stale ingestion jobs",
+            REQUEUE_STALE_INGESTION_JOBS_QUERY,
+            (lease_seconds,),
+            "all"
+        )
+
+    async def get_ingested_file(self, content_hash: str) -> Tuple | None:
+        """
+        Asynchronously looks up a CSV file that was already ingested by its content hash.
+
+        Args:
+            content_hash (str): The SHA-256 of the file.
+
+        Returns:
+            Tuple | None: The upload ID and ingestion time, or None if the file was never ingested.
+        """
+        return await self._run(
+            self._execute_job_query, "get ingested file", SELECT_INGESTED_FILE_QUERY, (content_hash,), True
+        )
+
+    async def record_ingested_file(
+        self,
+        content_hash: str,
+        upload_id: str,
+        file_name: str | None,
+        rows_processed: int,
+        dataset_id: int = DEFAULT_DATASET_ID
+    ) -> None:
+        """
+        Asynchronously records a successfully ingested CSV file, so uploading it again is detected.
+        The record is deleted with the dataset the file was ingested into.
+
+        Args:
+            content_hash (str): The SHA-256 of the file.
+            upload_id (str): The upload or job ID that ingested it.
+            file_name (str | None): The name of the uploaded file.
+            rows_processed (int): The number of rows ingested.
+            dataset_id (int, optional): The dataset the rows went into. Defaults to DEFAULT_DATASET_ID.
+        """
+        await self._run(
+            self._execute_job_query,
+            "record ingested file",
+            INSERT_INGESTED_FILE_QUERY,
+            (content_hash, upload_id, file_name, rows_processed, dataset_id)
+        )
+
+    def _execute_job_query(self, action: str, query: str, params: Tuple | None, fetch: bool | str = False):
+        """
+        Runs one statement in its own transaction and returns the first row if fetch is set, or every row
+        if fetch is "all".
+        """
+        with self.borrow_connection() as connection:
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute(query, params)
+                    if fetch == "all":
+                        result = cursor.fetchall()
+                    else:
+                        result = cursor.fetchone() if fetch else None
+                connection.commit()
+            except Exception as error:
+                logging.error("Failed to %s. Error: %s", action, error)
+                raise HTTPException(status_code=500, detail=f"Failed to {action}. Error: {error}") from error
+        return result
@@ -0,0 +1,33 @@
+import os
+
+from psycopg2 import sql
+
+
+# Dataset of the rows stored before datasets existed and of the items added one by one
+# (see database/migrations/02_datasets.sql). It cannot be dropped.
+DEFAULT_DATASET_ID = 1
+
+# Most datasets that may exist at once. Every dataset is a partition of users_data, which adds
+# to the planning time of the queries that are not routed to a single dataset.
+DATASET_MAX_COUNT = int(os.environ.get("DATASET_MAX_COUNT", "100"))
+
+# Seconds a dataset drop waits for the queries reading users_data before giving up
+DATASET_DROP_LOCK_TIMEOUT = float(os.environ.get("DATASET_DROP_LOCK_TIMEOUT", "2"))
+
+
+def partition_name(dataset_id: int) -> str:
+    """
+    Returns the name of the users_data partition holding the rows of a dataset.
+    """
+    return f"users_data_{int(dataset_id)}"
+
+
+def partition_table(dataset_id: int) -> sql.Identifier:
+    return sql.Identifier(partition_name(dataset_id))
+
+
+def lock_timeout(seconds: float) -> str:
+    """
+    Returns a number of seconds as a lock_timeout setting, in milliseconds.
+    """
+    return f"{max(int(seconds * 1000), 1)}ms"
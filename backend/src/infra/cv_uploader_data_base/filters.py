@@ -0,0 +1,168 @@
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+from psycopg2 import sql
+
+from ...utils import format_date
+
+from .pagination import Cursor
+from .querys import ITEM_SELECT_COLUMNS
+
+
+class InvalidFilterError(ValueError):
+    """Raised when a filter names an unknown column or operator, or has an invalid value."""
+
+
+FILTERABLE_COLUMNS: Dict[str, Callable[[str], Any]] = {
+    "id": int,
+    "dataset_id": int,
+    "nome": str,
+    "data_nascimento": format_date,
+    "genero": str,
+    "nacionalidade": str,
+    "data_criacao": format_date,
+    "data_atualizacao": format_date,
+}
+
+OPERATORS = {
+    "eq": "=",
+    "ne": "<>",
+    "gt": ">",
+    "gte": ">=",
+    "lt": "<",
+    "lte": "<=",
+    "in": "= ANY",
+}
+
+OPERATOR_SEPARATOR = "__"
+
+
+@dataclass
+class Predicate:
+    column: str
+    operator: str
+    value: Any
+
+
+def make_predicate(column: str, operator: str, value: str) -> Predicate:
+    """
+    Validates a filter against the whitelist of columns and operators and converts its value.
+
+    Args:
+        column (str): The column to filter by, one of FILTERABLE_COLUMNS.
+        operator (str): The comparison, one of OPERATORS. "in" takes comma separated values.
+        value (str): The raw value to compare with.
+
+    Returns:
+        Predicate: The validated predicate.
+
+    Raises:
+        InvalidFilterError: If the column, operator or value is invalid.
+    """
+    if column not in FILTERABLE_COLUMNS:
+        raise InvalidFilterError(
+            f"Invalid filter field '{column}'. Available fields: {', '.join(FILTERABLE_COLUMNS)}"
+        )
+    if operator not in OPERATORS:
+        raise InvalidFilterError(
+            f"Invalid filter operator '{operator}'. Available operators: {', '.join(OPERATORS)}"
+        )
+    convert = FILTERABLE_COLUMNS[column]
+    try:
+        if operator == "in":
+            converted = [convert(item) for item in str(value).split(",")]
+        else:
+            converted = convert(value)
+    except ValueError as error:
+        raise InvalidFilterError(f"Invalid value '{value}' for filter field '{column}'") from error
+    return Predicate(column=column, operator=operator, value=converted)
+
+
+def parse_filters(params: Iterable[Tuple[str, str]]) -> List[Predicate]:
+    """
+    Parses query parameters like "nacionalidade=Brasileiro" or "data_nascimento__gte=1980/01/01" into predicates.
+
+    Args:
+        params (Iterable[Tuple[str, str]]): The (key, value) pairs. Keys are "<column>" or "<column>__<operator>".
+
+    Returns:
+        List[Predicate]: The validated predicates, combined with AND.
+
+    Raises:
+        InvalidFilterError: If any of the filters is invalid.
+    """
+    predicates = []
+    for key, value in params:
+        column, _, operator = key.partition(OPERATOR_SEPARATOR)
+        predicates.append(make_predicate(column, operator or "eq", value))
+    return predicates
+
+
+def build_where_clause(predicates: List[Predicate]) -> Tuple[sql.Composable, List[Any]]:
+    """
+    Builds a parameterized WHERE condition from the predicates. Column names come from the whitelist
+    and are quoted as identifiers; values are always passed as query parameters.
+
+    Returns:
+        Tuple[sql.Composable, List[Any]]: The condition and its parameters.
+    """
+    if not predicates:
+        return sql.SQL("TRUE"), []
+    clauses = []
+    params = []
+    for predicate in predicates:
+        if predicate.operator == "in":
+            clauses.append(sql.SQL("{} = ANY(%s)").format(sql.Identifier(predicate.column)))
+        else:
+            clauses.append(
+                sql.SQL("{} {} %s").format(sql.Identifier(predicate.column), sql.SQL(OPERATORS[predicate.operator]))
+            )
+        params.append(predicate.value)
+    return sql.SQL(" AND ").join(clauses), params
+
+
+def build_page_query(
+    predicates: List[Predicate],
+    page_number: int,
+    page_size: int,
+    cursor: Cursor | None = None
+) -> Tuple[sql.Composable, List[Any]]:
+    """
+    Builds the query of one page of users_data items ordered by id, with one extra row to tell
+    whether there is another page.
+
+    With a cursor the page is selected with a keyset condition on id; otherwise page_number is
+    turned into an OFFSET.
+
+    Returns:
+        Tuple[sql.Composable, List[Any]]: The query and its parameters.
+    """
+    if cursor is None:
+        return build_range_query(predicates, page_size + 1, offset=(page_number - 1) * page_size)
+    return build_range_query(
+        predicates, page_size + 1, bound_id=cursor.last_id, descending=cursor.direction == "prev"
+    )
+
+
+def build_range_query(
+    predicates: List[Predicate],
+    limit: int,
+    offset: int = 0,
+    bound_id: int | None = None,
+    descending: bool = False
+) -> Tuple[sql.Composable, List[Any]]:
+    """
+    Builds the query of up to limit users_data items ordered by id, after bound_id, or before it
+    when descending, and skipping the first offset items.
+
+    Returns:
+        Tuple[sql.Composable, List[Any]]: The query and its parameters.
+    """
+    where, params = build_where_clause(predicates)
+    if bound_id is not None:
+        where = sql.SQL("{} AND id {} %s").format(where, sql.SQL("<" if descending else ">"))
+        params.append(bound_id)
+    query = sql.SQL("SELECT {} FROM users_data WHERE {} ORDER BY id {} OFFSET %s LIMIT %s").format(
+        sql.SQL(ITEM_SELECT_COLUMNS), where, sql.SQL("DESC" if descending else "ASC")
+    )
+    return query, params + [offset, limit]
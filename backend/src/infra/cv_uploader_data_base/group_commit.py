@@ -0,0 +1,120 @@
+import os
+import asyncio
+import logging
+from typing import Awaitable, Callable, Generic, Hashable, List, Tuple, TypeVar
+
+from ..metrics import GROUP_COMMIT_BATCH_SIZE
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+GROUP_COMMIT_ENABLED = os.environ.get("GROUP_COMMIT_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# Seconds a batch waits for more writes before it is sent. With 0 a lone write is sent right away,
+# and a batch holds the writes that arrived while the previous one was being committed.
+GROUP_COMMIT_WINDOW = float(os.environ.get("GROUP_COMMIT_WINDOW", "0"))
+GROUP_COMMIT_MAX_BATCH = int(os.environ.get("GROUP_COMMIT_MAX_BATCH", "500"))
+
+
+class WriteCoalescer(Generic[T, R]):
+    """
+    Group commit of concurrent single-row writes.
+
+    Writes submitted while a batch is being written wait for it to finish, and are then written
+    together by write_batch, in one statement and one transaction. A burst of writes therefore
+    pays for a few commits instead of one commit, and one WAL flush, per write.
+
+    A caller only gets its result once the transaction holding its write is committed, so a write
+    is as durable when submit returns as when it is written alone. If a batch fails because of one
+    of its rows, as told by is_row_error, e.g. a duplicate key, its writes are retried one at a
+    time so the error only fails the write causing it. Any other error, such as a pool timeout or a
+    connection lost while committing, whose outcome is unknown, is given to every caller of the
+    batch as is: retrying would flood a struggling database, or write a committed row twice.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        write_batch: Callable[[List[T]], Awaitable[List[R]]],
+        key: Callable[[T], Hashable] | None = None,
+        is_row_error: Callable[[Exception], bool] | None = None,
+        window: float = GROUP_COMMIT_WINDOW,
+        max_batch: int = GROUP_COMMIT_MAX_BATCH,
+    ) -> None:
+        """
+        Args:
+            name (str): The name of the operation, used in logs and metrics.
+            write_batch (Callable[[List[T]], Awaitable[List[R]]]): Writes and commits a batch,
+                returning the result of each write in order.
+            key (Callable[[T], Hashable] | None, optional): Writes with the same key never share a
+                batch, for statements that cannot write the same row twice. Defaults to None.
+            is_row_error (Callable[[Exception], bool] | None, optional): Tells whether a batch failed
+                because of one of its rows, in which case its writes are retried one by one. Defaults
+                to None, never retrying.
+            window (float, optional): Seconds a batch waits for more writes. Defaults to GROUP_COMMIT_WINDOW.
+            max_batch (int, optional): The maximum number of writes per batch. Defaults to GROUP_COMMIT_MAX_BATCH.
+        """
+        self.name = name
+        self.write_batch = write_batch
+        self.key = key
+        self.is_row_error = is_row_error
+        self.window = window
+        self.max_batch = max_batch
+        self._pending: List[Tuple[T, asyncio.Future]] = []
+        self._flusher: asyncio.Task | None = None
+
+    async def submit(self, item: T) -> R:
+        """
+        Writes an item with the next batch and returns its result once the batch is committed.
+
+        Raises:
+            Exception: The error raised by write_batch when the item is written alone.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((item, future))
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush())
+        return await future
+
+    async def _flush(self) -> None:
+        if self.window > 0:
+            await asyncio.sleep(self.window)
+        while self._pending:
+            await self._write(self._take_batch())
+
+    def _take_batch(self) -> List[Tuple[T, asyncio.Future]]:
+        batch, deferred, keys = [], [], set()
+        for entry in self._pending:
+            key = self.key(entry[0]) if self.key else None
+            if len(batch) >= self.max_batch or (key is not None and key in keys):
+                deferred.append(entry)
+                continue
+            batch.append(entry)
+            keys.add(key)
+        self._pending = deferred
+        return batch
+
+    async def _write(self, batch: List[Tuple[T, asyncio.Future]]) -> None:
+        GROUP_COMMIT_BATCH_SIZE.observe(len(batch), operation=self.name)
+        try:
+            results = await self.write_batch([item for item, _ in batch])
+        except Exception as error:
+            if len(batch) == 1 or not (self.is_row_error and self.is_row_error(error)):
+                for _, future in batch:
+                    _resolve(future, error=error)
+                return
+            logging.warning("Group commit of %s %s writes failed, writing them one by one. Error: %s", len(batch), self.name, error)
+            await asyncio.gather(*(self._write([entry]) for entry in batch))
+            return
+        for (_, future), result in zip(batch, results):
+            _resolve(future, result)
+
+
+def _resolve(future: asyncio.Future, result=None, error: Exception | None = None) -> None:
+    # The caller may have been cancelled, e.g. by a client disconnect, while its write was committed
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
@@ -0,0 +1,63 @@
+import json
+import base64
+import binascii
+from dataclasses import dataclass, field
+from typing import Any, List
+
+from .datasets import DEFAULT_DATASET_ID
+
+
+COUNT_MODES = ("maintained", "estimate", "exact")
+
+
+class InvalidCursorError(ValueError):
+    """Raised when a pagination cursor cannot be decoded."""
+
+
+@dataclass
+class Cursor:
+    """
+    Position in a keyset-paginated listing: the rows right after ("next") or right
+    before ("prev") the row with the given id, in the given dataset.
+    """
+    last_id: int
+    direction: str = "next"
+    dataset_id: int = DEFAULT_DATASET_ID
+
+
+@dataclass
+class Page:
+    items: List[Any] = field(default_factory=list)
+    total_count: int = 0
+    next_cursor: str | None = None
+    prev_cursor: str | None = None
+
+
+def encode_cursor(cursor: Cursor) -> str:
+    payload = json.dumps(
+        {"id": cursor.last_id, "d": cursor.direction, "ds": cursor.dataset_id}, separators=(",", ":")
+    )
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def decode_cursor(value: str) -> Cursor:
+    """
+    Decodes an opaque cursor produced by encode_cursor. Cursors encoded before they carried a
+    dataset point into the default dataset.
+
+    Raises:
+        InvalidCursorError: If the value is not a valid cursor.
+    """
+    try:
+        padded = value + "=" * (-len(value) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        cursor = Cursor(
+            last_id=int(payload["id"]),
+            direction=payload["d"],
+            dataset_id=int(payload.get("ds", DEFAULT_DATASET_ID))
+        )
+    except (binascii.Error, ValueError, TypeError, KeyError) as error:
+        raise InvalidCursorError(f"Invalid cursor: {value}") from error
+    if cursor.direction not in ("next", "prev"):
+        raise InvalidCursorError(f"Invalid cursor: {value}")
+    return cursor
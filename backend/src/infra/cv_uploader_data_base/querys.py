@@ -0,0 +1,471 @@
+USERS_DATA_COLUMNS = (
+    "nome",
+    "data_nascimento",
+    "genero",
+    "nacionalidade",
+    "data_criacao",
+    "data_atualizacao",
+)
+
+ITEM_FIELDS = ("id",) + USERS_DATA_COLUMNS + ("dataset_id",)
+
+# Columns returned to API clients; dates are formatted by PostgreSQL so rows can be
+# encoded to JSON without any per-row conversion in Python. An item is identified by
+# its id and dataset_id, which routes its reads and writes to a single partition.
+ITEM_SELECT_COLUMNS = """
+    id,
+    nome,
+    to_char(data_nascimento, 'YYYY/MM/DD') AS data_nascimento,
+    genero,
+    nacionalidade,
+    to_char(data_criacao, 'YYYY/MM/DD') AS data_criacao,
+    to_char(data_atualizacao, 'YYYY/MM/DD') AS data_atualizacao,
+    dataset_id
+"""
+
+# The bulk engines write each row with the dataset it belongs to in front of its values
+COPY_USERS_DATA_QUERY = f"""
+    COPY users_data (dataset_id, {", ".join(USERS_DATA_COLUMNS)})
+    FROM STDIN WITH (FORMAT csv)
+"""
+
+INSERT_USERS_DATA_VALUES_QUERY = f"""
+    INSERT INTO users_data (dataset_id, {", ".join(USERS_DATA_COLUMNS)})
+    VALUES %s
+"""
+
+# VARCHAR limits of the users_data columns in database/init.sql
+FIELD_MAX_LENGTHS = {
+    "nome": 100,
+    "genero": 100,
+    "nacionalidade": 50,
+}
+
+# Bulk writes send the whole batch as one VALUES list. ord is the position of each item in the
+# request, so every returned row can be matched to the item it came from.
+BULK_INSERT_USERS_DATA_QUERY = f"""
+    WITH input (ord, {", ".join(USERS_DATA_COLUMNS)}) AS (
+        VALUES %s
+    ), inserted AS (
+        INSERT INTO users_data ({", ".join(USERS_DATA_COLUMNS)})
+        SELECT {", ".join(USERS_DATA_COLUMNS)} FROM input ORDER BY ord
+        ON CONFLICT (natural_key, dataset_id) DO NOTHING
+        RETURNING natural_key, {ITEM_SELECT_COLUMNS}
+    )
+    SELECT input.ord, {", ".join(f"inserted.{field}" for field in ITEM_FIELDS)}
+    FROM input
+    JOIN inserted ON inserted.natural_key = users_data_natural_key(input.nome, input.data_nascimento, input.data_criacao)
+    ORDER BY input.ord
+"""
+
+# {dataset_ids} lists the datasets of the batch as literals, so only their partitions are planned and probed.
+BULK_UPDATE_USERS_DATA_QUERY = f"""
+    WITH input (ord, dataset_id, id, {", ".join(USERS_DATA_COLUMNS)}) AS (
+        VALUES %s
+    )
+    UPDATE users_data
+    SET {", ".join(f"{column} = input.{column}" for column in USERS_DATA_COLUMNS)}
+    FROM input
+    WHERE users_data.dataset_id IN ({{dataset_ids}})
+        AND users_data.dataset_id = input.dataset_id
+        AND users_data.id = input.id
+    RETURNING
+        input.ord,
+        users_data.id,
+        users_data.nome,
+        to_char(users_data.data_nascimento, 'YYYY/MM/DD'),
+        users_data.genero,
+        users_data.nacionalidade,
+        to_char(users_data.data_criacao, 'YYYY/MM/DD'),
+        to_char(users_data.data_atualizacao, 'YYYY/MM/DD'),
+        users_data.dataset_id
+"""
+
+DELETE_USERS_DATA_QUERY = """
+    DELETE FROM users_data WHERE dataset_id = %s AND id = %s
+"""
+
+BULK_DELETE_USERS_DATA_QUERY = """
+    DELETE FROM users_data WHERE dataset_id = %s AND id = ANY(%s) RETURNING id
+"""
+
+# Columns of the natural key (see users_data_natural_key in init.sql) and the columns an upsert may change.
+NATURAL_KEY_COLUMNS = ("nome", "data_nascimento", "data_criacao")
+UPSERT_UPDATE_COLUMNS = tuple(column for column in USERS_DATA_COLUMNS if column not in NATURAL_KEY_COLUMNS)
+
+# Staging tables receive the raw upload with COPY before it is merged into users_data.
+# seq keeps the file order, so the last occurrence of a duplicated key wins.
+USERS_DATA_STAGING_DEFINITION = """(
+    seq BIGSERIAL,
+    nome VARCHAR(100),
+    data_nascimento DATE,
+    genero VARCHAR(100),
+    nacionalidade VARCHAR(50),
+    data_criacao DATE,
+    data_atualizacao DATE
+)"""
+
+CREATE_TEMP_STAGING_TABLE_QUERY = f"""
+    CREATE TEMPORARY TABLE {{table}} {USERS_DATA_STAGING_DEFINITION} ON COMMIT DROP
+"""
+
+CREATE_UNLOGGED_STAGING_TABLE_QUERY = f"""
+    CREATE UNLOGGED TABLE {{table}} {USERS_DATA_STAGING_DEFINITION}
+"""
+
+DROP_STAGING_TABLE_QUERY = """
+    DROP TABLE IF EXISTS {table}
+"""
+
+TRUNCATE_STAGING_TABLE_QUERY = """
+    TRUNCATE {table}
+"""
+
+COPY_STAGING_QUERY = f"""
+    COPY {{table}} ({", ".join(USERS_DATA_COLUMNS)})
+    FROM STDIN WITH (FORMAT csv)
+"""
+
+# Inserts the new rows of a staging table that match {condition} into the dataset given as
+# parameter and updates the rows of the dataset whose key exists but whose other values changed;
+# unchanged rows are not written at all. Returns the inserted and updated row counts.
+UPSERT_USERS_DATA_FROM_STAGING_QUERY = f"""
+    WITH upserted AS (
+        INSERT INTO users_data (dataset_id, {", ".join(USERS_DATA_COLUMNS)})
+        SELECT DISTINCT ON (users_data_natural_key({", ".join(NATURAL_KEY_COLUMNS)}))
+            %s, {", ".join(USERS_DATA_COLUMNS)}
+        FROM {{table}}
+        WHERE {{condition}}
+        ORDER BY users_data_natural_key({", ".join(NATURAL_KEY_COLUMNS)}), seq DESC
+        ON CONFLICT (natural_key, dataset_id) DO UPDATE
+        SET {", ".join(f"{column} = EXCLUDED.{column}" for column in UPSERT_UPDATE_COLUMNS)}
+        WHERE ({", ".join(f"users_data.{column}" for column in UPSERT_UPDATE_COLUMNS)})
+            IS DISTINCT FROM ({", ".join(f"EXCLUDED.{column}" for column in UPSERT_UPDATE_COLUMNS)})
+        RETURNING xmax = 0 AS inserted
+    )
+    SELECT COUNT(*) FILTER (WHERE inserted), COUNT(*) FILTER (WHERE NOT inserted) FROM upserted
+"""
+
+# Condition of UPSERT_USERS_DATA_FROM_STAGING_QUERY that selects one of several disjoint buckets
+# of natural keys, given the number of buckets and the bucket. Every copy of a key is in the same
+# bucket, so the buckets can be merged concurrently without waiting on each other's keys.
+STAGING_BUCKET_CONDITION = f"""
+    (hashtext(users_data_natural_key({", ".join(NATURAL_KEY_COLUMNS)})::text) & 2147483647) %% %s = %s
+"""
+
+# Staging tables of the parallel engine are held by a session-level advisory lock on their name
+# while they are in use, so the ones left behind by a process that died can be told apart.
+LOCK_STAGING_TABLE_QUERY = """
+    SELECT pg_advisory_lock(hashtext(%s))
+"""
+
+TRY_LOCK_STAGING_TABLE_QUERY = """
+    SELECT pg_try_advisory_lock(hashtext(%s))
+"""
+
+UNLOCK_STAGING_TABLE_QUERY = """
+    SELECT pg_advisory_unlock(hashtext(%s))
+"""
+
+SELECT_STAGING_TABLES_QUERY = r"""
+    SELECT tablename FROM pg_tables
+    WHERE schemaname = current_schema() AND tablename LIKE 'users\_data\_staging\_%'
+"""
+
+SELECT_INGESTED_FILE_QUERY = """
+    SELECT upload_id, ingested_at FROM ingested_files
+    WHERE content_hash = %s
+"""
+
+INSERT_INGESTED_FILE_QUERY = """
+    INSERT INTO ingested_files (content_hash, upload_id, file_name, rows_processed, dataset_id)
+    VALUES (%s, %s, %s, %s, %s)
+    ON CONFLICT (content_hash) DO NOTHING
+"""
+
+COUNT_USERS_DATA_EXACT_QUERY = """
+    SELECT COUNT(*) FROM users_data
+"""
+
+# users_data is partitioned by dataset and only its partitions have planner statistics
+COUNT_USERS_DATA_ESTIMATE_QUERY = """
+    SELECT COALESCE(SUM(GREATEST(partition.reltuples, 0)), 0)::BIGINT
+    FROM pg_inherits
+    JOIN pg_class AS partition ON partition.oid = pg_inherits.inhrelid
+    WHERE pg_inherits.inhparent = 'users_data'::regclass
+"""
+
+COUNT_USERS_DATA_MAINTAINED_QUERY = """
+    SELECT COALESCE(SUM(delta), 0)::BIGINT, COUNT(*) FROM users_data_row_count
+"""
+
+COUNT_DATASET_EXACT_QUERY = """
+    SELECT COUNT(*) FROM users_data WHERE dataset_id = %s
+"""
+
+COUNT_DATASET_ESTIMATE_QUERY = """
+    SELECT COALESCE(MAX(GREATEST(reltuples, 0)), 0)::BIGINT FROM pg_class
+    WHERE oid = to_regclass(%s)
+"""
+
+COUNT_DATASET_MAINTAINED_QUERY = """
+    SELECT COALESCE(SUM(delta), 0)::BIGINT, COUNT(*) FROM users_data_row_count
+    WHERE dataset_id = %s
+"""
+
+COMPACT_USERS_DATA_ROW_COUNT_QUERY = """
+    WITH deltas AS (
+        DELETE FROM users_data_row_count RETURNING dataset_id, delta
+    )
+    INSERT INTO users_data_row_count (dataset_id, delta)
+    SELECT dataset_id, SUM(delta) FROM deltas
+    GROUP BY dataset_id
+"""
+
+# Stats buckets with their counts, and the number of delta rows of users_data_stats to decide
+# when to fold them. Buckets whose count went down to zero are left out.
+SELECT_USERS_DATA_STATS_QUERY = """
+    SELECT dimension, bucket, SUM(delta)::BIGINT, COUNT(*) FROM users_data_stats
+    GROUP BY dimension, bucket
+"""
+
+COMPACT_USERS_DATA_STATS_QUERY = """
+    WITH deltas AS (
+        DELETE FROM users_data_stats RETURNING dataset_id, dimension, bucket, delta
+    )
+    INSERT INTO users_data_stats (dataset_id, dimension, bucket, delta)
+    SELECT dataset_id, dimension, bucket, SUM(delta) FROM deltas
+    GROUP BY dataset_id, dimension, bucket
+    HAVING SUM(delta) <> 0
+"""
+
+# Recomputes the trigger-maintained aggregates from users_data. The SHARE lock lets reads go on
+# but makes writers wait, so no delta is lost or counted twice while the counts are rebuilt.
+REBUILD_USERS_DATA_STATS_QUERIES = (
+    "LOCK TABLE users_data IN SHARE MODE",
+    "DELETE FROM users_data_stats",
+    """
+    INSERT INTO users_data_stats (dataset_id, dimension, bucket, delta)
+    SELECT dataset_id, b.dimension, b.bucket, COUNT(*)
+    FROM users_data
+    CROSS JOIN LATERAL users_data_stats_buckets(nacionalidade, genero, data_nascimento, data_criacao) AS b
+    GROUP BY dataset_id, b.dimension, b.bucket
+    """,
+    "DELETE FROM users_data_row_count",
+    "INSERT INTO users_data_row_count (dataset_id, delta) SELECT dataset_id, COUNT(*) FROM users_data GROUP BY dataset_id",
+)
+
+# Name searches compare users_data_search_text(nome), the lowercased and unaccented name indexed
+# by database/migrations/01_name_search.sql, with the search text normalized the same way.
+# Prefix matches come in index order; substring and fuzzy matches are ranked by similarity
+# among the first %s candidates, so a very common term cannot make the ranking read every match.
+SEARCH_USERS_DATA_PREFIX_QUERY = f"""
+    SELECT {ITEM_SELECT_COLUMNS} FROM users_data
+    WHERE users_data_search_text(nome) COLLATE "C" LIKE users_data_search_text(%s) || '%%'
+    ORDER BY users_data_search_text(nome) COLLATE "C", id
+    LIMIT %s
+"""
+
+SEARCH_USERS_DATA_SUBSTRING_QUERY = f"""
+    WITH candidates AS (
+        SELECT id, dataset_id, users_data_search_text(nome) AS search_text FROM users_data
+        WHERE users_data_search_text(nome) LIKE '%%' || users_data_search_text(%s) || '%%'
+        LIMIT %s
+    )
+    SELECT {ITEM_SELECT_COLUMNS} FROM candidates JOIN users_data USING (id, dataset_id)
+    ORDER BY similarity(candidates.search_text, users_data_search_text(%s)) DESC, id
+    LIMIT %s
+"""
+
+SEARCH_USERS_DATA_FUZZY_QUERY = f"""
+    WITH candidates AS (
+        SELECT id, dataset_id, users_data_search_text(nome) AS search_text FROM users_data
+        WHERE users_data_search_text(%s) <%% users_data_search_text(nome)
+        LIMIT %s
+    )
+    SELECT {ITEM_SELECT_COLUMNS} FROM candidates JOIN users_data USING (id, dataset_id)
+    ORDER BY word_similarity(users_data_search_text(%s), candidates.search_text) DESC, id
+    LIMIT %s
+"""
+
+SET_FUZZY_SEARCH_THRESHOLD_QUERY = """
+    SELECT set_config('pg_trgm.word_similarity_threshold', %s, true)
+"""
+
+SELECT_USERS_DATA_EXPORT_QUERY = f"""
+    SELECT {", ".join(USERS_DATA_COLUMNS)} FROM users_data WHERE {{where}}
+"""
+
+INGESTION_JOB_FIELDS = (
+    "id",
+    "status",
+    "file_name",
+    "engine",
+    "dataset_id",
+    "rows_processed",
+    "rows_rejected",
+    "rows_inserted",
+    "rows_updated",
+    "rows_per_second",
+    "error",
+    "created_at",
+    "started_at",
+    "finished_at",
+)
+
+INSERT_INGESTION_JOB_QUERY = """
+    INSERT INTO ingestion_jobs (
+        id, status, file_name, file_path, engine, content_hash, dataset_id, replaces_dataset_id, append
+    )
+    VALUES (%s, 'queued', %s, %s, %s, %s, %s, %s, %s)
+"""
+
+SELECT_INGESTION_JOB_QUERY = f"""
+    SELECT {", ".join(INGESTION_JOB_FIELDS)} FROM ingestion_jobs
+    WHERE id = %s
+"""
+
+# A worker holds the jobs it claims with a lease: it writes heartbeat_at on a timer while the job runs,
+# and a job whose heartbeat is older than the lease is put back in the queue by any worker.
+CLAIM_INGESTION_JOB_QUERY = """
+    UPDATE ingestion_jobs
+    SET status = 'running', worker_id = %s, started_at = now(), heartbeat_at = now(), updated_at = now()
+    WHERE id = (
+        SELECT id FROM ingestion_jobs
+        WHERE status = 'queued'
+        ORDER BY created_at
+        FOR UPDATE SKIP LOCKED
+        LIMIT 1
+    )
+    RETURNING id, file_name, file_path, engine, content_hash, dataset_id, replaces_dataset_id, append
+"""
+
+# The job updates below only apply while the worker still holds the lease of the job; no row is
+# returned once the job was put back in the queue and, maybe, claimed by another worker.
+UPDATE_INGESTION_JOB_PROGRESS_QUERY = """
+    UPDATE ingestion_jobs
+    SET rows_processed = %s, rows_rejected = %s, rows_per_second = %s, heartbeat_at = now(), updated_at = now()
+    WHERE id = %s AND worker_id = %s AND status IN ('running', 'cancelling')
+    RETURNING status
+"""
+
+RENEW_INGESTION_JOB_LEASE_QUERY = """
+    UPDATE ingestion_jobs
+    SET heartbeat_at = now()
+    WHERE id = %s AND worker_id = %s AND status IN ('running', 'cancelling')
+    RETURNING status
+"""
+
+FINISH_INGESTION_JOB_QUERY = """
+    UPDATE ingestion_jobs
+    SET status = %s, rows_processed = %s, rows_rejected = %s, rows_inserted = %s, rows_updated = %s,
+        rows_per_second = %s, error = %s,
+        finished_at = now(), updated_at = now()
+    WHERE id = %s AND worker_id = %s
+"""
+
+CANCEL_INGESTION_JOB_QUERY = """
+    UPDATE ingestion_jobs
+    SET status = CASE WHEN status = 'queued' THEN 'cancelled' ELSE 'cancelling' END,
+        finished_at = CASE WHEN status = 'queued' THEN now() END,
+        updated_at = now()
+    WHERE id = %s AND status IN ('queued', 'running')
+    RETURNING status, file_path, dataset_id, append
+"""
+
+REQUEUE_INGESTION_JOB_QUERY = """
+    UPDATE ingestion_jobs
+    SET status = 'queued', worker_id = NULL, heartbeat_at = NULL, rows_processed = 0, rows_rejected = 0,
+        started_at = NULL, updated_at = now()
+    WHERE id = %s AND worker_id = %s AND status = 'running'
+"""
+
+# Jobs claimed before leases existed have no heartbeat and are judged on their last update.
+# Returns the jobs put back in the queue, and the cancelled ones whose dataset and spooled file
+# are left to clean up.
+REQUEUE_STALE_INGESTION_JOBS_QUERY = """
+    UPDATE ingestion_jobs
+    SET status = CASE WHEN status = 'cancelling' THEN 'cancelled' ELSE 'queued' END,
+        finished_at = CASE WHEN status = 'cancelling' THEN now() END,
+        started_at = CASE WHEN status = 'cancelling' THEN started_at END,
+        worker_id = NULL, heartbeat_at = NULL, rows_processed = 0, rows_rejected = 0, updated_at = now()
+    WHERE status IN ('running', 'cancelling')
+      AND COALESCE(heartbeat_at, updated_at) < now() - make_interval(secs => %s)
+    RETURNING id, status, file_path, dataset_id, append
+"""
+
+# Datasets of database/migrations/02_datasets.sql. The row count of a dataset is read from the
+# trigger-maintained users_data_row_count, so listing datasets does not scan their partitions.
+DATASET_FIELDS = (
+    "id",
+    "status",
+    "file_name",
+    "content_hash",
+    "upload_id",
+    "rows",
+    "created_at",
+    "updated_at",
+)
+
+SELECT_DATASETS_QUERY = """
+    SELECT datasets.id, status, file_name, content_hash, upload_id, COALESCE(row_counts.rows, 0),
+        created_at, updated_at
+    FROM datasets
+    LEFT JOIN (
+        SELECT dataset_id, SUM(delta)::BIGINT AS rows FROM users_data_row_count
+        GROUP BY dataset_id
+    ) AS row_counts ON row_counts.dataset_id = datasets.id
+    WHERE {where}
+    ORDER BY datasets.id
+"""
+
+COUNT_DATASETS_QUERY = """
+    SELECT COUNT(*) FROM datasets
+"""
+
+LOCK_DATASET_CREATION_QUERY = """
+    SELECT pg_advisory_xact_lock(hashtext('datasets'))
+"""
+
+INSERT_DATASET_QUERY = """
+    INSERT INTO datasets (status, file_name, content_hash, upload_id)
+    VALUES ('loading', %s, %s, %s)
+    RETURNING id
+"""
+
+# A new partition is created empty and attached afterwards: attaching only takes a SHARE UPDATE
+# EXCLUSIVE lock on users_data, so it does not wait for, or block, the reads and writes of the
+# other datasets, and an empty table is validated at once.
+CREATE_DATASET_PARTITION_QUERIES = (
+    "CREATE TABLE {table} (LIKE users_data INCLUDING DEFAULTS INCLUDING GENERATED)",
+    "ALTER TABLE users_data ATTACH PARTITION {table} FOR VALUES IN ({dataset_id})",
+)
+
+SELECT_DATASET_IDS_BY_STATUS_QUERY = """
+    SELECT id FROM datasets WHERE status = %s ORDER BY id
+"""
+
+UPDATE_DATASET_STATUS_QUERY = """
+    UPDATE datasets SET status = %s, updated_at = now()
+    WHERE id = %s
+"""
+
+SET_LOCK_TIMEOUT_QUERY = """
+    SELECT set_config('lock_timeout', %s, true)
+"""
+
+# Dropping a partition skips the row triggers, so the deltas and the ingested file records of the
+# dataset, including the files appended to it, are deleted in the same transaction.
+DELETE_DATASET_QUERY = """
+    DELETE FROM datasets WHERE id = %s RETURNING upload_id
+"""
+
+DROP_DATASET_PARTITION_QUERY = """
+    DROP TABLE IF EXISTS {table}
+"""
+
+DELETE_DATASET_RECORDS_QUERIES = (
+    "DELETE FROM users_data_row_count WHERE dataset_id = %(dataset_id)s",
+    "DELETE FROM users_data_stats WHERE dataset_id = %(dataset_id)s",
+    "DELETE FROM ingested_files WHERE upload_id = %(upload_id)s OR dataset_id = %(dataset_id)s",
+)
@@ -0,0 +1,30 @@
+import os
+
+from .csv_uploader_repository import ResumeConnectionHandler
+from .threaded_repository import ThreadedResumeConnectionHandler
+
+
+REPOSITORY_HANDLERS = {
+    "blocking": ResumeConnectionHandler,
+    "threaded": ThreadedResumeConnectionHandler,
+}
+
+
+def create_repository() -> ResumeConnectionHandler:
+    """
+    Builds the repository selected by the DB_HANDLER environment variable.
+
+    "threaded" (the default) runs the database calls in a worker thread pool, "blocking"
+    runs them directly on the event loop.
+
+    Raises:
+        ValueError: If DB_HANDLER names an unknown handler.
+    """
+    handler = os.environ.get("DB_HANDLER", "threaded")
+    try:
+        handler_class = REPOSITORY_HANDLERS[handler]
+    except KeyError as error:
+        raise ValueError(
+            f"Unknown DB_HANDLER '{handler}'. Available handlers: {', '.join(REPOSITORY_HANDLERS)}"
+        ) from error
+    return handler_class()
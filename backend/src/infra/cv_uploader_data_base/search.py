@@ -0,0 +1,67 @@
+import os
+from typing import Any, List, Tuple
+
+from .querys import (
+    SEARCH_USERS_DATA_FUZZY_QUERY,
+    SEARCH_USERS_DATA_PREFIX_QUERY,
+    SEARCH_USERS_DATA_SUBSTRING_QUERY,
+)
+
+SEARCH_MODES = ("prefix", "substring", "fuzzy")
+
+SEARCH_MAX_LIMIT = int(os.environ.get("SEARCH_MAX_LIMIT", "50"))
+
+# Matches read before ranking substring and fuzzy searches
+SEARCH_CANDIDATES = int(os.environ.get("SEARCH_CANDIDATES", "1000"))
+
+# Minimum pg_trgm word similarity of a fuzzy match, between 0 and 1
+SEARCH_FUZZY_THRESHOLD = float(os.environ.get("SEARCH_FUZZY_THRESHOLD", "0.5"))
+
+
+class InvalidSearchError(ValueError):
+    """Raised when a search has an empty text, an unknown mode or an invalid limit."""
+
+
+def escape_like(text: str) -> str:
+    """
+    Escapes the LIKE wildcards of a search text, so it is matched literally.
+    """
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def validate_search(text: str, mode: str, limit: int) -> str:
+    """
+    Returns:
+        str: The search text without surrounding whitespace.
+
+    Raises:
+        InvalidSearchError: If the text is empty, or the mode or limit is invalid.
+    """
+    text = text.strip()
+    if not text:
+        raise InvalidSearchError("The search text must not be empty")
+    if mode not in SEARCH_MODES:
+        raise InvalidSearchError(f"Invalid search mode '{mode}'. Available modes: {', '.join(SEARCH_MODES)}")
+    if not 1 <= limit <= SEARCH_MAX_LIMIT:
+        raise InvalidSearchError(f"The search limit must be between 1 and {SEARCH_MAX_LIMIT}")
+    return text
+
+
+def build_search_query(text: str, mode: str, limit: int) -> Tuple[str, List[Any]]:
+    """
+    Builds the query of a case- and accent-insensitive search on nome.
+
+    Args:
+        text (str): The text to search for, already checked with validate_search.
+        mode (str): "prefix" matches the names starting with the text, "substring" the names
+            containing it, and "fuzzy" the names with a word similar to it, to tolerate typos.
+        limit (int): The maximum number of results.
+
+    Returns:
+        Tuple[str, List[Any]]: The query and its parameters.
+    """
+    if mode == "prefix":
+        return SEARCH_USERS_DATA_PREFIX_QUERY, [escape_like(text), limit]
+    if mode == "substring":
+        return SEARCH_USERS_DATA_SUBSTRING_QUERY, [escape_like(text), SEARCH_CANDIDATES, text, limit]
+    return SEARCH_USERS_DATA_FUZZY_QUERY, [text, SEARCH_CANDIDATES, text, limit]
@@ -0,0 +1,56 @@
+import os
+import asyncio
+import threading
+from functools import partial
+from typing import Callable, TypeVar
+from concurrent.futures import ThreadPoolExecutor
+
+from ..connection_pool import ConnectionPool
+
+from .csv_uploader_repository import ResumeConnectionHandler
+
+T = TypeVar("T")
+
+_executor: ThreadPoolExecutor | None = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """
+    Returns the process-wide executor used for database calls, creating it lazily.
+
+    Its size comes from DB_EXECUTOR_MAX_WORKERS and defaults to DB_POOL_MAX_SIZE, so threads
+    never wait on the connection pool for long.
+    """
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                max_workers = int(
+                    os.environ.get("DB_EXECUTOR_MAX_WORKERS", os.environ.get("DB_POOL_MAX_SIZE", "10"))
+                )
+                _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="db")
+    return _executor
+
+
+def shutdown_executor() -> None:
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+            _executor = None
+
+
+class ThreadedResumeConnectionHandler(ResumeConnectionHandler):
+    """
+    ResumeConnectionHandler that runs every blocking psycopg2 call in a bounded thread pool,
+    so a long query or upload does not stall the event loop for other requests.
+    """
+
+    def __init__(self, pool: ConnectionPool | None = None, executor: ThreadPoolExecutor | None = None):
+        super().__init__(pool)
+        self.executor = executor if executor is not None else get_executor()
+
+    async def _run(self, func: Callable[..., T], *args) -> T:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, partial(func, *args))
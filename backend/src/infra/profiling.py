@@ -0,0 +1,99 @@
+import os
+import sys
+import time
+import threading
+import tempfile
+from collections import Counter
+from typing import Dict
+
+
+PROFILING_ENABLED = os.environ.get("PROFILING_ENABLED", "false").lower() in ("1", "true", "yes")
+PROFILE_DIR = os.environ.get("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "csv_uploader_profiles"))
+PROFILE_SAMPLE_INTERVAL = float(os.environ.get("PROFILE_SAMPLE_INTERVAL", "0.005"))
+
+# Only one request is profiled at a time, so concurrent profiles do not sample each other.
+_profile_lock = threading.Lock()
+
+
+class StackSampler:
+    """
+    Sampling profiler of every thread of the process.
+
+    A background thread records the stack of every other thread every interval seconds, so the
+    work a request hands to the database executor or to other threads is captured too, unlike
+    with cProfile. Idle threads show up waiting, which helps telling CPU from waits apart.
+    The threads are not filtered: the event loop and the executors are shared by all requests,
+    so the work of the requests running meanwhile is recorded as well. The root of each stack
+    is the thread name, which tells the event loop, the database executor and the other pools apart.
+    The result is written in the folded stack format read by flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, name: str, interval: float = PROFILE_SAMPLE_INTERVAL) -> None:
+        self.path = os.path.join(PROFILE_DIR, f"{time.strftime('%Y%m%dT%H%M%S')}-{name}.folded")
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        names: Dict[int, str] = {}
+        while not self._stop.is_set():
+            for thread in threading.enumerate():
+                names.setdefault(thread.ident, thread.name)
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                self.samples[";".join(reversed(stack))] += 1
+            self._stop.wait(self.interval)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def write(self) -> None:
+        """
+        Writes the samples as folded stacks to self.path, in PROFILE_DIR.
+        """
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        with open(self.path, "w", encoding="utf-8") as file:
+            for stack, count in self.samples.most_common():
+                file.write(f"{stack} {count}\n")
+
+
+def try_start_profile(name: str) -> StackSampler | None:
+    """
+    Starts a StackSampler unless another request is already being profiled.
+
+    Args:
+        name (str): Identifies the profile in the name of its file.
+
+    Returns:
+        StackSampler | None: The running sampler, to be finished with finish_profile, or None.
+    """
+    if not _profile_lock.acquire(blocking=False):
+        return None
+    sampler = StackSampler(name)
+    sampler.start()
+    return sampler
+
+
+def finish_profile(sampler: StackSampler) -> None:
+    """
+    Stops a sampler started by try_start_profile, writes its profile and lets another request be
+    profiled. Blocks while the sampler thread exits and the file is written.
+    """
+    try:
+        sampler.stop()
+        sampler.write()
+    finally:
+        _profile_lock.release()
@@ -0,0 +1,415 @@
+import os
+import time
+import pickle
+import sqlite3
+import logging
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Set, Tuple
+
+
+class QueryCache(ABC):
+    """
+    Read-through cache of query results with a TTL, LRU eviction and a memory bound.
+
+    Values are stored pickled, so every get returns a fresh copy that callers may modify, and
+    the size of each entry is known exactly.
+
+    Entries are scoped to the dataset they were read from, or unscoped when they cover all of
+    users_data. A write to some datasets only drops the entries of those datasets and the
+    unscoped ones. Every scope has a generation that writes bump: a value computed before an
+    invalidation of its scope is not stored, so results read before a write commits can never
+    outlive it.
+    """
+    backend = ""
+
+    def __init__(self, ttl: float, max_bytes: int) -> None:
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._stats_lock = threading.Lock()
+
+    def get(self, key: str) -> Any | None:
+        try:
+            data = self._get(key, time.time())
+        except Exception as error:
+            logging.error("Failed to read from the query cache. Error: %s", error)
+            data = None
+        with self._stats_lock:
+            if data is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return None if data is None else pickle.loads(data)
+
+    def set(self, key: str, value: Any, generation: Tuple[int, int], dataset_id: int | None = None) -> None:
+        """
+        Stores a value of the dataset_id scope computed while the scope was at the given generation.
+        The value is dropped if the scope was invalidated since, or if it is larger than the whole cache.
+        """
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if len(data) > self.max_bytes:
+            return
+        try:
+            self._set(key, data, generation, dataset_id, time.time() + self.ttl)
+        except Exception as error:
+            logging.error("Failed to write to the query cache. Error: %s", error)
+
+    def invalidate(self, dataset_ids: Iterable[int] | None = None) -> None:
+        """
+        Drops the entries of the given datasets and the unscoped entries, or every entry if
+        dataset_ids is None. Called after a write to users_data commits.
+        """
+        try:
+            self._invalidate(None if dataset_ids is None else sorted(set(dataset_ids)))
+        except Exception as error:
+            logging.error("Failed to invalidate the query cache. Error: %s", error)
+            return
+        with self._stats_lock:
+            self.invalidations += 1
+
+    def stats(self) -> dict:
+        entries, size = self._size()
+        with self._stats_lock:
+            requests = self.hits + self.misses
+            return {
+                "backend": self.backend,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / requests if requests else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "entries": entries,
+                "bytes": size,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl,
+            }
+
+    def close(self) -> None:
+        pass
+
+    def _count_evictions(self, count: int) -> None:
+        with self._stats_lock:
+            self.evictions += count
+
+    @abstractmethod
+    def generation(self, dataset_id: int | None = None) -> Tuple[int, int]:
+        """
+        Returns the generation of the dataset_id scope, to be given back to set().
+        """
+        raise NotImplementedError("Should implement generation()")
+
+    @abstractmethod
+    def _get(self, key: str, now: float) -> bytes | None:
+        raise NotImplementedError("Should implement _get()")
+
+    @abstractmethod
+    def _set(self, key: str, data: bytes, generation: Tuple[int, int], dataset_id: int | None, expires_at: float) -> None:
+        raise NotImplementedError("Should implement _set()")
+
+    @abstractmethod
+    def _invalidate(self, dataset_ids: List[int] | None) -> None:
+        raise NotImplementedError("Should implement _invalidate()")
+
+    @abstractmethod
+    def _size(self) -> Tuple[int, int]:
+        raise NotImplementedError("Should implement _size()")
+
+
+class NullQueryCache(QueryCache):
+    """Cache that stores nothing, used when caching is disabled."""
+    backend = "none"
+
+    def generation(self, dataset_id: int | None = None) -> Tuple[int, int]:
+        return 0, 0
+
+    def _get(self, key: str, now: float) -> bytes | None:
+        return None
+
+    def _set(self, key: str, data: bytes, generation: Tuple[int, int], dataset_id: int | None, expires_at: float) -> None:
+        pass
+
+    def _invalidate(self, dataset_ids: List[int] | None) -> None:
+        pass
+
+    def _size(self) -> Tuple[int, int]:
+        return 0, 0
+
+
+class MemoryQueryCache(QueryCache):
+    """
+    In-process cache. Each uvicorn worker has its own, so a write made by another worker is only
+    seen here once the entries expire.
+    """
+    backend = "memory"
+
+    def __init__(self, ttl: float, max_bytes: int) -> None:
+        super().__init__(ttl, max_bytes)
+        self._entries: OrderedDict = OrderedDict()
+        self._scopes: Dict[int | None, Set[str]] = {}
+        self._bytes = 0
+        # Bumped when every entry is dropped, which resets the generations of all scopes
+        self._epoch = 0
+        self._generations: Dict[int | None, int] = {}
+        self._lock = threading.Lock()
+
+    def generation(self, dataset_id: int | None = None) -> Tuple[int, int]:
+        with self._lock:
+            return self._epoch, self._generations.get(dataset_id, 0)
+
+    def _get(self, key: str, now: float) -> bytes | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, data, _ = entry
+            if expires_at <= now:
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return data
+
+    def _set(self, key: str, data: bytes, generation: Tuple[int, int], dataset_id: int | None, expires_at: float) -> None:
+        evicted = 0
+        with self._lock:
+            if generation != (self._epoch, self._generations.get(dataset_id, 0)):
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (expires_at, data, dataset_id)
+            self._scopes.setdefault(dataset_id, set()).add(key)
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                evicted += 1
+        if evicted:
+            self._count_evictions(evicted)
+
+    def _remove(self, key: str) -> None:
+        _, data, dataset_id = self._entries.pop(key)
+        self._bytes -= len(data)
+        keys = self._scopes[dataset_id]
+        keys.discard(key)
+        if not keys:
+            del self._scopes[dataset_id]
+
+    def _invalidate(self, dataset_ids: List[int] | None) -> None:
+        with self._lock:
+            if dataset_ids is None:
+                self._epoch += 1
+                self._generations.clear()
+                self._entries.clear()
+                self._scopes.clear()
+                self._bytes = 0
+                return
+            for dataset_id in (None, *dataset_ids):
+                self._generations[dataset_id] = self._generations.get(dataset_id, 0) + 1
+                for key in list(self._scopes.get(dataset_id, ())):
+                    self._remove(key)
+
+    def _size(self) -> Tuple[int, int]:
+        with self._lock:
+            return len(self._entries), self._bytes
+
+
+class SqliteQueryCache(QueryCache):
+    """
+    Cache stored in a local SQLite database, shared by every worker process of the host, so an
+    invalidation made by one worker is seen by all of them. Hit and miss counters are per process.
+
+    The generations are stored by scope: 0 for the unscoped entries, the dataset ID for the others
+    and -1 for the epoch, bumped when every entry is dropped.
+
+    Eviction is an approximate LRU: a hit only updates the access time of an entry once it is
+    older than touch_interval seconds, so most reads never wait for the SQLite write lock.
+    Expired entries are not deleted by reads either, but by the next write.
+    """
+    backend = "sqlite"
+    # Files created with another schema are emptied, since a cache can always be rebuilt
+    schema_version = 2
+    unscoped = 0
+    epoch_scope = -1
+
+    def __init__(self, ttl: float, max_bytes: int, path: str, touch_interval: float | None = None) -> None:
+        super().__init__(ttl, max_bytes)
+        self.path = path
+        self.touch_interval = ttl / 10 if touch_interval is None else touch_interval
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=5, isolation_level=None, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        connection = self._connection
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            if connection.execute("PRAGMA user_version").fetchone()[0] != self.schema_version:
+                for table in ("cache_entries", "cache_generation", "cache_generations"):
+                    connection.execute(f"DROP TABLE IF EXISTS {table}")
+                connection.execute(f"PRAGMA user_version = {self.schema_version}")
+            connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS cache_entries (
+                    key TEXT PRIMARY KEY,
+                    value BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    scope INTEGER NOT NULL,
+                    expires_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+                """
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS cache_entries_accessed_at_idx ON cache_entries (accessed_at)")
+            connection.execute("CREATE INDEX IF NOT EXISTS cache_entries_scope_idx ON cache_entries (scope)")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache_generations (scope INTEGER PRIMARY KEY, value INTEGER NOT NULL)"
+            )
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+    def _scope(self, dataset_id: int | None) -> int:
+        return self.unscoped if dataset_id is None else dataset_id
+
+    def _generation(self, scope: int) -> Tuple[int, int]:
+        values = dict(self._connection.execute(
+            "SELECT scope, value FROM cache_generations WHERE scope IN (?, ?)", (self.epoch_scope, scope)
+        ).fetchall())
+        return values.get(self.epoch_scope, 0), values.get(scope, 0)
+
+    def generation(self, dataset_id: int | None = None) -> Tuple[int, int]:
+        with self._lock:
+            return self._generation(self._scope(dataset_id))
+
+    def _get(self, key: str, now: float) -> bytes | None:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value, expires_at, accessed_at FROM cache_entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or row[1] <= now:
+                return None
+            if now - row[2] > self.touch_interval:
+                self._connection.execute("UPDATE cache_entries SET accessed_at = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def _set(self, key: str, data: bytes, generation: Tuple[int, int], dataset_id: int | None, expires_at: float) -> None:
+        scope = self._scope(dataset_id)
+        with self._lock:
+            connection = self._connection
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                if self._generation(scope) != tuple(generation):
+                    connection.execute("ROLLBACK")
+                    return
+                connection.execute(
+                    "INSERT OR REPLACE INTO cache_entries (key, value, size, scope, expires_at, accessed_at)"
+                    " VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, data, len(data), scope, expires_at, time.time())
+                )
+                connection.execute("DELETE FROM cache_entries WHERE expires_at <= ?", (time.time(),))
+                evicted = self._evict(connection)
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+        if evicted:
+            self._count_evictions(evicted)
+
+    def _evict(self, connection) -> int:
+        total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM cache_entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return 0
+        evicted = 0
+        for key, size in connection.execute("SELECT key, size FROM cache_entries ORDER BY accessed_at").fetchall():
+            connection.execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+            evicted += 1
+            total -= size
+            if total <= self.max_bytes:
+                break
+        return evicted
+
+    def _invalidate(self, dataset_ids: List[int] | None) -> None:
+        with self._lock:
+            connection = self._connection
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                if dataset_ids is None:
+                    scopes = [self.epoch_scope]
+                    connection.execute("DELETE FROM cache_generations WHERE scope <> ?", (self.epoch_scope,))
+                    connection.execute("DELETE FROM cache_entries")
+                else:
+                    scopes = [self.unscoped, *dataset_ids]
+                    placeholders = ", ".join("?" * len(scopes))
+                    connection.execute(f"DELETE FROM cache_entries WHERE scope IN ({placeholders})", scopes)
+                connection.executemany(
+                    "INSERT INTO cache_generations (scope, value) VALUES (?, 1)"
+                    " ON CONFLICT (scope) DO UPDATE SET value = value + 1",
+                    [(scope,) for scope in scopes]
+                )
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                raise
+
+    def _size(self) -> Tuple[int, int]:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM cache_entries").fetchone()
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+
+QUERY_CACHE_BACKENDS = ("memory", "sqlite", "none")
+
+_cache: QueryCache | None = None
+_cache_lock = threading.Lock()
+
+
+def create_cache_from_env() -> QueryCache:
+    """
+    Creates the query cache configured by QUERY_CACHE_BACKEND ("memory", "sqlite" or "none"),
+    QUERY_CACHE_TTL, QUERY_CACHE_MAX_BYTES and, for the sqlite backend, QUERY_CACHE_PATH.
+    """
+    backend = os.environ.get("QUERY_CACHE_BACKEND", "memory")
+    ttl = float(os.environ.get("QUERY_CACHE_TTL", "30"))
+    max_bytes = int(os.environ.get("QUERY_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+    if backend == "memory":
+        return MemoryQueryCache(ttl, max_bytes)
+    if backend == "sqlite":
+        path = os.environ.get("QUERY_CACHE_PATH", os.path.join(tempfile.gettempdir(), "csv_uploader_cache.sqlite3"))
+        try:
+            return SqliteQueryCache(ttl, max_bytes, path)
+        except sqlite3.Error as error:
+            logging.error("Failed to open the query cache at %s, caching in memory instead. Error: %s", path, error)
+            return MemoryQueryCache(ttl, max_bytes)
+    if backend != "none":
+        logging.error(
+            "Unknown query cache backend '%s', caching is disabled. Available backends: %s",
+            backend, ", ".join(QUERY_CACHE_BACKENDS)
+        )
+    return NullQueryCache(ttl, max_bytes)
+
+
+def get_query_cache() -> QueryCache:
+    """
+    Returns the process-wide query cache, creating it lazily.
+    """
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = create_cache_from_env()
+    return _cache
+
+
+def close_query_cache() -> None:
+    global _cache
+    with _cache_lock:
+        if _cache is not None:
+            _cache.close()
+            _cache = None
@@ -0,0 +1,61 @@
+import time
+import logging
+from uuid import uuid4
+
+from starlette.concurrency import run_in_threadpool
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from ..infra.metrics import HTTP_REQUEST_SECONDS
+from ..infra.profiling import PROFILING_ENABLED, finish_profile, try_start_profile
+
+PROFILE_REQUEST_HEADER = b"x-profile"
+PROFILE_FILE_HEADER = b"x-profile-file"
+
+
+class RequestMetricsMiddleware:
+    """
+    Records the latency of every HTTP request in HTTP_REQUEST_SECONDS, labelled with the method,
+    the route template (not the raw path, to keep the number of series bounded) and the status.
+
+    The time runs until the last byte of the response body is sent, so streamed exports are
+    measured in full. It is a plain ASGI middleware, so responses are not buffered.
+
+    When PROFILING_ENABLED is set, a request sent with the "X-Profile: 1" header is profiled with
+    a StackSampler and the path of the profile is returned in the "X-Profile-File" header. The
+    sampler records every thread of the process, so the profile also holds the requests served
+    concurrently; profile on an otherwise idle worker to get the cost of a single request.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        sampler = None
+        if PROFILING_ENABLED and dict(scope["headers"]).get(PROFILE_REQUEST_HEADER) == b"1":
+            sampler = try_start_profile(uuid4().hex[:12])
+        status_code = 500
+
+        async def send_with_metrics(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if sampler:
+                    message["headers"] = [*message.get("headers", []), (PROFILE_FILE_HEADER, sampler.path.encode())]
+            await send(message)
+
+        started_at = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            route = getattr(scope.get("route"), "path", "unmatched")
+            HTTP_REQUEST_SECONDS.observe(
+                time.perf_counter() - started_at, method=scope["method"], route=route, status=str(status_code)
+            )
+            if sampler:
+                # Stopping the sampler joins its thread and writing the profile is file I/O
+                await run_in_threadpool(finish_profile, sampler)
+                logging.info("Profile of %s %s written to %s", scope["method"], route, sampler.path)
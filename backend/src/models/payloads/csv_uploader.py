@@ -1,7 +1,14 @@
-from datetime import datetime
+from typing import List, Tuple
+
 from pydantic import BaseModel
 from fastapi import HTTPException
 
+from ...date_parser import is_valid_date, parse_date
+from ...infra.cv_uploader_data_base.datasets import DEFAULT_DATASET_ID
+from ...infra.cv_uploader_data_base.querys import FIELD_MAX_LENGTHS, USERS_DATA_COLUMNS
+
+DATE_FIELDS = ("data_nascimento", "data_criacao", "data_atualizacao")
+
 
 class AddItemPayload(BaseModel):
     nome: str
@@ -13,13 +20,8 @@ class AddItemPayload(BaseModel):
 
     @classmethod
     def validate_date_format(cls, value) -> None:
-        try:
-            datetime.strptime(value, '%Y/%m/%d')
-        except ValueError:
-            try:
-                datetime.strptime(value, '%d/%m/%Y')
-            except ValueError as error:
-                raise HTTPException(status_code=400, detail=f"Invalid field format: {value}") from error
+        if not is_valid_date(value):
+            raise HTTPException(status_code=400, detail=f"Invalid field format: {value}")
 
         
     @classmethod
@@ -27,3 +29,46 @@ class AddItemPayload(BaseModel):
         cls.validate_date_format(data_nascimento)
         cls.validate_date_format(data_criacao)
         cls.validate_date_format(data_atualizacao)
+
+    def validation_error(self) -> str | None:
+        """
+        Checks the payload with the rules of validate_fields and the VARCHAR limits of the table,
+        without raising, so a batch can report every invalid item at once.
+
+        Returns:
+            str | None: Why the payload is invalid, or None if it is valid.
+        """
+        for field in DATE_FIELDS:
+            value = getattr(self, field)
+            if not is_valid_date(value):
+                return f"Invalid field format: {value}"
+        for field, max_length in FIELD_MAX_LENGTHS.items():
+            if len(getattr(self, field)) > max_length:
+                return f"{field} is longer than {max_length} characters"
+        return None
+
+    def to_row(self) -> Tuple:
+        """
+        Returns the payload values in USERS_DATA_COLUMNS order, with the dates parsed.
+        """
+        return tuple(
+            parse_date(getattr(self, column)) if column in DATE_FIELDS else getattr(self, column)
+            for column in USERS_DATA_COLUMNS
+        )
+
+
+class UpdateItemPayload(AddItemPayload):
+    id: int
+    dataset_id: int = DEFAULT_DATASET_ID
+
+
+class DeleteItemsPayload(BaseModel):
+    ids: List[int]
+    dataset_id: int = DEFAULT_DATASET_ID
+
+
+class CreateUploadPayload(BaseModel):
+    size: int
+    file_name: str | None = None
+    engine: str | None = None
+    sha256: str | None = None
@@ -1,4 +1,5 @@
-from typing import List
+from typing import Dict, List
+from datetime import datetime
 from pydantic import BaseModel, RootModel
 
 
@@ -6,6 +7,100 @@ class CsvUploaderResponse(BaseModel):
     message: str
 
 
+class CsvUploadResponse(CsvUploaderResponse):
+    upload_id: str
+    dataset_id: int
+    engine: str
+    rows: int
+    rows_rejected: int
+    rows_inserted: int
+    rows_updated: int
+    rows_unchanged: int
+    rejects_url: str | None = None
+    elapsed_seconds: float
+    rows_per_second: float
+    replaced_dataset_id: int | None = None
+    replaced_dataset_status: str | None = None
+
+
+class CsvDuplicateUploadResponse(CsvUploaderResponse):
+    upload_id: str
+    content_hash: str
+    ingested_at: datetime
+
+
+class CsvUploadJobResponse(CsvUploaderResponse):
+    job_id: str
+    dataset_id: int
+    status: str
+
+
+class UploadSessionResponse(BaseModel):
+    id: str
+    file_name: str | None
+    size: int
+    offset: int
+    engine: str
+    expires_at: datetime
+
+
+class IngestionJobResponse(BaseModel):
+    id: str
+    status: str
+    file_name: str | None
+    engine: str
+    dataset_id: int | None
+    rows_processed: int
+    rows_rejected: int
+    rows_inserted: int
+    rows_updated: int
+    rejects_url: str | None = None
+    rows_per_second: float | None
+    error: str | None
+    created_at: datetime
+    started_at: datetime | None
+    finished_at: datetime | None
+
+
+class DatasetResponse(BaseModel):
+    id: int
+    status: str
+    file_name: str | None
+    content_hash: str | None
+    upload_id: str | None
+    rows: int
+    created_at: datetime
+    updated_at: datetime
+
+
+class CacheStatsResponse(BaseModel):
+    backend: str
+    hits: int
+    misses: int
+    hit_ratio: float
+    evictions: int
+    invalidations: int
+    entries: int
+    bytes: int
+    max_bytes: int
+    ttl_seconds: float
+
+
+class StatsBucket(BaseModel):
+    value: str | None
+    count: int
+
+
+class StatsResponse(BaseModel):
+    total: int
+    dimensions: Dict[str, List[StatsBucket]]
+
+
+class StatsRebuildResponse(CsvUploaderResponse):
+    rows: int
+    elapsed_seconds: float
+
+
 class CsvUploaderResponseAllItems(BaseModel):
     id: int
     nome: str
@@ -14,6 +109,21 @@ class CsvUploaderResponseAllItems(BaseModel):
     genero: str
     data_criacao: str
     data_atualizacao: str
+    dataset_id: int
 
 class ListResponseAllItems(RootModel[List[CsvUploaderResponseAllItems]]):
-    pass
\ No newline at end of file
+    pass
+
+
+class BulkItemResult(BaseModel):
+    index: int
+    status: str
+    id: int | None
+    item: CsvUploaderResponseAllItems | None
+    error: str | None
+
+
+class BulkWriteResponse(BaseModel):
+    succeeded: int
+    failed: int
+    results: List[BulkItemResult]
\ No newline at end of file
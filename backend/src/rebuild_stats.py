@@ -0,0 +1,41 @@
+"""
+Recomputes the trigger-maintained aggregates of users_data (users_data_stats and
+users_data_row_count) from scratch, for instance after restoring a dump or loading rows with
+triggers disabled. The same rebuild is available as POST /csv-uploader/api/stats/rebuild.
+
+Run from the backend directory, with the usual DB_* variables:
+    python -m src.rebuild_stats
+"""
+import sys
+import asyncio
+import logging
+
+from fastapi import HTTPException
+
+from .infra.connection_pool import close_pool
+from .infra.query_cache import close_query_cache
+from .infra.cv_uploader_data_base.threaded_repository import shutdown_executor
+from .services.csv_uploader_service import CsvUploaderService
+
+
+async def rebuild() -> None:
+    result = await CsvUploaderService().rebuild_stats()
+    print(f"Rebuilt stats of {result.rows:,} rows in {result.elapsed_seconds:.2f}s")
+
+
+def main() -> int:
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(rebuild())
+    except HTTPException as error:
+        print(error.detail, file=sys.stderr)
+        return 1
+    finally:
+        shutdown_executor()
+        close_pool()
+        close_query_cache()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
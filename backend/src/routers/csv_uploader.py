@@ -1,84 +1,360 @@
 import logging
+from uuid import UUID
 from typing import List, Union
 
 from fastapi import (
     APIRouter,
+    Depends,
+    Query,
     Request,
+    Response,
     File,
+    Header,
     UploadFile
 )
-from fastapi.responses import StreamingResponse
+from fastapi.responses import FileResponse, StreamingResponse
 
-from ..models.payloads.csv_uploader import AddItemPayload
+from ..models.payloads.csv_uploader import AddItemPayload, CreateUploadPayload, DeleteItemsPayload, UpdateItemPayload
 
+from ..infra.cv_uploader_data_base.datasets import DEFAULT_DATASET_ID
+from ..infra.cv_uploader_data_base.pagination import Page
 from ..services.csv_uploader_service import CsvUploaderService
+from ..services.serialization import json_response
 from ..models.responses.csv_uploader import (
-    CsvUploaderResponse,
+    BulkWriteResponse,
+    CacheStatsResponse,
+    CsvDuplicateUploadResponse,
+    CsvUploadJobResponse,
+    CsvUploadResponse,
     CsvUploaderResponseAllItems,
+    DatasetResponse,
+    IngestionJobResponse,
+    StatsRebuildResponse,
+    StatsResponse,
+    UploadSessionResponse,
 )
 
+from .dependencies import get_service
+
 router = APIRouter(tags=["CSV Uploader"])
 
+# Query parameters of /csv-file that are not filters
+EXPORT_PARAMS = ("compression", "format", "updated_since")
+
+
+def page_response(content, page: Page) -> Response:
+    response = json_response(content)
+    if page.next_cursor:
+        response.headers["next_cursor"] = page.next_cursor
+    if page.prev_cursor:
+        response.headers["prev_cursor"] = page.prev_cursor
+    return response
+
+
+def with_rejects_url(request: Request, result, upload_id: str, rows_rejected: int):
+    if rows_rejected:
+        result.rejects_url = str(request.url_for("get_rejects_file", upload_id=upload_id))
+    return result
+
+
 @router.post("/upload-csv-file")
-async def upload_csv(file: UploadFile = File(...)) -> CsvUploaderResponse:
-    logging.info("Uploading CSV file")
-    service = CsvUploaderService()
-    return await service.upload_csv(file)
+async def upload_csv(
+    request: Request,
+    response: Response,
+    file: UploadFile = File(...),
+    engine: str | None = None,
+    background: bool = True,
+    force: bool = False,
+    replace: int | None = None,
+    dataset_id: int | None = None,
+    new_dataset: bool = False,
+    service: CsvUploaderService = Depends(get_service)
+) -> CsvUploadJobResponse | CsvUploadResponse | CsvDuplicateUploadResponse:
+    logging.info("Uploading CSV file. Dataset: %s", dataset_id)
+    if background:
+        result = await service.submit_csv(file, engine, force, replace, dataset_id, new_dataset)
+        if isinstance(result, CsvUploadJobResponse):
+            response.status_code = 202
+        return result
+    result = await service.upload_csv(file, engine, force, replace, dataset_id, new_dataset)
+    if isinstance(result, CsvUploadResponse):
+        return with_rejects_url(request, result, result.upload_id, result.rows_rejected)
+    return result
+
+
+@router.post("/uploads", status_code=201)
+async def create_upload_session(
+    payload: CreateUploadPayload,
+    service: CsvUploaderService = Depends(get_service)
+) -> UploadSessionResponse:
+    logging.info("Creating upload session. File: %s, Size: %s", payload.file_name, payload.size)
+    return await service.create_upload_session(payload)
+
+
+def with_upload_offset(response: Response, session: UploadSessionResponse) -> UploadSessionResponse:
+    response.headers["Upload-Offset"] = str(session.offset)
+    return session
+
+
+@router.api_route("/uploads/{upload_id}", methods=["GET", "HEAD"])
+async def get_upload_session(
+    response: Response,
+    upload_id: UUID,
+    service: CsvUploaderService = Depends(get_service)
+) -> UploadSessionResponse:
+    logging.info("Getting upload session. ID: %s", upload_id)
+    session = await service.get_upload_session(str(upload_id))
+    return with_upload_offset(response, session)
+
+
+@router.put("/uploads/{upload_id}")
+async def upload_chunk(
+    request: Request,
+    response: Response,
+    upload_id: UUID,
+    content_range: str | None = Header(None),
+    x_chunk_sha256: str | None = Header(None),
+    service: CsvUploaderService = Depends(get_service)
+) -> UploadSessionResponse:
+    logging.info("Uploading chunk. ID: %s, Range: %s", upload_id, content_range)
+    session = await service.upload_chunk(str(upload_id), content_range, x_chunk_sha256, request.stream())
+    return with_upload_offset(response, session)
+
+
+@router.post("/uploads/{upload_id}/finalize")
+async def finalize_upload(
+    request: Request,
+    response: Response,
+    upload_id: UUID,
+    background: bool = True,
+    force: bool = False,
+    replace: int | None = None,
+    dataset_id: int | None = None,
+    new_dataset: bool = False,
+    service: CsvUploaderService = Depends(get_service)
+) -> CsvUploadJobResponse | CsvUploadResponse | CsvDuplicateUploadResponse:
+    logging.info("Finalizing upload. ID: %s, Dataset: %s", upload_id, dataset_id)
+    result = await service.finalize_upload(str(upload_id), background, force, replace, dataset_id, new_dataset)
+    if isinstance(result, CsvUploadJobResponse):
+        response.status_code = 202
+    if isinstance(result, CsvUploadResponse):
+        return with_rejects_url(request, result, result.upload_id, result.rows_rejected)
+    return result
+
+
+@router.delete("/uploads/{upload_id}", status_code=204)
+async def delete_upload_session(upload_id: UUID, service: CsvUploaderService = Depends(get_service)) -> None:
+    logging.info("Deleting upload session. ID: %s", upload_id)
+    await service.delete_upload_session(str(upload_id))
+
+
+@router.get("/jobs/{job_id}")
+async def get_ingestion_job(
+    request: Request,
+    job_id: UUID,
+    service: CsvUploaderService = Depends(get_service)
+) -> IngestionJobResponse:
+    logging.info("Getting ingestion job. ID: %s", job_id)
+    job = await service.get_ingestion_job(str(job_id))
+    return with_rejects_url(request, job, job.id, job.rows_rejected)
+
+
+@router.get("/rejects/{upload_id}")
+async def get_rejects_file(
+    upload_id: UUID,
+    service: CsvUploaderService = Depends(get_service)
+) -> FileResponse:
+    logging.info("Getting rejected rows. Upload ID: %s", upload_id)
+    return await service.get_rejects_file(str(upload_id))
+
+
+@router.post("/jobs/{job_id}/cancel")
+async def cancel_ingestion_job(
+    request: Request,
+    job_id: UUID,
+    service: CsvUploaderService = Depends(get_service)
+) -> IngestionJobResponse:
+    logging.info("Cancelling ingestion job. ID: %s", job_id)
+    job = await service.cancel_ingestion_job(str(job_id))
+    return with_rejects_url(request, job, job.id, job.rows_rejected)
 
 
-@router.post("/add-item")
-async def add_item(payload: AddItemPayload) -> CsvUploaderResponseAllItems:
+@router.get("/datasets")
+async def get_datasets(service: CsvUploaderService = Depends(get_service)) -> List[DatasetResponse]:
+    logging.info("Getting datasets")
+    return await service.get_datasets()
+
+
+@router.get("/datasets/{dataset_id}")
+async def get_dataset(dataset_id: int, service: CsvUploaderService = Depends(get_service)) -> DatasetResponse:
+    logging.info("Getting dataset. ID: %s", dataset_id)
+    return await service.get_dataset(dataset_id)
+
+
+@router.delete("/datasets/{dataset_id}", status_code=204)
+async def delete_dataset(dataset_id: int, service: CsvUploaderService = Depends(get_service)) -> None:
+    logging.info("Deleting dataset. ID: %s", dataset_id)
+    await service.delete_dataset(dataset_id)
+
+
+@router.post("/add-item", response_model=CsvUploaderResponseAllItems)
+async def add_item(payload: AddItemPayload, service: CsvUploaderService = Depends(get_service)) -> Response:
     logging.info("Adding item to DataBase")
     payload.validate_fields(payload.data_nascimento, payload.data_criacao, payload.data_atualizacao)
-    service = CsvUploaderService()
     item = await service.add_item(payload)
-    return item[0]
+    return json_response(item[0])
+
 
+@router.post("/add-items", response_model=BulkWriteResponse)
+async def add_items(
+    payloads: List[AddItemPayload],
+    service: CsvUploaderService = Depends(get_service)
+) -> Response:
+    logging.info("Adding %s items to DataBase", len(payloads))
+    result = await service.add_items(payloads)
+    return json_response(result)
 
-@router.get("/all")
-async def get_all_values(request: Request) -> List[Union[int, CsvUploaderResponseAllItems]] | None:
-    logging.info("Getting all values")
+
+@router.get("/all", response_model=List[Union[int, CsvUploaderResponseAllItems]] | None)
+async def get_all_values(
+    request: Request,
+    dataset_id: int | None = None,
+    service: CsvUploaderService = Depends(get_service)
+) -> Response:
+    logging.info("Getting all values. Dataset: %s", dataset_id)
     page_size = request.headers.get("page_size", 10)
     page_number = request.headers.get("page", 1)
-    service = CsvUploaderService()
-    response, total_count = await service.get_all_values_with_pagination(int(page_number), int(page_size))
-    if response:
-        result = [total_count] + list(response)
-        return result
-    return None
+    cursor = request.headers.get("cursor")
+    count_mode = request.headers.get("count_mode")
+    page = await service.get_all_values_with_pagination(
+        int(page_number), int(page_size), cursor, count_mode, dataset_id
+    )
+    if page:
+        result = [page.total_count] + page.items
+        return page_response(result, page)
+    return json_response(None)
 
 
-@router.put("/update/id/{item_id}")
-async def update_item(payload: AddItemPayload, item_id: int) -> CsvUploaderResponseAllItems:
-    logging.info("Updating item. ID: %s", item_id)
+@router.put("/update/id/{item_id}", response_model=CsvUploaderResponseAllItems)
+async def update_item(
+    payload: AddItemPayload,
+    item_id: int,
+    dataset_id: int = DEFAULT_DATASET_ID,
+    service: CsvUploaderService = Depends(get_service)
+) -> Response:
+    logging.info("Updating item. ID: %s, Dataset: %s", item_id, dataset_id)
     payload.validate_fields(payload.data_nascimento, payload.data_criacao, payload.data_atualizacao)
-    service = CsvUploaderService()
-    item = await service.update_item(payload, item_id)
-    return item[0]
+    item = await service.update_item(payload, item_id, dataset_id)
+    return json_response(item[0])
+
+
+@router.put("/update-items", response_model=BulkWriteResponse)
+async def update_items(
+    payloads: List[UpdateItemPayload],
+    service: CsvUploaderService = Depends(get_service)
+) -> Response:
+    logging.info("Updating %s items", len(payloads))
+    result = await service.update_items(payloads)
+    return json_response(result)
 
 
 @router.delete("/delete/id/{item_id}", status_code=204)
-async def delete_item(item_id: int) -> None:
-    logging.info("Deleting item. ID: %s", item_id)
-    service = CsvUploaderService()
-    await service.delete_item(item_id)
+async def delete_item(
+    item_id: int,
+    dataset_id: int = DEFAULT_DATASET_ID,
+    service: CsvUploaderService = Depends(get_service)
+) -> None:
+    logging.info("Deleting item. ID: %s, Dataset: %s", item_id, dataset_id)
+    await service.delete_item(item_id, dataset_id)
+
+
+@router.post("/delete-items", response_model=BulkWriteResponse)
+async def delete_items(
+    payload: DeleteItemsPayload,
+    service: CsvUploaderService = Depends(get_service)
+) -> Response:
+    logging.info("Deleting %s items", len(payload.ids))
+    result = await service.delete_items(payload.ids, payload.dataset_id)
+    return json_response(result)
 
 
-@router.get("/filter/field/{field}/value/{value}")
-async def get_value_by_field(request: Request, field: str, value: str) -> List[CsvUploaderResponseAllItems] | None:
-    logging.info("Getting value by field. Field: %s, Value: %s", field, value)
+@router.get("/filter/field/{field}/value/{value}", response_model=List[CsvUploaderResponseAllItems] | None)
+async def get_value_by_field(
+    request: Request,
+    field: str,
+    value: str,
+    dataset_id: int | None = None,
+    service: CsvUploaderService = Depends(get_service)
+) -> Response:
+    logging.info("Getting value by field. Field: %s, Value: %s, Dataset: %s", field, value, dataset_id)
+    page_size = request.headers.get("page_size", 10)
     page_number = request.headers.get("page", 1)
-    service = CsvUploaderService()
-    response = await service.get_filtered_value(field, value, int(page_number))
-    if response:
-        return response
-    return None
+    cursor = request.headers.get("cursor")
+    page = await service.get_filtered_value(field, value, int(page_number), int(page_size), cursor, dataset_id)
+    if page:
+        return page_response(page.items, page)
+    return json_response(None)
+
+
+@router.get("/filter", response_model=List[CsvUploaderResponseAllItems] | None)
+async def filter_values(request: Request, service: CsvUploaderService = Depends(get_service)) -> Response:
+    logging.info("Filtering values. Filters: %s", request.query_params)
+    page_size = request.headers.get("page_size", 10)
+    page_number = request.headers.get("page", 1)
+    cursor = request.headers.get("cursor")
+    page = await service.filter_values(request.query_params.multi_items(), int(page_number), int(page_size), cursor)
+    if page:
+        return page_response(page.items, page)
+    return json_response(None)
+
+
+@router.get("/search", response_model=List[CsvUploaderResponseAllItems])
+async def search_values(
+    q: str,
+    mode: str = "prefix",
+    limit: int = 10,
+    service: CsvUploaderService = Depends(get_service)
+) -> Response:
+    logging.info("Searching values. Text: %s, Mode: %s", q, mode)
+    items = await service.search_values(q, mode, limit)
+    return json_response(items)
+
+
+@router.get("/cache/stats")
+async def get_cache_stats(service: CsvUploaderService = Depends(get_service)) -> CacheStatsResponse:
+    logging.info("Getting query cache stats")
+    return await service.get_cache_stats()
+
+
+@router.get("/stats")
+async def get_stats(
+    dimensions: List[str] = Query([], alias="dimension"),
+    birth_year_bucket: int = 10,
+    date_granularity: str = "month",
+    service: CsvUploaderService = Depends(get_service)
+) -> StatsResponse:
+    logging.info("Getting stats. Dimensions: %s", dimensions)
+    return await service.get_stats(dimensions, birth_year_bucket, date_granularity)
+
+
+@router.post("/stats/rebuild")
+async def rebuild_stats(service: CsvUploaderService = Depends(get_service)) -> StatsRebuildResponse:
+    logging.info("Rebuilding stats")
+    return await service.rebuild_stats()
 
 
 @router.get("/csv-file")
-async def get_csv_file() -> StreamingResponse:
-    logging.info("Getting CSV file")
-    service = CsvUploaderService()
-    return await service.get_csv_file()
+async def get_csv_file(
+    request: Request,
+    compression: str | None = None,
+    export_format: str | None = Query(None, alias="format"),
+    updated_since: str | None = None,
+    service: CsvUploaderService = Depends(get_service)
+) -> StreamingResponse:
+    logging.info("Getting CSV file. Format: %s, Filters: %s", export_format, request.query_params)
+    filters = [(key, value) for key, value in request.query_params.multi_items() if key not in EXPORT_PARAMS]
+    return await service.get_csv_file(
+        compression, export_format, request.headers.get("accept"), filters, updated_since
+    )
 
 
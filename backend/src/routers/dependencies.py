@@ -0,0 +1,16 @@
+from fastapi import Request
+
+from ..services.csv_uploader_service import CsvUploaderService
+
+
+def get_service(request: Request) -> CsvUploaderService:
+    """
+    Returns the service shared by every request, built by the app lifespan.
+
+    The service is built on first use if the lifespan did not run, as when the app is served by
+    a test client without entering its context.
+    """
+    service = getattr(request.app.state, "csv_uploader_service", None)
+    if service is None:
+        service = request.app.state.csv_uploader_service = CsvUploaderService()
+    return service
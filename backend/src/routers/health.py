@@ -0,0 +1,20 @@
+from fastapi import APIRouter, Request, Response
+
+from ..services.serialization import json_response
+
+router = APIRouter(tags=["Health"])
+
+
+@router.get("/health/live")
+async def get_liveness() -> Response:
+    return json_response({"status": "alive"})
+
+
+@router.get("/health/ready")
+async def get_readiness(request: Request) -> Response:
+    """
+    Answers 503 until the database connections are warmed up and the ingestion workers started,
+    so a load balancer only sends traffic to workers ready to serve it.
+    """
+    status = getattr(request.app.state, "status", "starting")
+    return json_response({"status": status}, status_code=200 if status == "ready" else 503)
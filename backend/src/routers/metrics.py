@@ -0,0 +1,10 @@
+from fastapi import APIRouter, Response
+
+from ..infra.metrics import CONTENT_TYPE, REGISTRY
+
+router = APIRouter(tags=["Metrics"])
+
+
+@router.get("/metrics")
+async def get_metrics() -> Response:
+    return Response(content=REGISTRY.render(), media_type=CONTENT_TYPE)
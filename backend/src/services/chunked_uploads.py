@@ -0,0 +1,354 @@
+import os
+import re
+import json
+import mmap
+import time
+import fcntl
+import asyncio
+import hashlib
+import logging
+from dataclasses import asdict, dataclass
+from typing import AsyncIterator, Tuple
+
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+
+from ..infra.metrics import stage
+
+from .csv_stream import map_file
+from .ingestion_jobs import UPLOAD_SPOOL_DIR, remove_spool_file
+
+
+# Sessions live next to the spooled uploads, so finalizing one only renames its file.
+# Every request of a session must reach a process that sees this directory.
+UPLOAD_SESSION_DIR = os.path.join(UPLOAD_SPOOL_DIR, "sessions")
+UPLOAD_MAX_SIZE = int(os.environ.get("UPLOAD_MAX_SIZE", str(64 * 1024 ** 3)))
+UPLOAD_CHUNK_MAX_SIZE = int(os.environ.get("UPLOAD_CHUNK_MAX_SIZE", str(64 * 1024 ** 2)))
+UPLOAD_SESSION_TTL = float(os.environ.get("UPLOAD_SESSION_TTL", "86400"))
+UPLOAD_SESSION_SWEEP_INTERVAL = float(os.environ.get("UPLOAD_SESSION_SWEEP_INTERVAL", "3600"))
+
+# Bytes of a chunk body collected before they are written to the session file
+CHUNK_WRITE_SIZE = 1024 * 1024
+
+CONTENT_RANGE_PATTERN = re.compile(r"bytes (\d+)-(\d+)/(\d+)")
+
+SESSION_ID_PATTERN = re.compile(r"[0-9a-f-]{36}")
+
+
+@dataclass
+class UploadSession:
+    id: str
+    file_name: str | None
+    size: int
+    engine: str
+    sha256: str | None
+    created_at: float
+    offset: int = 0
+
+    @property
+    def expires_at(self) -> float:
+        return self.created_at + UPLOAD_SESSION_TTL
+
+
+def _metadata_path(upload_id: str) -> str:
+    return os.path.join(UPLOAD_SESSION_DIR, f"{upload_id}.json")
+
+
+def _data_path(upload_id: str) -> str:
+    return os.path.join(UPLOAD_SESSION_DIR, f"{upload_id}.part")
+
+
+def _remove_session_files(upload_id: str) -> None:
+    remove_spool_file(_data_path(upload_id))
+    remove_spool_file(_metadata_path(upload_id))
+
+
+def remove_expired_sessions() -> int:
+    """
+    Removes the sessions created more than UPLOAD_SESSION_TTL seconds ago.
+
+    Sessions whose file is locked by a chunk being written or by finalize_session are skipped.
+
+    Returns:
+        int: The number of sessions removed.
+    """
+    now = time.time()
+    removed = 0
+    try:
+        entries = list(os.scandir(UPLOAD_SESSION_DIR))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        if not entry.name.endswith(".json"):
+            continue
+        upload_id = entry.name[:-len(".json")]
+        try:
+            if now - entry.stat().st_mtime <= UPLOAD_SESSION_TTL:
+                continue
+            with open(_data_path(upload_id), "r+b") as file:
+                fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                logging.info("Removing expired upload session %s", upload_id)
+                _remove_session_files(upload_id)
+        except BlockingIOError:
+            continue
+        except FileNotFoundError:
+            remove_spool_file(entry.path)
+            continue
+        removed += 1
+    return removed
+
+
+async def sweep_expired_sessions(interval: float = UPLOAD_SESSION_SWEEP_INTERVAL) -> None:
+    """
+    Asynchronously removes the expired sessions every interval seconds, until cancelled, so the
+    data of abandoned uploads does not stay on disk until the next session is created.
+    """
+    while True:
+        try:
+            removed = await run_in_threadpool(remove_expired_sessions)
+            if removed:
+                logging.info("Removed %s expired upload sessions", removed)
+        except OSError as error:
+            logging.error("Failed to remove expired upload sessions. Error: %s", error)
+        await asyncio.sleep(interval)
+
+
+def create_session(upload_id: str, file_name: str | None, size: int, engine: str, sha256: str | None) -> UploadSession:
+    """
+    Creates an empty upload session for a file of the given size.
+
+    Args:
+        upload_id (str): The ID of the session.
+        file_name (str | None): The name of the file being uploaded.
+        size (int): The size of the whole file, in bytes.
+        engine (str): The ingestion engine the file is ingested with once finalized.
+        sha256 (str | None): The expected SHA-256 of the whole file, checked when finalizing.
+
+    Returns:
+        UploadSession: The new session, at offset 0.
+
+    Raises:
+        HTTPException: If the size or the checksum is invalid.
+    """
+    if not 0 < size <= UPLOAD_MAX_SIZE:
+        raise HTTPException(status_code=400, detail=f"The upload size must be between 1 and {UPLOAD_MAX_SIZE} bytes")
+    if sha256 is not None and not re.fullmatch(r"[0-9a-fA-F]{64}", sha256):
+        raise HTTPException(status_code=400, detail="sha256 must be 64 hexadecimal characters")
+    os.makedirs(UPLOAD_SESSION_DIR, exist_ok=True)
+    remove_expired_sessions()
+    session = UploadSession(upload_id, file_name, size, engine, sha256 and sha256.lower(), time.time())
+    open(_data_path(upload_id), "wb").close()
+    metadata = asdict(session)
+    del metadata["offset"]
+    with open(_metadata_path(upload_id), "w", encoding="utf-8") as file:
+        json.dump(metadata, file)
+    return session
+
+
+def load_session(upload_id: str) -> UploadSession:
+    """
+    Reads an upload session. Its offset is the size of the data received so far.
+
+    Raises:
+        HTTPException: 404 if the session does not exist or has expired.
+    """
+    if not SESSION_ID_PATTERN.fullmatch(upload_id):
+        raise HTTPException(status_code=404, detail=f"Upload session {upload_id} not found")
+    try:
+        with open(_metadata_path(upload_id), encoding="utf-8") as file:
+            session = UploadSession(**json.load(file))
+        session.offset = os.path.getsize(_data_path(upload_id))
+    except FileNotFoundError as error:
+        raise HTTPException(status_code=404, detail=f"Upload session {upload_id} not found") from error
+    if time.time() > session.expires_at:
+        _remove_session_files(upload_id)
+        raise HTTPException(status_code=404, detail=f"Upload session {upload_id} has expired")
+    return session
+
+
+def parse_content_range(session: UploadSession, content_range: str | None) -> Tuple[int, int]:
+    """
+    Parses a "bytes <first>-<last>/<size>" Content-Range header.
+
+    Returns:
+        Tuple[int, int]: The offset of the first byte of the chunk and its length.
+
+    Raises:
+        HTTPException: If the header is missing or malformed, does not match the session size,
+            or the chunk is larger than UPLOAD_CHUNK_MAX_SIZE.
+    """
+    match = CONTENT_RANGE_PATTERN.fullmatch((content_range or "").strip())
+    if not match:
+        raise HTTPException(status_code=400, detail="A Content-Range header like 'bytes 0-1048575/5000000' is required")
+    first, last, size = (int(value) for value in match.groups())
+    if size != session.size or first > last or last >= size:
+        raise HTTPException(
+            status_code=416, detail=f"Invalid range {first}-{last}/{size} for an upload of {session.size} bytes"
+        )
+    if last - first + 1 > UPLOAD_CHUNK_MAX_SIZE:
+        raise HTTPException(status_code=413, detail=f"Chunks must not be larger than {UPLOAD_CHUNK_MAX_SIZE} bytes")
+    return first, last - first + 1
+
+
+def offset_conflict(session: UploadSession, detail: str) -> HTTPException:
+    return HTTPException(status_code=409, detail=detail, headers={"Upload-Offset": str(session.offset)})
+
+
+def _open_locked(session: UploadSession, busy_detail: str):
+    """
+    Opens the session file and locks it, so a single chunk write or finalization runs at a time.
+
+    Returns:
+        The open file, which must be closed to release the lock. The session offset is refreshed.
+
+    Raises:
+        HTTPException: 404 if the session was finalized or removed meanwhile, 409 if the file is locked.
+    """
+    data_path = _data_path(session.id)
+    try:
+        file = open(data_path, "r+b")
+    except FileNotFoundError as error:
+        raise HTTPException(status_code=404, detail=f"Upload session {session.id} not found") from error
+    try:
+        try:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError as error:
+            raise offset_conflict(session, busy_detail) from error
+        # The file may have been moved to the spool by a finalization that held the lock until now
+        stat = os.fstat(file.fileno())
+        try:
+            current = os.stat(data_path)
+        except FileNotFoundError:
+            current = None
+        if current is None or not os.path.samestat(current, stat):
+            raise HTTPException(status_code=404, detail=f"Upload session {session.id} not found")
+        session.offset = stat.st_size
+    except BaseException:
+        file.close()
+        raise
+    return file
+
+
+async def write_chunk(
+    session: UploadSession,
+    start: int,
+    length: int,
+    body: AsyncIterator[bytes],
+    checksum: str | None
+) -> int:
+    """
+    Asynchronously appends a chunk streamed from the request body to the session file.
+
+    The chunk must start at the current offset, so chunks are written in order and a chunk sent
+    twice after a lost response is detected. The body is written as it arrives, in pieces of
+    CHUNK_WRITE_SIZE bytes, and the file is cut back to the previous offset if the body is
+    shorter or longer than the range, its SHA-256 does not match checksum, or the client
+    disconnects, so the session only ever holds whole, verified chunks.
+
+    Args:
+        session (UploadSession): The session to write to.
+        start (int): The offset of the first byte of the chunk.
+        length (int): The length of the chunk.
+        body (AsyncIterator[bytes]): The chunk, as received.
+        checksum (str | None): The expected SHA-256 of the chunk, in hexadecimal.
+
+    Returns:
+        int: The new offset of the session.
+
+    Raises:
+        HTTPException: 409 if the chunk does not start at the current offset or another chunk of the
+            session is being written or the session is being finalized, 400 if the body does not match
+            the range or the checksum, 404 if the session was finalized meanwhile.
+    """
+    file = await run_in_threadpool(_open_locked, session, "Another chunk of this upload is being written")
+    try:
+        if start != session.offset:
+            raise offset_conflict(session, f"Expected a chunk starting at offset {session.offset}, got {start}")
+        file.seek(start)
+        digest = hashlib.sha256()
+        received = 0
+        pending = []
+        pending_size = 0
+        try:
+            async for piece in body:
+                received += len(piece)
+                if received > length:
+                    raise HTTPException(status_code=400, detail=f"The chunk is longer than its range of {length} bytes")
+                digest.update(piece)
+                pending.append(piece)
+                pending_size += len(piece)
+                if pending_size >= CHUNK_WRITE_SIZE:
+                    await run_in_threadpool(_write_pieces, file, pending)
+                    pending, pending_size = [], 0
+            if received != length:
+                raise HTTPException(status_code=400, detail=f"Received {received} bytes of a {length} byte chunk")
+            if checksum and digest.hexdigest() != checksum.lower():
+                raise HTTPException(status_code=400, detail="The chunk does not match its SHA-256 checksum")
+            await run_in_threadpool(_write_pieces, file, pending, True)
+        except BaseException:
+            file.truncate(start)
+            raise
+        session.offset = start + length
+        return session.offset
+    finally:
+        file.close()
+
+
+def _write_pieces(file, pieces, sync: bool = False) -> None:
+    with stage("upload.spool"):
+        file.write(b"".join(pieces))
+        if sync:
+            file.flush()
+            os.fsync(file.fileno())
+
+
+def hash_file(file_path: str) -> str:
+    """
+    Returns the SHA-256 of a file, read through a memory mapping.
+    """
+    digest = hashlib.sha256()
+    with stage("upload.hash"), map_file(file_path) as mapped:
+        digest.update(mapped if isinstance(mapped, mmap.mmap) else mapped.read())
+    return digest.hexdigest()
+
+
+def finalize_session(session: UploadSession, job_id: str) -> Tuple[str, str]:
+    """
+    Checks that an upload is complete and moves its file to the spool, ready to be ingested.
+
+    The session file is locked like in write_chunk, so a concurrent finalization or chunk fails
+    instead of racing with the move.
+
+    Args:
+        session (UploadSession): The session to finalize.
+        job_id (str): The ID of the upload or job the file is ingested by, used as its file name.
+
+    Returns:
+        Tuple[str, str]: The path of the spooled file and the SHA-256 of its content.
+
+    Raises:
+        HTTPException: 409 if bytes are missing or the session is being written or finalized, 404 if it
+            was finalized meanwhile, 400 if the file does not match the expected SHA-256.
+    """
+    with _open_locked(session, "This upload is being written or finalized"):
+        if session.offset != session.size:
+            raise offset_conflict(
+                session, f"The upload is incomplete: {session.offset} of {session.size} bytes received"
+            )
+        data_path = _data_path(session.id)
+        content_hash = hash_file(data_path)
+        if session.sha256 and content_hash != session.sha256:
+            raise HTTPException(status_code=400, detail="The uploaded file does not match its SHA-256 checksum")
+        file_path = os.path.join(UPLOAD_SPOOL_DIR, f"{job_id}.csv")
+        os.replace(data_path, file_path)
+        remove_spool_file(_metadata_path(session.id))
+    return file_path, content_hash
+
+
+def delete_session(upload_id: str) -> None:
+    """
+    Raises:
+        HTTPException: 404 if the session does not exist.
+    """
+    load_session(upload_id)
+    _remove_session_files(upload_id)
@@ -0,0 +1,132 @@
+import gzip
+import zlib
+import zipfile
+from contextlib import contextmanager
+from typing import BinaryIO, Iterator
+
+from .csv_stream import READ_CHUNK_SIZE, map_file
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Leading bytes of each supported compressed format
+MAGIC_NUMBERS = {
+    "gzip": b"\x1f\x8b",
+    "zstd": b"\x28\xb5\x2f\xfd",
+    "zip": b"PK\x03\x04",
+}
+
+# Content-Encoding values a client may declare for an uploaded file
+CONTENT_ENCODINGS = {
+    "identity": None,
+    "gzip": "gzip",
+    "x-gzip": "gzip",
+    "zstd": "zstd",
+    "zip": "zip",
+}
+
+# Raised while reading a corrupt or truncated compressed file
+DECOMPRESSION_ERRORS = (EOFError, zlib.error, gzip.BadGzipFile, zipfile.BadZipFile) + (
+    (zstandard.ZstdError,) if zstandard else ()
+)
+
+
+class UnsupportedCompressionError(ValueError):
+    """Raised when an upload is compressed with an unsupported format or does not match its Content-Encoding."""
+
+
+def detect_compression(file_path: str) -> str | None:
+    """
+    Returns the compression of a file from its magic bytes: "gzip", "zstd", "zip", or None for plain text.
+    """
+    with open(file_path, "rb") as file:
+        head = file.read(4)
+    for compression, magic in MAGIC_NUMBERS.items():
+        if head.startswith(magic):
+            return compression
+    return None
+
+
+def check_compression(file_path: str, content_encoding: str | None = None) -> str | None:
+    """
+    Detects the compression of an uploaded file and checks that it can be read.
+
+    Args:
+        file_path (str): The path of the spooled file.
+        content_encoding (str | None, optional): The Content-Encoding declared for the file, if any.
+
+    Returns:
+        str | None: The compression of the file, or None for plain text.
+
+    Raises:
+        UnsupportedCompressionError: If the declared encoding is unknown or does not match the content,
+            the file is compressed with zstd and the zstandard package is not installed, or it is a
+            zip archive that does not hold exactly one file.
+    """
+    compression = detect_compression(file_path)
+    if content_encoding:
+        encoding = content_encoding.strip().lower()
+        if encoding not in CONTENT_ENCODINGS:
+            raise UnsupportedCompressionError(
+                f"Unsupported Content-Encoding '{content_encoding}'. "
+                f"Available encodings: {', '.join(CONTENT_ENCODINGS)}"
+            )
+        if CONTENT_ENCODINGS[encoding] != compression:
+            raise UnsupportedCompressionError(
+                f"The file is declared as {encoding} but its content is {compression or 'not compressed'}"
+            )
+    if compression == "zstd" and zstandard is None:
+        raise UnsupportedCompressionError("zstd compressed uploads require the zstandard package")
+    if compression == "zip":
+        try:
+            with zipfile.ZipFile(file_path) as archive:
+                _zip_member(archive)
+        except zipfile.BadZipFile as error:
+            raise UnsupportedCompressionError(f"Invalid zip file. Error: {error}") from error
+    return compression
+
+
+def _zip_member(archive: zipfile.ZipFile) -> zipfile.ZipInfo:
+    members = [member for member in archive.infolist() if not member.is_dir()]
+    if len(members) != 1:
+        raise UnsupportedCompressionError(f"A zip upload must contain exactly one CSV file, found {len(members)} files")
+    return members[0]
+
+
+@contextmanager
+def open_csv_file(file_path: str, compression: str | None = None) -> Iterator[BinaryIO]:
+    """
+    Opens a spooled CSV file for reading, decompressing it on the fly.
+
+    Plain, gzip and zstd files are read through a memory mapping, and compressed files are
+    decompressed as they are read, so the decompressed CSV is never written to disk or held in
+    memory as a whole. A zip archive must hold a single file.
+
+    Args:
+        file_path (str): The path of the spooled file.
+        compression (str | None, optional): The compression returned by check_compression. Defaults to None.
+
+    Returns:
+        Iterator[BinaryIO]: A binary file with the decompressed CSV content.
+
+    Raises:
+        UnsupportedCompressionError: If a zip archive does not hold exactly one file.
+    """
+    if compression == "zip":
+        # zipfile seeks between the central directory and the member, so it reads the file itself
+        with zipfile.ZipFile(file_path) as archive, archive.open(_zip_member(archive)) as file:
+            yield file
+        return
+    with map_file(file_path) as mapped:
+        if compression == "gzip":
+            with gzip.GzipFile(fileobj=mapped, mode="rb") as file:
+                yield file
+        elif compression == "zstd":
+            decompressor = zstandard.ZstdDecompressor()
+            with decompressor.stream_reader(mapped, read_size=READ_CHUNK_SIZE, read_across_frames=True) as file:
+                yield file
+        else:
+            yield mapped
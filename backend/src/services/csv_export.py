@@ -0,0 +1,12 @@
+import csv
+from io import StringIO
+from typing import List, Sequence
+
+
+CSV_EXPORT_HEADER = ["Nome", "Data de Nascimento", "Gênero", "Nacionalidade", "Data de Criacao", "Data de Atualizacao"]
+
+
+def encode_csv_rows(rows: List[Sequence]) -> bytes:
+    buffer = StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue().encode("utf-8")
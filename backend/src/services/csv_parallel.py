@@ -0,0 +1,209 @@
+import os
+import re
+import csv
+import threading
+import multiprocessing
+from io import StringIO
+from itertools import islice
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Callable, Iterator, List, Tuple
+
+from .csv_stream import iter_lines, iter_numbered_rows, map_file, validate_rows
+from ..infra.metrics import stage
+
+
+PARALLEL_SHARD_SIZE = int(os.environ.get("PARALLEL_SHARD_SIZE", str(8 * 1024 * 1024)))
+PARALLEL_PARSE_WORKERS = int(os.environ.get("PARALLEL_PARSE_WORKERS", str(os.cpu_count() or 1)))
+PARALLEL_START_METHOD = os.environ.get("PARALLEL_START_METHOD", "spawn")
+
+_process_pool: ProcessPoolExecutor | None = None
+_process_pool_lock = threading.Lock()
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """
+    Returns the process-wide pool used to parse CSV shards, creating it lazily.
+
+    Its size comes from PARALLEL_PARSE_WORKERS and defaults to the number of CPUs. Workers are
+    started with PARALLEL_START_METHOD ("spawn" by default), since forking a process that already
+    runs database threads is not safe.
+    """
+    global _process_pool
+    if _process_pool is None:
+        with _process_pool_lock:
+            if _process_pool is None:
+                _process_pool = ProcessPoolExecutor(
+                    max_workers=PARALLEL_PARSE_WORKERS,
+                    mp_context=multiprocessing.get_context(PARALLEL_START_METHOD),
+                )
+    return _process_pool
+
+
+def shutdown_process_pool() -> None:
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is not None:
+            _process_pool.shutdown(wait=True, cancel_futures=True)
+            _process_pool = None
+
+
+# A double quote opens a quoted field only as the first character of a field, like in the csv
+# module's default dialect; anywhere else in an unquoted field it is a literal character. Doubled
+# quotes inside a quoted field are escapes. The patterns below match whole fields and never stop
+# inside a quoted one: a quoted field that is not closed is left unmatched.
+_QUOTED_FIELD = rb'(?<![^,\n])"[^"]*(?:""[^"]*)*"(?!")'
+_LITERAL_QUOTE = rb'(?<=[^,\n])"'
+RECORDS = re.compile(rb'(?:[^"]+|' + _QUOTED_FIELD + rb'|' + _LITERAL_QUOTE + rb')*')
+RECORD_REST = re.compile(rb'(?:[^"\n]+|' + _QUOTED_FIELD + rb'|' + _LITERAL_QUOTE + rb')*')
+UTF8_BOM = b"\xef\xbb\xbf"
+
+
+def _skip_quoted_field(data, position: int) -> int:
+    """
+    Returns the offset just past the closing quote of a quoted field whose content starts at position,
+    or the length of data if the field is never closed. Doubled quotes inside the field are escapes.
+    """
+    while True:
+        quote = data.find(b'"', position)
+        if quote == -1:
+            return len(data)
+        if data[quote + 1:quote + 2] != b'"':
+            return quote + 1
+        position = quote + 2
+
+
+def iter_record_ranges(file_path: str, shard_size: int = PARALLEL_SHARD_SIZE) -> Iterator[Tuple[int, int, int]]:
+    """
+    Splits the data rows of a CSV file into byte ranges of roughly shard_size bytes that start
+    and end on record boundaries.
+
+    A newline ends a record unless it is inside a quoted field. Quotes are tracked the way the
+    csv module reads them: a field is quoted only when it starts with a double quote, doubled quotes
+    inside it are escapes, and a stray quote inside an unquoted field (e.g. O"Brien) is a literal
+    character. The file is memory-mapped and scanned without decoding with regular expressions that
+    match whole fields, since quotes, commas and newlines are single bytes in UTF-8. The header row
+    is left out of the ranges.
+
+    Args:
+        file_path (str): The path of the CSV file.
+        shard_size (int, optional): The target number of bytes per range. Defaults to PARALLEL_SHARD_SIZE.
+
+    Returns:
+        Iterator[Tuple[int, int, int]]: The (start, end) offsets of each range and the line number it
+        starts on, in file order.
+    """
+    if os.path.getsize(file_path) == 0:
+        return
+    with map_file(file_path) as data:
+        file_size = len(data)
+        start = None
+        start_line = 1
+        target = 0
+        position = len(UTF8_BOM) if data[:len(UTF8_BOM)] == UTF8_BOM else 0
+        if position and data[position:position + 1] == b'"':
+            position = _skip_quoted_field(data, position + 1)
+        while position < file_size:
+            if position < target:
+                # Skip whole fields up to the target in one match. The run never ends right after
+                # a quote, so that a closing quote cannot be mistaken for half of an escaped one.
+                run_end = min(target, file_size)
+                while run_end < file_size and data[run_end - 1:run_end] == b'"':
+                    run_end += 1
+                position = RECORDS.match(data, position, run_end).end()
+                if position < run_end:
+                    # A quoted field that closes past the end of the run, or never does
+                    position = _skip_quoted_field(data, position + 1)
+                continue
+            position = RECORD_REST.match(data, position).end()
+            if data[position:position + 1] != b"\n":
+                # The end of the file, or a quoted field that is never closed
+                break
+            boundary = position + 1
+            if start is not None:
+                yield start, boundary, start_line
+                start_line += data[start:boundary].count(b"\n")
+            else:
+                start_line = data[:boundary].count(b"\n") + 1
+            start = boundary
+            target = boundary + shard_size
+            position = boundary
+    if start is not None and start < file_size:
+        yield start, file_size, start_line
+
+
+def parse_shard(file_path: str, start: int, end: int, first_line: int) -> Tuple[int, str, List[Tuple[int, List[str], str]]]:
+    """
+    Parses, validates and normalizes one range of a CSV file and encodes the valid rows for COPY.
+
+    Runs in a worker process, so only the file path and offsets are sent to it and only the
+    encoded text and the rejected rows come back.
+
+    Args:
+        file_path (str): The path of the CSV file.
+        start (int): The offset of the first byte of the range.
+        end (int): The offset just past the last byte of the range.
+        first_line (int): The line number the range starts on.
+
+    Returns:
+        Tuple[int, str, List[Tuple[int, List[str], str]]]: The number of valid rows, the valid rows encoded
+        as CSV in USERS_DATA_COLUMNS order, and the line number, row and reason of each rejected row.
+
+    Raises:
+        UnicodeDecodeError: If the range is not valid UTF-8.
+    """
+    with map_file(file_path) as mapped:
+        text = mapped[start:end].decode("utf-8")
+    rejects = []
+    rows = iter_numbered_rows(iter_lines([text]), first_line)
+    valid_rows = list(validate_rows(rows, lambda *reject: rejects.append(reject)))
+    buffer = StringIO()
+    csv.writer(buffer).writerows(valid_rows)
+    return len(valid_rows), buffer.getvalue(), rejects
+
+
+def iter_shard_payloads(
+    file_path: str,
+    shard_size: int = PARALLEL_SHARD_SIZE,
+    executor: Executor | None = None,
+    prefetch: int | None = None,
+    on_reject: Callable[[int, List[str], str], None] | None = None
+) -> Iterator[Tuple[int, str]]:
+    """
+    Parses a CSV file shard by shard in a process pool, yielding the encoded shards in file order.
+
+    At most prefetch shards are parsed ahead of the consumer, which bounds memory usage and lets
+    parsing overlap with the database writes.
+
+    Args:
+        file_path (str): The path of the CSV file.
+        shard_size (int, optional): The target number of bytes per shard. Defaults to PARALLEL_SHARD_SIZE.
+        executor (Executor | None, optional): The pool running parse_shard. Defaults to get_process_pool().
+        prefetch (int | None, optional): The number of shards parsed ahead. Defaults to twice PARALLEL_PARSE_WORKERS.
+        on_reject (Callable[[int, List[str], str], None] | None, optional): Called with the line number, the row
+            and the reason of each invalid row. If None, the first invalid row raises. Defaults to None.
+
+    Returns:
+        Iterator[Tuple[int, str]]: The valid row count and CSV text of each shard.
+
+    Raises:
+        ValueError: If a row is invalid and no on_reject callback was given.
+    """
+    executor = executor if executor is not None else get_process_pool()
+    prefetch = prefetch or 2 * PARALLEL_PARSE_WORKERS
+    ranges = iter_record_ranges(file_path, shard_size)
+    pending = deque(executor.submit(parse_shard, file_path, *shard) for shard in islice(ranges, prefetch))
+    try:
+        while pending:
+            with stage("parse.shard_wait"):
+                rows, payload, rejects = pending.popleft().result()
+            for shard in islice(ranges, 1):
+                pending.append(executor.submit(parse_shard, file_path, *shard))
+            for line_number, row, reason in rejects:
+                if on_reject is None:
+                    raise ValueError(f"Line {line_number}: {reason}")
+                on_reject(line_number, row, reason)
+            yield rows, payload
+    finally:
+        for future in pending:
+            future.cancel()
@@ -0,0 +1,223 @@
+import os
+import csv
+import mmap
+import codecs
+from contextlib import contextmanager
+from datetime import date
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, List, Tuple
+
+from ..date_parser import parse_date
+from ..infra.metrics import stage
+from ..infra.cv_uploader_data_base.bulk_ingestion import batched
+from ..infra.cv_uploader_data_base.querys import FIELD_MAX_LENGTHS, USERS_DATA_COLUMNS
+
+
+READ_CHUNK_SIZE = 1024 * 1024
+
+NORMALIZE_BATCH_SIZE = 1000
+
+DATE_COLUMN_INDEXES = frozenset(
+    USERS_DATA_COLUMNS.index(column) for column in ("data_nascimento", "data_criacao", "data_atualizacao")
+)
+
+REJECT_FILE_HEADER = ("line_number", "reason") + USERS_DATA_COLUMNS
+
+
+@contextmanager
+def map_file(file_path: str) -> Iterator[BinaryIO]:
+    """
+    Memory-maps a file read-only for the duration of a with block.
+
+    Reads from the mapping are served from the page cache without going through a Python file
+    buffer, and a multi-GB file is never loaded in one piece. The mapping supports read() and
+    slicing, so it can be passed wherever a binary file is read. Empty files cannot be mapped
+    and are opened normally instead.
+    """
+    with open(file_path, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            yield file
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            yield mapped
+
+
+def iter_decoded_chunks(file: BinaryIO, chunk_size: int = READ_CHUNK_SIZE, encoding: str = "utf-8-sig") -> Iterator[str]:
+    """
+    Reads a binary file in fixed-size chunks and decodes them incrementally.
+
+    Multi-byte characters split across two chunks are kept by the decoder until the next
+    chunk arrives, and a leading UTF-8 BOM is dropped.
+
+    Args:
+        file (BinaryIO): The file to be read, e.g. the SpooledTemporaryFile of an UploadFile.
+        chunk_size (int, optional): The number of bytes read at a time. Defaults to READ_CHUNK_SIZE.
+        encoding (str, optional): The file encoding. Defaults to "utf-8-sig".
+
+    Returns:
+        Iterator[str]: The decoded text chunks.
+
+    Raises:
+        UnicodeDecodeError: If the file is not valid in the given encoding.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)()
+    while True:
+        chunk = file.read(chunk_size)
+        if not chunk:
+            break
+        with stage("parse.decode"):
+            text = decoder.decode(chunk)
+        if text:
+            yield text
+    text = decoder.decode(b"", final=True)
+    if text:
+        yield text
+
+
+def iter_lines(chunks: Iterable[str]) -> Iterator[str]:
+    """
+    Re-splits text chunks into lines, keeping the line terminators.
+
+    Only "\n" is treated as a line break, so the csv module still sees "\r\n" endings and
+    any other control characters inside fields untouched.
+
+    Args:
+        chunks (Iterable[str]): The text chunks.
+
+    Returns:
+        Iterator[str]: The lines, in order.
+    """
+    pending = ""
+    for chunk in chunks:
+        lines = (pending + chunk).split("\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line + "\n"
+    if pending:
+        yield pending
+
+
+def iter_numbered_rows(lines: Iterable[str], first_line: int = 1) -> Iterator[Tuple[int, List[str]]]:
+    """
+    Parses CSV lines into rows, skipping blank lines.
+
+    Args:
+        lines (Iterable[str]): The lines, as split by iter_lines.
+        first_line (int, optional): The line number of the first line. Defaults to 1.
+
+    Returns:
+        Iterator[Tuple[int, List[str]]]: The line number each row starts on and the row.
+    """
+    reader = csv.reader(lines)
+    line_number = first_line
+    for row in reader:
+        if row:
+            yield line_number, row
+        line_number = first_line + reader.line_num
+
+
+def iter_csv_rows(file: BinaryIO, chunk_size: int = READ_CHUNK_SIZE) -> Iterator[Tuple[int, List[str]]]:
+    """
+    Parses a CSV file row by row, skipping the header row and blank lines.
+
+    Args:
+        file (BinaryIO): The CSV file to be parsed.
+        chunk_size (int, optional): The number of bytes read at a time. Defaults to READ_CHUNK_SIZE.
+
+    Returns:
+        Iterator[Tuple[int, List[str]]]: The line number each data row starts on and the row.
+    """
+    rows = iter_numbered_rows(iter_lines(iter_decoded_chunks(file, chunk_size)))
+    next(rows, None)
+    yield from rows
+
+
+def _row_error(row: List[str], dates: Dict[str, date | None]) -> str | None:
+    if len(row) != len(USERS_DATA_COLUMNS):
+        return f"Expected {len(USERS_DATA_COLUMNS)} columns, got {len(row)}"
+    for index, column in enumerate(USERS_DATA_COLUMNS):
+        value = row[index]
+        if index in DATE_COLUMN_INDEXES:
+            if dates[value] is None:
+                return f"Invalid date in {column}: {value!r}"
+        elif column in FIELD_MAX_LENGTHS and len(value) > FIELD_MAX_LENGTHS[column]:
+            return f"{column} is longer than {FIELD_MAX_LENGTHS[column]} characters"
+    return None
+
+
+def validate_rows(
+    rows: Iterable[Tuple[int, List[str]]],
+    on_reject: Callable[[int, List[str], str], None] | None = None,
+    batch_size: int = NORMALIZE_BATCH_SIZE
+) -> Iterator[Tuple]:
+    """
+    Validates CSV rows and converts the valid ones into tuples ready to be inserted.
+
+    A row is valid when it has one value per column, its dates are valid YYYY/MM/DD or DD/MM/YYYY
+    dates (the rules of AddItemPayload.validate_fields) and its text fields fit the VARCHAR
+    limits of users_data. Rows are handled in batches so each distinct date is parsed only once.
+
+    Args:
+        rows (Iterable[Tuple[int, List[str]]]): The line numbers and CSV rows, without the header.
+        on_reject (Callable[[int, List[str], str], None] | None, optional): Called with the line number,
+            the row and the reason of each invalid row. If None, the first invalid row raises. Defaults to None.
+        batch_size (int, optional): The number of rows validated at a time. Defaults to NORMALIZE_BATCH_SIZE.
+
+    Returns:
+        Iterator[Tuple]: The normalized valid rows.
+
+    Raises:
+        ValueError: If a row is invalid and no on_reject callback was given.
+    """
+    for batch in batched(rows, batch_size):
+        dates = {}
+        for _, row in batch:
+            if len(row) == len(USERS_DATA_COLUMNS):
+                for index in DATE_COLUMN_INDEXES:
+                    dates[row[index]] = None
+        with stage("parse.dates"):
+            for value in dates:
+                try:
+                    dates[value] = parse_date(value)
+                except ValueError:
+                    pass
+        for line_number, row in batch:
+            error = _row_error(row, dates)
+            if error is None:
+                yield tuple(dates[value] if index in DATE_COLUMN_INDEXES else value for index, value in enumerate(row))
+            elif on_reject is None:
+                raise ValueError(f"Line {line_number}: {error}")
+            else:
+                on_reject(line_number, row, error)
+
+
+class RejectWriter:
+    """
+    Writes rejected rows to a CSV file with their line number and the reason they were rejected.
+
+    The file is only created when the first row is rejected.
+    """
+
+    def __init__(self, file_path: str) -> None:
+        self.file_path = file_path
+        self.count = 0
+        self._file = None
+        self._writer = None
+
+    def write(self, line_number: int, row: List[str], reason: str) -> None:
+        if self._file is None:
+            self._file = open(self.file_path, "w", encoding="utf-8", newline="")
+            self._writer = csv.writer(self._file)
+            self._writer.writerow(REJECT_FILE_HEADER)
+        self._writer.writerow([line_number, reason, *row])
+        self.count += 1
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self) -> "RejectWriter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
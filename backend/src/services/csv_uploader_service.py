@@ -1,109 +1,688 @@
-import csv
+import os
+import time
 import logging
-from io import StringIO
-from typing import List, Tuple, Union
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Dict, Iterable, List, Tuple
 
-from fastapi import UploadFile
+from fastapi import HTTPException, UploadFile
+from fastapi.concurrency import run_in_threadpool
 
-from fastapi.responses import StreamingResponse
+from fastapi.responses import FileResponse, StreamingResponse
 
-from ..utils import format_date_ymd_to_ymd
+from .export_formats import (
+    UnsupportedExportError,
+    encode_export,
+    export_media_type,
+    negotiate_format,
+    validate_compression,
+)
+from .compressed_csv import DECOMPRESSION_ERRORS, UnsupportedCompressionError, check_compression
+from .chunked_uploads import (
+    UploadSession,
+    create_session,
+    delete_session,
+    finalize_session,
+    load_session,
+    parse_content_range,
+    write_chunk,
+)
+from .serialization import bulk_response, bulk_result, rows_to_items
+from .stats import InvalidStatsQueryError, summarize_stats, validate_stats_query
+from .ingestion_jobs import (
+    CSV_INGESTION_ENGINE,
+    complete_dataset,
+    discard_dataset,
+    get_job_manager,
+    ingest_file,
+    new_job_id,
+    record_ingested_file,
+    reject_file_path,
+    remove_spool_file,
+    spool_upload,
+)
 
-from ..models.payloads.csv_uploader import AddItemPayload
+from ..models.payloads.csv_uploader import AddItemPayload, CreateUploadPayload, UpdateItemPayload
 
+from ..infra.metrics import stage, timed_operation
+from ..infra.cv_uploader_data_base.bulk_ingestion import ENGINE_NAMES
+from ..infra.cv_uploader_data_base.datasets import DATASET_MAX_COUNT, DEFAULT_DATASET_ID
+from ..infra.cv_uploader_data_base.querys import DATASET_FIELDS, INGESTION_JOB_FIELDS, NATURAL_KEY_COLUMNS
+from ..infra.cv_uploader_data_base.filters import InvalidFilterError, parse_filters
+from ..infra.cv_uploader_data_base.search import InvalidSearchError, validate_search
+from ..infra.cv_uploader_data_base.pagination import Page
 from ..infra.cv_uploader_data_base.csv_uploader_repository import ResumeConnectionHandler
+from ..infra.cv_uploader_data_base.repository_factory import create_repository
 from ..models.responses.csv_uploader import (
-    CsvUploaderResponse,
-    CsvUploaderResponseAllItems,
+    CacheStatsResponse,
+    CsvDuplicateUploadResponse,
+    CsvUploadJobResponse,
+    CsvUploadResponse,
+    DatasetResponse,
+    IngestionJobResponse,
+    StatsRebuildResponse,
+    StatsResponse,
+    UploadSessionResponse,
 )
 
+PAGINATION_COUNT_MODE = os.environ.get("PAGINATION_COUNT_MODE", "maintained")
+
+BULK_MAX_ITEMS = int(os.environ.get("BULK_MAX_ITEMS", "1000"))
+
 
 class CsvUploaderService:
-    def __init__(self):
+    def __init__(self, repository: ResumeConnectionHandler | None = None):
         logging.info("Initializing CSV uploader service")
-        self.repository = ResumeConnectionHandler()
+        self.repository = repository if repository is not None else create_repository()
+
+    @timed_operation("upload_csv")
+    async def upload_csv(
+        self,
+        file: UploadFile,
+        engine: str | None = None,
+        force: bool = False,
+        replace: int | None = None,
+        dataset_id: int | None = None,
+        new_dataset: bool = False
+    ) -> CsvUploadResponse | CsvDuplicateUploadResponse:
+        """
+        Asynchronously uploads a CSV file, streams its valid rows into the default dataset, or into the dataset_id or a new dataset when set, and returns a CsvUploadResponse with a success message, the dataset ID, the accepted and rejected row counts and the ingestion throughput.
+
+        The file is spooled to disk and parsed in chunks, so memory usage does not depend on the file size.
+        Files compressed with gzip, zstd or zip are detected by their magic bytes, spooled compressed and
+        decompressed as they are parsed.
+        Invalid rows are written to a reject file that can be downloaded with get_rejects_file.
+        A file whose exact content was already ingested is not parsed again, unless force is set.
+
+        Parameters:
+            file (UploadFile): The CSV file to be uploaded.
+            engine (str | None, optional): The ingestion engine, "upsert", "copy", "insert" or "parallel". Defaults to the CSV_INGESTION_ENGINE environment variable.
+            force (bool, optional): Ingest the file even if it was already ingested. Defaults to False.
+            replace (int | None, optional): A dataset dropped once the file is ingested into a new dataset. Defaults to None.
+            dataset_id (int | None, optional): The existing dataset the rows are upserted into. Defaults to None,
+                the default dataset, so rows already uploaded are updated instead of duplicated.
+            new_dataset (bool, optional): Ingest the rows into a new dataset of their own. Defaults to False.
+
+        Returns:
+            CsvUploadResponse | CsvDuplicateUploadResponse: A response object indicating the success of the CSV file upload,
+            or pointing to the upload that already ingested the file.
+        """
+        engine = self.validate_engine(engine)
+        dataset_id = await self.check_upload_target(dataset_id, replace, new_dataset)
+        upload_id = new_job_id()
+        file_path, content_hash = await run_in_threadpool(spool_upload, file.file, upload_id)
+        await self.check_upload_compression(file_path, file.headers.get("content-encoding"))
+        return await self.ingest_spooled_file(
+            upload_id, file_path, content_hash, file.filename, engine, force, replace, dataset_id
+        )
 
-    async def upload_csv(self, file: UploadFile) -> CsvUploaderResponse:
+    async def ingest_spooled_file(
+        self,
+        upload_id: str,
+        file_path: str,
+        content_hash: str,
+        file_name: str | None,
+        engine: str,
+        force: bool = False,
+        replace: int | None = None,
+        dataset_id: int | None = None
+    ) -> CsvUploadResponse | CsvDuplicateUploadResponse:
         """
-        Asynchronously uploads a CSV file, reads the file content, saves it to the database, and returns a CsvUploaderResponse with a success message.
+        Asynchronously ingests a file already spooled to disk into a new dataset, unless its content
+        was already ingested and force is not set, and removes it afterwards. The dataset is dropped
+        if the ingestion fails; once it succeeds, the dataset it replaces is dropped instead. If that
+        drop fails, the upload still succeeds and the response reports the replaced dataset as
+        "pending_drop"; its drop is retried in the background.
+
+        With dataset_id the rows are upserted into that existing dataset instead, and a failed
+        ingestion leaves it as it was, since its transaction is rolled back.
+
+        Args:
+            upload_id (str): The ID of the upload.
+            file_path (str): The path of the spooled file.
+            content_hash (str): The SHA-256 of the file.
+            file_name (str | None): The name of the uploaded file.
+            engine (str): The ingestion engine, already validated.
+            force (bool, optional): Ingest the file even if it was already ingested. Defaults to False.
+            replace (int | None, optional): The dataset dropped once the file is ingested. Defaults to None.
+            dataset_id (int | None, optional): The existing dataset the rows are upserted into, as resolved
+                by check_upload_target. Defaults to None, a new dataset.
+
+        Returns:
+            CsvUploadResponse | CsvDuplicateUploadResponse: The ingestion result, or the upload that already ingested the file.
+        """
+        append = dataset_id is not None
+        stats = None
+        try:
+            duplicate = None if force else await self.find_duplicate_upload(content_hash)
+            if duplicate:
+                return duplicate
+            if not append:
+                dataset_id = await self.repository.create_dataset(upload_id, file_name, content_hash)
+            stats = await ingest_file(
+                self.repository, file_path, engine, reject_file_path(upload_id), dataset_id=dataset_id
+            )
+        except HTTPException as error:
+            if isinstance(error.__cause__, UnicodeDecodeError):
+                raise HTTPException(status_code=400, detail="CSV file must be UTF-8 encoded") from error
+            if isinstance(error.__cause__, DECOMPRESSION_ERRORS):
+                raise self.corrupt_file_error(error.__cause__) from error
+            raise
+        except DECOMPRESSION_ERRORS as error:
+            raise self.corrupt_file_error(error) from error
+        finally:
+            remove_spool_file(file_path)
+            if dataset_id is not None and stats is None and not append:
+                await discard_dataset(self.repository, dataset_id)
+        replaced_status = None
+        if not append:
+            drop_error = await complete_dataset(self.repository, dataset_id, replace)
+            if replace is not None:
+                replaced_status = "pending_drop" if drop_error else "dropped"
+        await record_ingested_file(self.repository, content_hash, upload_id, file_name, stats, dataset_id)
+        return CsvUploadResponse(
+            message="CSV file uploaded successfully",
+            upload_id=upload_id,
+            dataset_id=dataset_id,
+            engine=stats.engine,
+            rows=stats.rows,
+            rows_rejected=stats.rows_rejected,
+            rows_inserted=stats.rows_inserted,
+            rows_updated=stats.rows_updated,
+            rows_unchanged=stats.rows_unchanged,
+            elapsed_seconds=stats.elapsed_seconds,
+            rows_per_second=stats.rows_per_second,
+            replaced_dataset_id=replace,
+            replaced_dataset_status=replaced_status,
+        )
+
+    @timed_operation("submit_csv")
+    async def submit_csv(
+        self,
+        file: UploadFile,
+        engine: str | None = None,
+        force: bool = False,
+        replace: int | None = None,
+        dataset_id: int | None = None,
+        new_dataset: bool = False
+    ) -> CsvUploadJobResponse | CsvDuplicateUploadResponse:
+        """
+        Asynchronously spools an uploaded CSV file to disk and queues a background ingestion job for it.
+        The job ingests the file into the default dataset, or into the dataset_id or a new dataset when set.
 
         Parameters:
             file (UploadFile): The CSV file to be uploaded.
+            engine (str | None, optional): The ingestion engine, "upsert", "copy", "insert" or "parallel". Defaults to the CSV_INGESTION_ENGINE environment variable.
+            force (bool, optional): Queue the file even if it was already ingested. Defaults to False.
+            replace (int | None, optional): A dataset dropped once the job has ingested the file into a new dataset. Defaults to None.
+            dataset_id (int | None, optional): The existing dataset the rows are upserted into. Defaults to None,
+                the default dataset, so rows already uploaded are updated instead of duplicated.
+            new_dataset (bool, optional): Ingest the rows into a new dataset of their own. Defaults to False.
+
+        Returns:
+            CsvUploadJobResponse | CsvDuplicateUploadResponse: The ID of the queued job, to be followed with get_ingestion_job,
+            or the upload that already ingested the file.
+
+        Raises:
+            HTTPException: If the engine is unknown, the replaced dataset cannot be dropped, the target dataset
+                cannot be appended to or the job cannot be created.
+        """
+        engine = self.validate_engine(engine)
+        dataset_id = await self.check_upload_target(dataset_id, replace, new_dataset)
+        job_id = new_job_id()
+        file_path, content_hash = await run_in_threadpool(spool_upload, file.file, job_id)
+        await self.check_upload_compression(file_path, file.headers.get("content-encoding"))
+        return await self.queue_spooled_file(
+            job_id, file_path, content_hash, file.filename, engine, force, replace, dataset_id
+        )
+
+    async def queue_spooled_file(
+        self,
+        job_id: str,
+        file_path: str,
+        content_hash: str,
+        file_name: str | None,
+        engine: str,
+        force: bool = False,
+        replace: int | None = None,
+        dataset_id: int | None = None
+    ) -> CsvUploadJobResponse | CsvDuplicateUploadResponse:
+        """
+        Asynchronously queues a background ingestion job for a file already spooled to disk, unless
+        its content was already ingested and force is not set. The dataset the job ingests into is
+        created right away, so its ID is known before the job runs, unless the job appends to the
+        existing dataset_id, which is never dropped by the job.
+
+        Args:
+            job_id (str): The ID of the job.
+            file_path (str): The path of the spooled file, removed once the job is done.
+            content_hash (str): The SHA-256 of the file.
+            file_name (str | None): The name of the uploaded file.
+            engine (str): The ingestion engine, already validated.
+            force (bool, optional): Queue the file even if it was already ingested. Defaults to False.
+            replace (int | None, optional): The dataset dropped once the job succeeds. Defaults to None.
+            dataset_id (int | None, optional): The existing dataset the rows are upserted into, as resolved
+                by check_upload_target. Defaults to None, a new dataset.
+
+        Returns:
+            CsvUploadJobResponse | CsvDuplicateUploadResponse: The queued job, or the upload that already ingested the file.
+
+        Raises:
+            HTTPException: If the job cannot be created.
+        """
+        append = dataset_id is not None
+        try:
+            duplicate = None if force else await self.find_duplicate_upload(content_hash)
+            if not duplicate:
+                if not append:
+                    dataset_id = await self.repository.create_dataset(job_id, file_name, content_hash)
+                await self.repository.create_ingestion_job(
+                    job_id, file_name, file_path, engine, content_hash, dataset_id, replace, append
+                )
+        except HTTPException:
+            remove_spool_file(file_path)
+            if dataset_id is not None and not append:
+                await discard_dataset(self.repository, dataset_id)
+            raise
+        if duplicate:
+            remove_spool_file(file_path)
+            return duplicate
+
+        job_manager = get_job_manager()
+        if job_manager:
+            job_manager.submit()
+        return CsvUploadJobResponse(
+            message="CSV file queued for ingestion", job_id=job_id, dataset_id=dataset_id, status="queued"
+        )
+
+    @staticmethod
+    def corrupt_file_error(error: Exception) -> HTTPException:
+        return HTTPException(status_code=400, detail=f"Compressed file is corrupt or truncated. Error: {error}")
+
+    @staticmethod
+    async def check_upload_compression(file_path: str, content_encoding: str | None = None) -> str | None:
+        """
+        Asynchronously detects whether a spooled upload is compressed with gzip, zstd or zip, which
+        are decompressed while the file is ingested. The spooled file is removed if it cannot be read.
+
+        Args:
+            file_path (str): The path of the spooled file.
+            content_encoding (str | None, optional): The Content-Encoding declared for the file. Defaults to None.
+
+        Returns:
+            str | None: The compression of the file, or None for plain text.
+
+        Raises:
+            HTTPException: If the compression is not supported or does not match content_encoding.
+        """
+        try:
+            return await run_in_threadpool(check_compression, file_path, content_encoding)
+        except UnsupportedCompressionError as error:
+            remove_spool_file(file_path)
+            raise HTTPException(status_code=400, detail=str(error)) from error
+
+    async def find_duplicate_upload(self, content_hash: str) -> CsvDuplicateUploadResponse | None:
+        """
+        Asynchronously checks whether a file with the same content was already ingested.
+
+        Args:
+            content_hash (str): The SHA-256 of the file.
+
+        Returns:
+            CsvDuplicateUploadResponse | None: The upload that ingested the file, or None if it is new.
+        """
+        ingested_file = await self.repository.get_ingested_file(content_hash)
+        if ingested_file is None:
+            return None
+        upload_id, ingested_at = ingested_file
+        logging.info("CSV file already ingested by upload %s", upload_id)
+        return CsvDuplicateUploadResponse(
+            message="CSV file was already ingested",
+            upload_id=str(upload_id),
+            content_hash=content_hash,
+            ingested_at=ingested_at,
+        )
+
+    @staticmethod
+    def validate_engine(engine: str | None) -> str:
+        """
+        Returns the ingestion engine to use, falling back to CSV_INGESTION_ENGINE.
+
+        Raises:
+            HTTPException: If the engine is unknown.
+        """
+        engine = engine or CSV_INGESTION_ENGINE
+        if engine not in ENGINE_NAMES:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unknown ingestion engine '{engine}'. Available engines: {', '.join(ENGINE_NAMES)}"
+            )
+        return engine
+
+    @staticmethod
+    def upload_session_response(session: UploadSession) -> UploadSessionResponse:
+        return UploadSessionResponse(
+            id=session.id,
+            file_name=session.file_name,
+            size=session.size,
+            offset=session.offset,
+            engine=session.engine,
+            expires_at=datetime.fromtimestamp(session.expires_at, timezone.utc),
+        )
+
+    @timed_operation("create_upload_session")
+    async def create_upload_session(self, payload: CreateUploadPayload) -> UploadSessionResponse:
+        """
+        Asynchronously starts a resumable upload of a file sent in chunks with upload_chunk.
+
+        Args:
+            payload (CreateUploadPayload): The size of the file and, optionally, its name, its ingestion
+                engine and its SHA-256, checked when the upload is finalized.
+
+        Returns:
+            UploadSessionResponse: The new session, at offset 0.
+
+        Raises:
+            HTTPException: If the engine, the size or the checksum is invalid.
+        """
+        engine = self.validate_engine(payload.engine)
+        session = await run_in_threadpool(
+            create_session, new_job_id(), payload.file_name, payload.size, engine, payload.sha256
+        )
+        return self.upload_session_response(session)
+
+    @timed_operation("get_upload_session")
+    async def get_upload_session(self, upload_id: str) -> UploadSessionResponse:
+        """
+        Asynchronously returns an upload session and its offset, the number of bytes received so
+        far, from which an interrupted upload is resumed.
+
+        Raises:
+            HTTPException: If the session does not exist or has expired.
+        """
+        session = await run_in_threadpool(load_session, upload_id)
+        return self.upload_session_response(session)
+
+    @timed_operation("upload_chunk")
+    async def upload_chunk(
+        self,
+        upload_id: str,
+        content_range: str | None,
+        checksum: str | None,
+        body: AsyncIterator[bytes]
+    ) -> UploadSessionResponse:
+        """
+        Asynchronously appends one chunk to an upload session. The chunk is streamed to disk as it
+        arrives, so its size does not affect memory usage.
+
+        Args:
+            upload_id (str): The ID of the session.
+            content_range (str | None): The Content-Range header of the chunk, "bytes <first>-<last>/<size>".
+            checksum (str | None): The SHA-256 of the chunk, in hexadecimal.
+            body (AsyncIterator[bytes]): The request body.
+
+        Returns:
+            UploadSessionResponse: The session with its new offset.
+
+        Raises:
+            HTTPException: 404 if the session does not exist, 409 if the chunk does not start at the
+                session offset, 400, 413 or 416 if the chunk is invalid.
+        """
+        session = await run_in_threadpool(load_session, upload_id)
+        start, length = parse_content_range(session, content_range)
+        await write_chunk(session, start, length, body, checksum)
+        return self.upload_session_response(session)
+
+    @timed_operation("finalize_upload")
+    async def finalize_upload(
+        self,
+        upload_id: str,
+        background: bool = True,
+        force: bool = False,
+        replace: int | None = None,
+        dataset_id: int | None = None,
+        new_dataset: bool = False
+    ) -> CsvUploadJobResponse | CsvUploadResponse | CsvDuplicateUploadResponse:
+        """
+        Asynchronously completes an upload session and ingests its file like upload_csv, or queues it
+        like submit_csv when background is set. The upload ID becomes the upload or job ID.
+
+        Args:
+            upload_id (str): The ID of the session.
+            background (bool, optional): Queue the file for ingestion instead of ingesting it now. Defaults to True.
+            force (bool, optional): Ingest the file even if it was already ingested. Defaults to False.
+            replace (int | None, optional): A dataset dropped once the file is ingested into a new dataset. Defaults to None.
+            dataset_id (int | None, optional): The existing dataset the rows are upserted into. Defaults to None,
+                the default dataset, so rows already uploaded are updated instead of duplicated.
+            new_dataset (bool, optional): Ingest the rows into a new dataset of their own. Defaults to False.
+
+        Returns:
+            CsvUploadJobResponse | CsvUploadResponse | CsvDuplicateUploadResponse: The queued job, the
+            ingestion result, or the upload that already ingested the file.
+
+        Raises:
+            HTTPException: 404 if the session, the replaced or the target dataset does not exist, 409 if bytes
+                are missing, 400 if the file does not match the SHA-256 given when the session was created.
+        """
+        session = await run_in_threadpool(load_session, upload_id)
+        dataset_id = await self.check_upload_target(dataset_id, replace, new_dataset)
+        file_path, content_hash = await run_in_threadpool(finalize_session, session, upload_id)
+        await self.check_upload_compression(file_path)
+        if background:
+            return await self.queue_spooled_file(
+                upload_id, file_path, content_hash, session.file_name, session.engine, force, replace, dataset_id
+            )
+        return await self.ingest_spooled_file(
+            upload_id, file_path, content_hash, session.file_name, session.engine, force, replace, dataset_id
+        )
+
+    @timed_operation("delete_upload_session")
+    async def delete_upload_session(self, upload_id: str) -> None:
+        """
+        Asynchronously abandons an upload session and removes the data received so far.
+
+        Raises:
+            HTTPException: If the session does not exist.
+        """
+        await run_in_threadpool(delete_session, upload_id)
+
+    @timed_operation("get_ingestion_job")
+    async def get_ingestion_job(self, job_id: str) -> IngestionJobResponse:
+        """
+        Asynchronously retrieves the status and progress of an ingestion job.
+
+        Args:
+            job_id (str): The job ID.
+
+        Returns:
+            IngestionJobResponse: The job status, rows processed, throughput and error, if any.
+
+        Raises:
+            HTTPException: If the job does not exist.
+        """
+        job = await self.repository.get_ingestion_job(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail=f"Ingestion job not found: {job_id}")
+        job = dict(zip(INGESTION_JOB_FIELDS, job))
+        job["id"] = str(job["id"])
+        return IngestionJobResponse(**job)
+
+    @timed_operation("get_rejects_file")
+    async def get_rejects_file(self, upload_id: str) -> FileResponse:
+        """
+        Asynchronously returns the reject file of an upload, with the line number, the reason and the
+        original values of each rejected row. Reject files are kept for REJECTS_RETENTION_SECONDS.
+
+        Args:
+            upload_id (str): The upload or job ID.
+
+        Returns:
+            FileResponse: The reject CSV file.
+
+        Raises:
+            HTTPException: If the upload has no rejected rows or does not exist.
+        """
+        file_path = reject_file_path(upload_id)
+        if not os.path.exists(file_path):
+            raise HTTPException(status_code=404, detail=f"No rejected rows for upload: {upload_id}")
+        return FileResponse(file_path, media_type="text/csv", filename=f"rejects-{upload_id}.csv")
+
+    @timed_operation("cancel_ingestion_job")
+    async def cancel_ingestion_job(self, job_id: str) -> IngestionJobResponse:
+        """
+        Asynchronously cancels a queued or running ingestion job. A running job stops at its next batch
+        and nothing it inserted is kept. The dataset created for the job and the spooled file are removed;
+        a dataset the job appends to is kept.
+
+        Args:
+            job_id (str): The job ID.
 
         Returns:
-            CsvUploaderResponse: A response object indicating the success of the CSV file upload.
+            IngestionJobResponse: The job after the cancellation request.
+
+        Raises:
+            HTTPException: If the job does not exist.
         """
-        file_content = file.file.read().decode("utf-8")
-        reader = csv.reader(file_content.splitlines())
-        await self.repository()
-        await self.repository.save_csv_file(list(reader))
-        return CsvUploaderResponse(message="CSV file uploaded successfully")
+        cancelled = await self.repository.cancel_ingestion_job(job_id)
+        if cancelled is not None and cancelled[0] == "cancelled":
+            # A job cancelled while queued never reaches a worker, which would clean up after it
+            _, file_path, dataset_id, append = cancelled
+            await run_in_threadpool(remove_spool_file, file_path)
+            if dataset_id is not None and not append:
+                await discard_dataset(self.repository, dataset_id)
+        return await self.get_ingestion_job(job_id)
 
-    async def get_all_values_with_pagination(self, page_number: int, page_size: int = 10) -> List[CsvUploaderResponseAllItems] | None:
+    @timed_operation("get_all_values_with_pagination")
+    async def get_all_values_with_pagination(
+        self,
+        page_number: int,
+        page_size: int = 10,
+        cursor: str | None = None,
+        count_mode: str | None = None,
+        dataset_id: int | None = None
+    ) -> Page | None:
         """
         Asynchronously retrieves all values from the database with pagination.
 
         Parameters:
-            page_number (int): The page number to retrieve values from.
+            page_number (int): The page number to retrieve values from. Ignored when a cursor is given.
+            page_size (int, optional): The number of items per page. Defaults to 10.
+            cursor (str | None, optional): The next or previous page cursor of a previous response. Defaults to None.
+            count_mode (str | None, optional): "maintained", "estimate" or "exact". Defaults to the PAGINATION_COUNT_MODE environment variable.
+            dataset_id (int | None, optional): Only list, and count, the items of this dataset. Defaults to None.
 
         Returns:
-            List[CsvUploaderResponseAllItems] | None: A list of CsvUploaderResponseAllItems objects, or None if no values are found.
+            Page | None: The page with its items as dictionaries, the total count and the page cursors, or None if no values are found.
         """
         logging.info("Getting all values with pagination")
-        await self.repository()
-        values, total_count = await self.repository.get_all_values_with_pagination(page_number, page_size)
-        if not values:
-            return None
-        return await self.prepare_values(values), total_count
+        page = await self.repository.get_all_values_with_pagination(
+            page_number, page_size, cursor, count_mode or PAGINATION_COUNT_MODE, dataset_id
+        )
+        return self.prepare_page(page)
 
-    async def get_filtered_value(self, field_name: str, field_value: str, page: int) -> List[CsvUploaderResponseAllItems] | None:
+    @timed_operation("get_filtered_value")
+    async def get_filtered_value(
+        self,
+        field_name: str,
+        field_value: str,
+        page: int,
+        page_size: int = 10,
+        cursor: str | None = None,
+        dataset_id: int | None = None
+    ) -> Page | None:
         """
         Asynchronously retrieves filtered values from the repository based on the given field name and value.
 
         Args:
             field_name (str): The name of the field to filter by.
             field_value (str): The value to filter by.
+            page (int): The page number to retrieve. Ignored when a cursor is given.
+            page_size (int, optional): The number of items per page. Defaults to 10.
+            cursor (str | None, optional): The next or previous page cursor of a previous response. Defaults to None.
+            dataset_id (int | None, optional): Only look in this dataset. Defaults to None, every dataset,
+                or the default dataset for an id.
 
         Returns:
-            List[CsvUploaderResponseAllItems] | None: A list of CsvUploaderResponseAllItems objects if values are found, 
+            Page | None: The page with its items as dictionaries if values are found,
             otherwise None.
         """
-        await self.repository()
-        values = await self.repository.get_filtered_value(field_name, field_value, page)
-        if not values:
-            return None
-        return await self.prepare_values(values)
+        values = await self.repository.get_filtered_value(field_name, field_value, page, page_size, cursor, dataset_id)
+        return self.prepare_page(values)
 
-    @staticmethod
-    async def prepare_values(values: Union[List[Tuple], Tuple]) -> List[CsvUploaderResponseAllItems]:
+    @timed_operation("filter_values")
+    async def filter_values(
+        self,
+        filters: Iterable[Tuple[str, str]],
+        page: int,
+        page_size: int = 10,
+        cursor: str | None = None
+    ) -> Page | None:
+        """
+        Asynchronously retrieves the values matching all the given filters.
+
+        Args:
+            filters (Iterable[Tuple[str, str]]): (key, value) pairs such as ("nacionalidade", "Brasileiro")
+                or ("data_nascimento__gte", "1980/01/01").
+            page (int): The page number to retrieve. Ignored when a cursor is given.
+            page_size (int, optional): The number of items per page. Defaults to 10.
+            cursor (str | None, optional): The next or previous page cursor of a previous response. Defaults to None.
+
+        Returns:
+            Page | None: The page with its items as dictionaries if values are found,
+            otherwise None.
+
+        Raises:
+            HTTPException: If any of the filters is invalid.
+        """
+        try:
+            predicates = parse_filters(filters)
+        except InvalidFilterError as error:
+            raise HTTPException(status_code=400, detail=str(error)) from error
+        values = await self.repository.filter_values(predicates, page, page_size, cursor)
+        return self.prepare_page(values)
+
+    @timed_operation("search_values")
+    async def search_values(self, text: str, mode: str = "prefix", limit: int = 10) -> List[Dict[str, Any]]:
         """
-        Asynchronously prepares a list of values from a list of tuples or a single tuple into a list of CsvUploaderResponseAllItems objects.
+        Asynchronously searches the items by name, ignoring case and accents, for typeahead.
 
         Args:
-            values (Union[List[Tuple], Tuple]): The list of tuples or a single tuple containing the values to be prepared.
+            text (str): The text to search for.
+            mode (str, optional): "prefix", "substring" or "fuzzy". Defaults to "prefix".
+            limit (int, optional): The maximum number of results. Defaults to 10.
 
         Returns:
-            List[CsvUploaderResponseAllItems]: The list of prepared CsvUploaderResponseAllItems objects.
+            List[Dict[str, Any]]: The matching items, best matches first.
+
+        Raises:
+            HTTPException: If the text is empty, or the mode or limit is invalid.
+        """
+        try:
+            text = validate_search(text, mode, limit)
+        except InvalidSearchError as error:
+            raise HTTPException(status_code=400, detail=str(error)) from error
+        values = await self.repository.search_values(text, mode, limit)
+        with stage("page.serialize"):
+            return rows_to_items(values)
+
+    @staticmethod
+    def prepare_page(page: Page) -> Page | None:
         """
-        prepared_values = []
-        if isinstance(values, tuple):
-            values = [values]
+        Turns the rows of a page into item dictionaries ready to be encoded as JSON.
 
-        for value in values:
-            prepared_value = {
-                "id": int(value[0]),
-                "nome": str(value[1]),
-                "data_nascimento": format_date_ymd_to_ymd(str(value[2])),
-                "genero": str(value[3]),
-                "nacionalidade": str(value[4]),
-                "data_criacao": format_date_ymd_to_ymd(str(value[5])),
-                "data_atualizacao": format_date_ymd_to_ymd(str(value[6])),
-            }
-            prepared_values.append(prepared_value)
+        Args:
+            page (Page): The page returned by the repository.
 
-        return [CsvUploaderResponseAllItems(**value) for value in prepared_values]
+        Returns:
+            Page | None: The page with its items as dictionaries, or None if it has no items.
+        """
+        if not page.items:
+            return None
+        with stage("page.serialize"):
+            page.items = rows_to_items(page.items)
+        return page
 
-    async def add_item(self, payload: AddItemPayload) -> List[CsvUploaderResponseAllItems]:
+    @timed_operation("add_item")
+    async def add_item(self, payload: AddItemPayload) -> List[Dict[str, Any]]:
         """
         Asynchronously adds an item to the repository and returns a list of prepared values.
 
@@ -111,57 +690,377 @@ class CsvUploaderService:
             payload (AddItemPayload): The payload containing the item to be added.
 
         Returns:
-            List[CsvUploaderResponseAllItems]: A list of prepared values.
+            List[Dict[str, Any]]: A list of prepared values.
         """
-        await self.repository()
         added_value = await self.repository.add_value_to_db(payload)
-        return await self.prepare_values(added_value)
+        return rows_to_items(added_value)
 
-    async def update_item(self, payload: AddItemPayload, item_id: int) -> List[CsvUploaderResponseAllItems]:
+    @timed_operation("update_item")
+    async def update_item(
+        self,
+        payload: AddItemPayload,
+        item_id: int,
+        dataset_id: int = DEFAULT_DATASET_ID
+    ) -> List[Dict[str, Any]]:
         """
         Asynchronously updates an item in the repository and returns a list of prepared values.
 
         Args:
             payload (AddItemPayload): The payload containing the updated item.
             item_id (int): The ID of the item to be updated.
+            dataset_id (int, optional): The dataset of the item. Defaults to DEFAULT_DATASET_ID.
 
         Returns:
-            List[CsvUploaderResponseAllItems]: A list of prepared values.
+            List[Dict[str, Any]]: A list of prepared values.
+
+        Raises:
+            HTTPException: 404 if the item does not exist.
+        """
+        updated_value = await self.repository.update_value_in_db(payload, item_id, dataset_id)
+        if not updated_value:
+            raise HTTPException(status_code=404, detail=f"Item not found: {item_id}")
+        return rows_to_items(updated_value)
+
+    @staticmethod
+    def dataset_response(dataset: Tuple) -> DatasetResponse:
+        dataset = dict(zip(DATASET_FIELDS, dataset))
+        if dataset["upload_id"] is not None:
+            dataset["upload_id"] = str(dataset["upload_id"])
+        return DatasetResponse(**dataset)
+
+    @timed_operation("get_datasets")
+    async def get_datasets(self) -> List[DatasetResponse]:
+        """
+        Asynchronously lists the datasets, one per upload, with their status and row count.
+
+        Returns:
+            List[DatasetResponse]: The datasets, oldest first.
+        """
+        return [self.dataset_response(dataset) for dataset in await self.repository.get_datasets()]
+
+    @timed_operation("get_dataset")
+    async def get_dataset(self, dataset_id: int) -> DatasetResponse:
+        """
+        Asynchronously retrieves a dataset with its status and row count.
+
+        Raises:
+            HTTPException: If the dataset does not exist.
+        """
+        dataset = await self.repository.get_dataset(dataset_id)
+        if dataset is None:
+            raise HTTPException(status_code=404, detail=f"Dataset not found: {dataset_id}")
+        return self.dataset_response(dataset)
+
+    async def get_droppable_dataset(self, dataset_id: int | None) -> DatasetResponse | None:
+        """
+        Asynchronously checks that a dataset to be deleted or replaced exists, is not the default
+        dataset, and is ready or pending its drop; a loading dataset is dropped by cancelling its job.
+
+        Returns:
+            DatasetResponse | None: The dataset, or None if dataset_id is None.
+
+        Raises:
+            HTTPException: 404 if the dataset does not exist, 400 if it is the default dataset,
+                409 if it is still loading.
+        """
+        if dataset_id is None:
+            return None
+        dataset = await self.get_dataset(dataset_id)
+        if dataset.id == DEFAULT_DATASET_ID:
+            raise HTTPException(status_code=400, detail=f"The default dataset {DEFAULT_DATASET_ID} cannot be dropped")
+        if dataset.status not in ("ready", "pending_drop"):
+            raise HTTPException(
+                status_code=409, detail=f"Dataset {dataset_id} is {dataset.status}, cancel its ingestion job instead"
+            )
+        return dataset
+
+    async def check_upload_target(
+        self,
+        dataset_id: int | None,
+        replace: int | None,
+        new_dataset: bool = False
+    ) -> int | None:
+        """
+        Asynchronously checks the datasets an upload writes to and resolves its target. By default
+        an upload upserts its rows into the default dataset, so rows that overlap earlier uploads
+        are updated rather than duplicated. With dataset_id they are upserted into that existing
+        dataset instead, which must be "ready". With new_dataset, or replace, the upload gets a new
+        dataset of its own, which replace then swaps for the replaced one.
+
+        Returns:
+            int | None: The dataset the rows are upserted into, or None for a new dataset.
+
+        Raises:
+            HTTPException: 400 if dataset_id is set together with replace or new_dataset, 404 if a dataset
+                does not exist, 409 if the target dataset is not ready or a new dataset would go past
+                DATASET_MAX_COUNT, or any error of get_droppable_dataset for replace.
+        """
+        if dataset_id is not None and (replace is not None or new_dataset):
+            raise HTTPException(
+                status_code=400, detail="An upload cannot both append to a dataset and create or replace one"
+            )
+        await self.get_droppable_dataset(replace)
+        if replace is not None or new_dataset:
+            # Checked again when the dataset is created, but failing here spares spooling the file
+            if len(await self.repository.get_datasets()) >= DATASET_MAX_COUNT:
+                raise ResumeConnectionHandler.dataset_limit_error()
+            return None
+        if dataset_id is None:
+            return DEFAULT_DATASET_ID
+        dataset = await self.get_dataset(dataset_id)
+        if dataset.status != "ready":
+            raise HTTPException(
+                status_code=409, detail=f"Dataset {dataset_id} is {dataset.status}, it cannot be appended to"
+            )
+        return dataset_id
+
+    @timed_operation("delete_dataset")
+    async def delete_dataset(self, dataset_id: int) -> None:
+        """
+        Asynchronously deletes a dataset with all its rows by dropping its partition, which takes
+        the same time whatever the size of the dataset.
+
+        Raises:
+            HTTPException: 404 if the dataset does not exist, 400 if it is the default dataset,
+                409 if it is still loading or the table stayed busy.
         """
-        await self.repository()
-        updated_value = await self.repository.update_value_in_db(payload, item_id)
-        return await self.prepare_values(updated_value)
+        await self.get_droppable_dataset(dataset_id)
+        if not await self.repository.drop_dataset(dataset_id):
+            raise HTTPException(status_code=404, detail=f"Dataset not found: {dataset_id}")
 
-    async def delete_item(self, item_id: int) -> None:
+    async def get_cache_stats(self) -> CacheStatsResponse:
+        """
+        Asynchronously returns the hit, miss, eviction and size statistics of the query cache.
+
+        Returns:
+            CacheStatsResponse: The query cache statistics.
+        """
+        stats = await run_in_threadpool(self.repository.cache.stats)
+        return CacheStatsResponse(**stats)
+
+    @timed_operation("get_stats")
+    async def get_stats(
+        self,
+        dimensions: Iterable[str] = (),
+        birth_year_bucket: int = 10,
+        date_granularity: str = "month"
+    ) -> StatsResponse:
+        """
+        Asynchronously returns the row counts by nacionalidade, genero, birth year and data_criacao,
+        read from the summary table the database keeps up to date on every write.
+
+        Args:
+            dimensions (Iterable[str], optional): The dimensions to include. Defaults to all of them.
+            birth_year_bucket (int, optional): The width of the birth year buckets, in years. Defaults to 10.
+            date_granularity (str, optional): "day", "month" or "year" buckets of data_criacao. Defaults to "month".
+
+        Returns:
+            StatsResponse: The total number of rows and the bucket counts by dimension.
+
+        Raises:
+            HTTPException: If a dimension, the bucket width or the granularity is invalid.
+        """
+        try:
+            dimensions = validate_stats_query(dimensions, birth_year_bucket, date_granularity)
+        except InvalidStatsQueryError as error:
+            raise HTTPException(status_code=400, detail=str(error)) from error
+        stats = await self.repository.get_stats()
+        return StatsResponse(**summarize_stats(stats, dimensions, birth_year_bucket, date_granularity))
+
+    @timed_operation("rebuild_stats")
+    async def rebuild_stats(self) -> StatsRebuildResponse:
+        """
+        Asynchronously recomputes the stats summary table and the row counter from users_data.
+
+        Returns:
+            StatsRebuildResponse: The number of rows counted and the time the rebuild took.
+        """
+        started_at = time.perf_counter()
+        rows = await self.repository.rebuild_stats()
+        elapsed = time.perf_counter() - started_at
+        logging.info("Rebuilt stats of %s rows in %.2fs", rows, elapsed)
+        return StatsRebuildResponse(message="Stats rebuilt successfully", rows=rows, elapsed_seconds=elapsed)
+
+    @timed_operation("delete_item")
+    async def delete_item(self, item_id: int, dataset_id: int = DEFAULT_DATASET_ID) -> None:
         """
         Asynchronously deletes an item from the repository.
 
         Args:
             item_id (int): The ID of the item to be deleted.
+            dataset_id (int, optional): The dataset of the item. Defaults to DEFAULT_DATASET_ID.
+        """
+        await self.repository.delete_value_from_db(item_id, dataset_id)
+
+    @staticmethod
+    def validate_batch_size(count: int) -> None:
+        """
+        Raises:
+            HTTPException: If the batch holds more than BULK_MAX_ITEMS items.
+        """
+        if count > BULK_MAX_ITEMS:
+            raise HTTPException(status_code=413, detail=f"A batch may hold at most {BULK_MAX_ITEMS} items, got {count}")
+
+    @timed_operation("add_items")
+    async def add_items(self, payloads: List[AddItemPayload]) -> Dict[str, Any]:
+        """
+        Asynchronously adds a batch of items in one transaction and reports the outcome of each one.
+
+        Every item is validated with the rules of add_item first. Invalid items are reported and
+        the valid ones are written with a single statement; an item whose natural key already
+        exists is reported as a conflict instead of failing the batch.
+
+        Args:
+            payloads (List[AddItemPayload]): The items to be added.
+
+        Returns:
+            Dict[str, Any]: The number of items created and failed, and the status ("created",
+            "invalid" or "conflict") of each item, in request order.
+
+        Raises:
+            HTTPException: If the batch is too large or cannot be written.
+        """
+        self.validate_batch_size(len(payloads))
+        results: List[Dict[str, Any] | None] = [None] * len(payloads)
+        positions, rows = [], []
+        for index, payload in enumerate(payloads):
+            error = payload.validation_error()
+            if error:
+                results[index] = bulk_result(index, "invalid", error=error)
+            else:
+                positions.append(index)
+                rows.append(payload.to_row())
+        if rows:
+            items = await self.repository.add_values_to_db(rows)
+            conflict = f"An item with the same {', '.join(NATURAL_KEY_COLUMNS)} already exists"
+            for index, item in zip(positions, items):
+                if item is None:
+                    results[index] = bulk_result(index, "conflict", error=conflict)
+                else:
+                    results[index] = bulk_result(index, "created", item=item)
+        return bulk_response(results, "created")
+
+    @timed_operation("update_items")
+    async def update_items(self, payloads: List[UpdateItemPayload]) -> Dict[str, Any]:
+        """
+        Asynchronously updates a batch of items in one transaction and reports the outcome of each one.
+
+        Every item is validated with the rules of update_item first, and an item may appear only once.
+        If an update would give an item the natural key of another one, nothing is updated.
+
+        Args:
+            payloads (List[UpdateItemPayload]): The items to be updated, each with its id and dataset_id.
+
+        Returns:
+            Dict[str, Any]: The number of items updated and failed, and the status ("updated",
+            "invalid" or "not_found") of each item, in request order.
+
+        Raises:
+            HTTPException: If the batch is too large, duplicates a natural key or cannot be written.
         """
-        await self.repository()
-        await self.repository.delete_value_from_db(item_id)
+        self.validate_batch_size(len(payloads))
+        results: List[Dict[str, Any] | None] = [None] * len(payloads)
+        positions, rows, seen_ids = [], [], set()
+        for index, payload in enumerate(payloads):
+            error = payload.validation_error()
+            if error is None and (payload.dataset_id, payload.id) in seen_ids:
+                error = f"Duplicate id in batch: {payload.id}"
+            if error:
+                results[index] = bulk_result(index, "invalid", item_id=payload.id, error=error)
+            else:
+                seen_ids.add((payload.dataset_id, payload.id))
+                positions.append(index)
+                rows.append((payload.dataset_id, payload.id, *payload.to_row()))
+        if rows:
+            items = await self.repository.update_values_in_db(rows)
+            for index, item in zip(positions, items):
+                if item is None:
+                    item_id = payloads[index].id
+                    results[index] = bulk_result(index, "not_found", item_id=item_id, error=f"Item not found: {item_id}")
+                else:
+                    results[index] = bulk_result(index, "updated", item=item)
+        return bulk_response(results, "updated")
+
+    @timed_operation("delete_items")
+    async def delete_items(self, item_ids: List[int], dataset_id: int = DEFAULT_DATASET_ID) -> Dict[str, Any]:
+        """
+        Asynchronously deletes a batch of items in one transaction and reports the outcome of each one.
+
+        Args:
+            item_ids (List[int]): The IDs of the items to be deleted.
+            dataset_id (int, optional): The dataset of the items. Defaults to DEFAULT_DATASET_ID.
+
+        Returns:
+            Dict[str, Any]: The number of items deleted and failed, and the status ("deleted",
+            "invalid" or "not_found") of each id, in request order.
+
+        Raises:
+            HTTPException: If the batch is too large or cannot be written.
+        """
+        self.validate_batch_size(len(item_ids))
+        unique_ids = list(dict.fromkeys(item_ids))
+        deleted_ids = set(await self.repository.delete_values_from_db(unique_ids, dataset_id)) if unique_ids else set()
+        results, seen_ids = [], set()
+        for index, item_id in enumerate(item_ids):
+            if item_id in seen_ids:
+                results.append(bulk_result(index, "invalid", item_id=item_id, error=f"Duplicate id in batch: {item_id}"))
+            elif item_id in deleted_ids:
+                results.append(bulk_result(index, "deleted", item_id=item_id))
+            else:
+                results.append(bulk_result(index, "not_found", item_id=item_id, error=f"Item not found: {item_id}"))
+            seen_ids.add(item_id)
+        return bulk_response(results, "deleted")
 
     
     
-    async def get_csv_file(self) -> StreamingResponse:
+    @timed_operation("get_csv_file")
+    async def get_csv_file(
+        self,
+        compression: str | None = None,
+        export_format: str | None = None,
+        accept: str | None = None,
+        filters: Iterable[Tuple[str, str]] = (),
+        updated_since: str | None = None
+    ) -> StreamingResponse:
         """
-        Asynchronously downloads the CSV file from the repository.
-        """
-        await self.repository()
-        all_values = await self.repository.get_all_values()
-        csv_buffer = StringIO()
-        csv_writer = csv.writer(csv_buffer)
+        Asynchronously downloads the table as a CSV, NDJSON, Parquet or Arrow IPC file.
+
+        The rows are read through a server-side cursor and encoded chunk by chunk (row group by row group for
+        the columnar formats) while the response is being sent, so the first bytes go out immediately and memory
+        usage does not grow with the table.
+
+        Args:
+            compression (str | None, optional): "gzip" or "zstd" to compress a CSV or NDJSON file, or the codec of
+                a Parquet ("snappy", "gzip", "zstd") or Arrow ("lz4", "zstd") file. Defaults to None.
+            export_format (str | None, optional): "csv", "ndjson", "parquet" or "arrow". Defaults to the format
+                negotiated from accept, or CSV.
+            accept (str | None, optional): The Accept header of the request. Defaults to None.
+            filters (Iterable[Tuple[str, str]], optional): (key, value) pairs in the format of filter_values,
+                to only export the matching rows. Defaults to ().
+            updated_since (str | None, optional): Only export the rows whose data_atualizacao is on or after
+                this date, for incremental exports. Defaults to None.
 
-        csv_writer.writerow(["Nome", "Data de Nascimento", "Gênero", "Nacionalidade", "Data de Criacao", "Data de Atualizacao"])
-        
-        for row in all_values:
-            csv_writer.writerow(row[1:])
+        Returns:
+            StreamingResponse: The streamed file.
 
-        csv_buffer.seek(0)
+        Raises:
+            HTTPException: If the format, the compression or any of the filters is invalid.
+        """
+        filters = list(filters)
+        if updated_since:
+            filters.append(("data_atualizacao__gte", updated_since))
+        try:
+            output_format = negotiate_format(export_format, accept)
+            validate_compression(output_format, compression)
+            predicates = parse_filters(filters)
+        except (UnsupportedExportError, InvalidFilterError) as error:
+            raise HTTPException(status_code=400, detail=str(error)) from error
 
-        response = StreamingResponse(csv_buffer, media_type="text/csv")
-        response.headers["Content-Disposition"] = "attachment; filename=relatorio.csv"
-        response.headers["Content-Type"] = "text/csv; charset=utf-8"
+        content = encode_export(self.repository.stream_all_values(predicates=predicates), output_format, compression)
+        media_type, extension = export_media_type(output_format, compression)
+        response = StreamingResponse(content, media_type=media_type)
+        response.headers["Content-Disposition"] = f"attachment; filename=relatorio.{extension}"
+        if media_type == "text/csv":
+            response.headers["Content-Type"] = "text/csv; charset=utf-8"
 
         return response
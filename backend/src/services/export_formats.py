@@ -0,0 +1,282 @@
+import os
+import zlib
+import importlib.util
+from dataclasses import dataclass
+from typing import AsyncIterator, Callable, List, Sequence, Tuple
+
+import orjson
+from fastapi.concurrency import run_in_threadpool
+
+from .csv_export import CSV_EXPORT_HEADER, encode_csv_rows
+from ..infra.metrics import stage
+from ..infra.cv_uploader_data_base.querys import USERS_DATA_COLUMNS
+
+# pyarrow takes longer to import than the rest of the app, so it is only imported by the first
+# Parquet or Arrow export instead of slowing down the startup of every worker.
+PYARROW_AVAILABLE = importlib.util.find_spec("pyarrow") is not None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+# Rows per Parquet row group and per Arrow record batch. Columnar encoders buffer this many rows.
+EXPORT_ROW_GROUP_SIZE = int(os.environ.get("EXPORT_ROW_GROUP_SIZE", "100000"))
+
+ZSTD_LEVEL = int(os.environ.get("EXPORT_ZSTD_LEVEL", "3"))
+
+
+class UnsupportedExportError(ValueError):
+    """Raised when an export format or compression is unknown or its library is not installed."""
+
+
+@dataclass(frozen=True)
+class ExportFormat:
+    name: str
+    media_type: str
+    extension: str
+    # Compressions of the whole stream for text formats, or codecs applied inside the file for columnar ones.
+    compressions: Tuple[str, ...]
+    columnar: bool = False
+
+
+EXPORT_FORMATS = {
+    "csv": ExportFormat("csv", "text/csv", "csv", ("gzip", "zstd")),
+    "ndjson": ExportFormat("ndjson", "application/x-ndjson", "ndjson", ("gzip", "zstd")),
+    "parquet": ExportFormat("parquet", "application/vnd.apache.parquet", "parquet", ("snappy", "gzip", "zstd"), True),
+    "arrow": ExportFormat("arrow", "application/vnd.apache.arrow.stream", "arrows", ("lz4", "zstd"), True),
+}
+
+# Media type and file extension of text exports compressed as a whole.
+COMPRESSED_MEDIA_TYPES = {
+    "gzip": ("application/gzip", "gz"),
+    "zstd": ("application/zstd", "zst"),
+}
+
+
+def negotiate_format(export_format: str | None, accept: str | None) -> ExportFormat:
+    """
+    Picks the export format from the format query parameter or, if it is not given, from the
+    media types of the Accept header in order of preference. Defaults to CSV.
+
+    Raises:
+        UnsupportedExportError: If the format parameter names an unknown format.
+    """
+    if export_format:
+        try:
+            return EXPORT_FORMATS[export_format]
+        except KeyError as error:
+            raise UnsupportedExportError(
+                f"Invalid format '{export_format}'. Available formats: {', '.join(EXPORT_FORMATS)}"
+            ) from error
+    by_media_type = {item.media_type: item for item in EXPORT_FORMATS.values()}
+    ranges = []
+    for position, media_range in enumerate((accept or "").split(",")):
+        media_type, *params = [part.strip() for part in media_range.split(";")]
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        ranges.append((-quality, position, media_type.lower()))
+    for quality, _, media_type in sorted(ranges):
+        if quality < 0 and media_type in by_media_type:
+            return by_media_type[media_type]
+    return EXPORT_FORMATS["csv"]
+
+
+def validate_compression(export_format: ExportFormat, compression: str | None) -> None:
+    """
+    Raises:
+        UnsupportedExportError: If the compression does not apply to the format or its library is missing.
+    """
+    if export_format.columnar and not PYARROW_AVAILABLE:
+        raise UnsupportedExportError(f"The {export_format.name} format requires the pyarrow package")
+    if compression is None:
+        return
+    if compression not in export_format.compressions:
+        raise UnsupportedExportError(
+            f"Invalid compression '{compression}' for {export_format.name}. "
+            f"Available compressions: {', '.join(export_format.compressions)}"
+        )
+    if compression == "zstd" and not export_format.columnar and zstandard is None:
+        raise UnsupportedExportError("zstd compression requires the zstandard package")
+
+
+def export_media_type(export_format: ExportFormat, compression: str | None) -> Tuple[str, str]:
+    """
+    Returns the media type and the file extension of an export.
+    """
+    if compression and not export_format.columnar:
+        media_type, extension = COMPRESSED_MEDIA_TYPES[compression]
+        return media_type, f"{export_format.extension}.{extension}"
+    return export_format.media_type, export_format.extension
+
+
+def _stream_compressor(compression: str | None) -> Tuple[Callable[[bytes], bytes], Callable[[], bytes]]:
+    if compression == "gzip":
+        compressor = zlib.compressobj(wbits=31)
+        return compressor.compress, compressor.flush
+    if compression == "zstd":
+        compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+        return compressor.compress, compressor.flush
+    return (lambda data: data), (lambda: b"")
+
+
+def encode_ndjson_rows(rows: List[Sequence]) -> bytes:
+    return b"".join(orjson.dumps(dict(zip(USERS_DATA_COLUMNS, row))) + b"\n" for row in rows)
+
+
+async def _encode_text(
+    chunks: AsyncIterator[List[Sequence]],
+    encode_rows: Callable[[List[Sequence]], bytes],
+    header: bytes,
+    compression: str | None
+) -> AsyncIterator[bytes]:
+    compress, flush = _stream_compressor(compression)
+
+    def encode(rows: List[Sequence]) -> bytes:
+        with stage("export.encode"):
+            return compress(encode_rows(rows))
+
+    if header:
+        yield compress(header)
+    # Encoding and compressing a chunk takes long enough to hold up other requests, so it runs in
+    # a worker thread. The chunks are still encoded one at a time and in order.
+    async for rows in chunks:
+        data = await run_in_threadpool(encode, rows)
+        if data:
+            yield data
+    data = await run_in_threadpool(flush)
+    if data:
+        yield data
+
+
+class _ChunkSink:
+    """Write-only file object that keeps what was written until it is drained."""
+
+    def __init__(self) -> None:
+        self._chunks: List[bytes] = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def writable(self) -> bool:
+        return True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def _arrow_schema(pyarrow):
+    return pyarrow.schema([
+        (column, pyarrow.date32() if column.startswith("data_") else pyarrow.string())
+        for column in USERS_DATA_COLUMNS
+    ])
+
+
+class _ColumnarWriter:
+    def __init__(self, export_format: ExportFormat, compression: str | None) -> None:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+
+        self.pyarrow = pyarrow
+        self.schema = _arrow_schema(pyarrow)
+        self.sink = _ChunkSink()
+        self.parquet = export_format.name == "parquet"
+        if self.parquet:
+            self.writer = pyarrow.parquet.ParquetWriter(self.sink, self.schema, compression=compression or "snappy")
+        else:
+            options = pyarrow.ipc.IpcWriteOptions(compression=compression)
+            self.writer = pyarrow.ipc.new_stream(self.sink, self.schema, options=options)
+
+    def write(self, rows: List[Sequence]) -> bytes:
+        with stage("export.encode"):
+            columns = list(zip(*rows))
+            table = self.pyarrow.Table.from_arrays(
+                [self.pyarrow.array(column, type=field.type) for column, field in zip(columns, self.schema)],
+                schema=self.schema,
+            )
+            if self.parquet:
+                self.writer.write_table(table, row_group_size=len(rows))
+            else:
+                self.writer.write_table(table)
+            return self.sink.drain()
+
+    def close(self) -> bytes:
+        self.writer.close()
+        return self.sink.drain()
+
+
+async def _encode_columnar(
+    chunks: AsyncIterator[List[Sequence]],
+    export_format: ExportFormat,
+    compression: str | None,
+    row_group_size: int
+) -> AsyncIterator[bytes]:
+    writer = _ColumnarWriter(export_format, compression)
+    buffer: List[Sequence] = []
+    async for rows in chunks:
+        buffer.extend(rows)
+        if len(buffer) >= row_group_size:
+            data = await run_in_threadpool(writer.write, buffer)
+            buffer = []
+            if data:
+                yield data
+    if buffer:
+        data = await run_in_threadpool(writer.write, buffer)
+        if data:
+            yield data
+    yield await run_in_threadpool(writer.close)
+
+
+def encode_export(
+    chunks: AsyncIterator[List[Sequence]],
+    export_format: ExportFormat,
+    compression: str | None = None,
+    row_group_size: int = EXPORT_ROW_GROUP_SIZE
+) -> AsyncIterator[bytes]:
+    """
+    Encodes chunks of rows in USERS_DATA_COLUMNS order into an export file as they arrive.
+
+    CSV and NDJSON are encoded chunk by chunk in a worker thread and optionally compressed as a
+    whole with gzip or zstd. Parquet and Arrow IPC buffer row_group_size rows, encode them as one row group (record
+    batch) in a worker thread and apply the compression codec inside the file, so memory usage
+    is bounded by one row group whatever the size of the table.
+
+    Args:
+        chunks (AsyncIterator[List[Sequence]]): The rows to be exported, in chunks.
+        export_format (ExportFormat): The output format, one of EXPORT_FORMATS.
+        compression (str | None, optional): One of the compressions of the format, already checked
+            with validate_compression. Defaults to None.
+        row_group_size (int, optional): The rows per Parquet row group or Arrow batch. Defaults to EXPORT_ROW_GROUP_SIZE.
+
+    Returns:
+        AsyncIterator[bytes]: The encoded export, piece by piece.
+    """
+    if export_format.columnar:
+        return _encode_columnar(chunks, export_format, compression, row_group_size)
+    if export_format.name == "ndjson":
+        return _encode_text(chunks, encode_ndjson_rows, b"", compression)
+    return _encode_text(chunks, encode_csv_rows, encode_csv_rows([CSV_EXPORT_HEADER]), compression)
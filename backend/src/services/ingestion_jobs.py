@@ -0,0 +1,551 @@
+import os
+import time
+import uuid
+import socket
+import hashlib
+import asyncio
+import logging
+import tempfile
+import threading
+from typing import BinaryIO, Callable, List, Tuple
+
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+
+from ..infra.metrics import stage
+from ..infra.cv_uploader_data_base.bulk_ingestion import (
+    IngestionCancelled,
+    IngestionStats,
+    ParallelCopyIngestion,
+    UpsertIngestionEngine,
+)
+from ..infra.cv_uploader_data_base.csv_uploader_repository import ResumeConnectionHandler
+from ..infra.cv_uploader_data_base.datasets import DEFAULT_DATASET_ID
+from ..infra.cv_uploader_data_base.repository_factory import create_repository
+
+from .csv_parallel import iter_shard_payloads
+from .csv_stream import RejectWriter, iter_csv_rows, validate_rows
+from .compressed_csv import detect_compression, open_csv_file
+
+
+CSV_INGESTION_ENGINE = os.environ.get("CSV_INGESTION_ENGINE", "upsert")
+CSV_INGESTION_BATCH_SIZE = int(os.environ.get("CSV_INGESTION_BATCH_SIZE", "10000"))
+PARALLEL_INGESTION_CONNECTIONS = int(os.environ.get("PARALLEL_INGESTION_CONNECTIONS", "4"))
+UPLOAD_SPOOL_DIR = os.environ.get("UPLOAD_SPOOL_DIR", os.path.join(tempfile.gettempdir(), "csv_uploader"))
+INGESTION_WORKERS = int(os.environ.get("INGESTION_WORKERS", "2"))
+INGESTION_POLL_INTERVAL = float(os.environ.get("INGESTION_POLL_INTERVAL", "5"))
+INGESTION_PROGRESS_INTERVAL = float(os.environ.get("INGESTION_PROGRESS_INTERVAL", "1"))
+INGESTION_HEARTBEAT_INTERVAL = float(os.environ.get("INGESTION_HEARTBEAT_INTERVAL", "10"))
+INGESTION_JOB_STALE_SECONDS = float(os.environ.get("INGESTION_JOB_STALE_SECONDS", "60"))
+INGESTION_MAINTENANCE_INTERVAL = float(os.environ.get("INGESTION_MAINTENANCE_INTERVAL", "30"))
+REJECTS_RETENTION_SECONDS = float(os.environ.get("REJECTS_RETENTION_SECONDS", str(7 * 24 * 3600)))
+INGESTION_DRAIN_TIMEOUT = float(os.environ.get("INGESTION_DRAIN_TIMEOUT", "20"))
+
+SPOOL_CHUNK_SIZE = 1024 * 1024
+
+
+def spool_upload(file: BinaryIO, job_id: str) -> Tuple[str, str]:
+    """
+    Copies an uploaded file to the spool directory in fixed-size chunks, hashing it on the way.
+
+    Args:
+        file (BinaryIO): The uploaded file.
+        job_id (str): The ID of the job the file belongs to, used as the file name.
+
+    Returns:
+        Tuple[str, str]: The path of the spooled file and the SHA-256 of its content.
+    """
+    os.makedirs(UPLOAD_SPOOL_DIR, exist_ok=True)
+    file_path = os.path.join(UPLOAD_SPOOL_DIR, f"{job_id}.csv")
+    content_hash = hashlib.sha256()
+    with stage("upload.spool"), open(file_path, "wb") as spool_file:
+        while True:
+            chunk = file.read(SPOOL_CHUNK_SIZE)
+            if not chunk:
+                break
+            content_hash.update(chunk)
+            spool_file.write(chunk)
+    return file_path, content_hash.hexdigest()
+
+
+def reject_file_path(upload_id: str) -> str:
+    """
+    Returns the path of the reject file of an upload, stored next to the spooled uploads.
+    """
+    return os.path.join(UPLOAD_SPOOL_DIR, f"{upload_id}.rejects.csv")
+
+
+def remove_expired_reject_files(retention_seconds: float = REJECTS_RETENTION_SECONDS) -> int:
+    """
+    Removes the reject files that were last written more than retention_seconds ago.
+
+    Args:
+        retention_seconds (float, optional): How long reject files are kept. Defaults to REJECTS_RETENTION_SECONDS.
+
+    Returns:
+        int: The number of reject files removed.
+    """
+    expires_before = time.time() - retention_seconds
+    removed = 0
+    try:
+        entries = list(os.scandir(UPLOAD_SPOOL_DIR))
+    except FileNotFoundError:
+        return 0
+    for entry in entries:
+        if not entry.name.endswith(".rejects.csv"):
+            continue
+        try:
+            if entry.stat().st_mtime >= expires_before:
+                continue
+            os.remove(entry.path)
+            removed += 1
+        except FileNotFoundError:
+            pass
+        except OSError as error:
+            logging.warning("Failed to remove reject file %s. Error: %s", entry.path, error)
+    return removed
+
+
+def remove_spool_file(file_path: str) -> None:
+    try:
+        os.remove(file_path)
+    except FileNotFoundError:
+        pass
+    except OSError as error:
+        logging.warning("Failed to remove spooled file %s. Error: %s", file_path, error)
+
+
+async def ingest_file(
+    repository: ResumeConnectionHandler,
+    file_path: str,
+    engine: str,
+    rejects_path: str,
+    batch_size: int = CSV_INGESTION_BATCH_SIZE,
+    on_batch: Callable[[IngestionStats], None] | None = None,
+    dataset_id: int = DEFAULT_DATASET_ID
+) -> IngestionStats:
+    """
+    Validates a spooled CSV file and ingests its valid rows into a dataset with the given engine.
+
+    Invalid rows do not fail the upload: they are written to a reject CSV with their line number
+    and the reason, and counted in rows_rejected.
+
+    The "parallel" engine parses the file in shards across processes and writes them over
+    PARALLEL_INGESTION_CONNECTIONS connections; the other engines stream it row by row.
+    Compressed files (gzip, zstd or zip) are decompressed as they are parsed. They cannot be
+    split into shards by byte offset, so the "parallel" engine streams them with "upsert",
+    which merges rows on the natural key the same way.
+
+    Args:
+        repository (ResumeConnectionHandler): The repository to write to.
+        file_path (str): The path of the spooled CSV file.
+        engine (str): The ingestion engine, one of ENGINE_NAMES.
+        rejects_path (str): The path of the reject CSV, only created if a row is rejected.
+        batch_size (int, optional): The number of rows per batch of the streaming engines. Defaults to CSV_INGESTION_BATCH_SIZE.
+        on_batch (Callable[[IngestionStats], None] | None, optional): Called with the running stats after each batch. Defaults to None.
+        dataset_id (int, optional): The dataset the rows are written to. Defaults to DEFAULT_DATASET_ID.
+
+    Returns:
+        IngestionStats: The number of rows written and rejected, the elapsed time and the throughput.
+    """
+    with RejectWriter(rejects_path) as rejects:
+        def count_rejects(stats: IngestionStats) -> None:
+            stats.rows_rejected = rejects.count
+            if on_batch:
+                on_batch(stats)
+
+        compression = detect_compression(file_path)
+        if compression and engine == ParallelCopyIngestion.name:
+            logging.info("Ingesting %s compressed file with the upsert engine instead of parallel", compression)
+            engine = UpsertIngestionEngine.name
+        if engine == ParallelCopyIngestion.name:
+            payloads = iter_shard_payloads(file_path, on_reject=rejects.write)
+            stats = await repository.save_csv_shards(
+                payloads, PARALLEL_INGESTION_CONNECTIONS, count_rejects, dataset_id
+            )
+        else:
+            with open_csv_file(file_path, compression) as file:
+                rows = validate_rows(iter_csv_rows(file), rejects.write)
+                stats = await repository.save_csv_file(rows, engine, batch_size, count_rejects, dataset_id)
+        stats.rows_rejected = rejects.count
+    return stats
+
+
+async def record_ingested_file(
+    repository: ResumeConnectionHandler,
+    content_hash: str,
+    upload_id: str,
+    file_name: str | None,
+    stats: IngestionStats,
+    dataset_id: int = DEFAULT_DATASET_ID
+) -> None:
+    """
+    Records a successfully ingested file and the dataset it went into, so that uploading it again
+    is detected until the dataset is dropped. A failure is only logged: the rows are already
+    stored, and ingesting the file again is harmless since rows are upserted on their natural key.
+    """
+    try:
+        await repository.record_ingested_file(content_hash, upload_id, file_name, stats.rows, dataset_id)
+    except HTTPException as error:
+        logging.error("Failed to record ingested file %s. Error: %s", upload_id, error.detail)
+
+
+async def complete_dataset(
+    repository: ResumeConnectionHandler,
+    dataset_id: int,
+    replaces_dataset_id: int | None = None
+) -> str | None:
+    """
+    Marks the dataset of a successful upload as ready and drops the dataset it replaces, if any.
+
+    The replaced dataset is marked "pending_drop" before it is dropped. If the drop fails, it stays
+    so and the drop is retried by the job manager maintenance, since the upload itself succeeded.
+
+    Returns:
+        str | None: Why the replaced dataset is still pending its drop, or None if it was dropped.
+    """
+    try:
+        await repository.set_dataset_status(dataset_id, "ready")
+    except HTTPException as error:
+        logging.error("Failed to complete dataset %s. Error: %s", dataset_id, error.detail)
+    if replaces_dataset_id is None:
+        return None
+    try:
+        await repository.set_dataset_status(replaces_dataset_id, "pending_drop")
+        await repository.drop_dataset(replaces_dataset_id)
+    except HTTPException as error:
+        logging.error("Failed to drop replaced dataset %s. Error: %s", replaces_dataset_id, error.detail)
+        return f"Replaced dataset {replaces_dataset_id} could not be dropped yet and will be retried. Error: {error.detail}"
+    return None
+
+
+async def drop_pending_datasets(repository: ResumeConnectionHandler) -> int:
+    """
+    Retries the drop of the datasets left "pending_drop" by complete_dataset. Failures are only
+    logged, and retried at the next call.
+
+    Returns:
+        int: The number of datasets dropped.
+    """
+    try:
+        dataset_ids = await repository.get_dataset_ids_by_status("pending_drop")
+    except HTTPException as error:
+        logging.error("Failed to get the datasets pending their drop. Error: %s", error.detail)
+        return 0
+    dropped = 0
+    for dataset_id in dataset_ids:
+        try:
+            await repository.drop_dataset(dataset_id)
+            dropped += 1
+        except HTTPException as error:
+            logging.error("Failed to drop replaced dataset %s. Error: %s", dataset_id, error.detail)
+    return dropped
+
+
+async def discard_dataset(repository: ResumeConnectionHandler, dataset_id: int) -> None:
+    """
+    Drops the dataset of a failed or cancelled upload, which holds no rows since its ingestion
+    was rolled back. A failure is only logged, and leaves the empty dataset "loading".
+    """
+    try:
+        await repository.drop_dataset(dataset_id)
+    except HTTPException as error:
+        logging.error("Failed to drop dataset %s. Error: %s", dataset_id, error.detail)
+
+
+class JobLeaseHeartbeat:
+    """
+    Renews the lease of a running job every INGESTION_HEARTBEAT_INTERVAL seconds from a thread of
+    its own, so the lease stays alive during a long batch or the final merge of an ingestion,
+    whichever handler runs the repository calls.
+
+    status follows the job: "cancelling" once a cancellation was requested, and "lost" once the
+    job was put back in the queue because the lease expired anyway.
+    """
+
+    def __init__(
+        self,
+        repository: ResumeConnectionHandler,
+        job_id: str,
+        worker_id: str,
+        interval: float = INGESTION_HEARTBEAT_INTERVAL
+    ) -> None:
+        self.repository = repository
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self.interval = interval
+        self.status = "running"
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"heartbeat-{job_id}", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        # The thread is not joined: it may be waiting on the database, and it exits on its own
+        self._stopped.set()
+
+    def update(self, status: str | None) -> None:
+        self.status = status or "lost"
+        if status is None:
+            logging.warning("Lost the lease of ingestion job %s", self.job_id)
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            try:
+                status = self.repository.renew_ingestion_job_lease(self.job_id, self.worker_id)
+            except HTTPException as error:
+                logging.error("Failed to renew the lease of ingestion job %s. Error: %s", self.job_id, error.detail)
+                continue
+            if not self._stopped.is_set():
+                self.update(status)
+            if status is None:
+                return
+
+
+class IngestionJobManager:
+    """
+    Runs the queued ingestion jobs in the background.
+
+    Job state lives in the ingestion_jobs table: workers claim queued jobs from the database, so
+    jobs submitted before a restart, or by another process, are picked up as well. submit() only
+    wakes the workers up instead of waiting for the next poll.
+
+    A claimed job is leased to the manager's worker_id and the lease is renewed by a heartbeat.
+    Every INGESTION_MAINTENANCE_INTERVAL seconds one of the workers puts back in the queue the jobs
+    whose lease expired, e.g. because the process running them crashed.
+    """
+
+    def __init__(
+        self,
+        repository: ResumeConnectionHandler | None = None,
+        workers: int = INGESTION_WORKERS,
+        batch_size: int = CSV_INGESTION_BATCH_SIZE,
+    ) -> None:
+        self.repository = repository if repository is not None else create_repository()
+        self.workers = workers
+        self.batch_size = batch_size
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+        self._draining = False
+        self._stopping = False
+        self._maintained_at: float | None = None
+
+    async def start(self) -> None:
+        logging.info("Starting %s ingestion workers as %s", self.workers, self.worker_id)
+        self._draining = False
+        self._stopping = False
+        self._maintained_at = None
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self, drain_timeout: float = 0) -> None:
+        """
+        Stops the workers.
+
+        The workers stop claiming jobs right away and are given drain_timeout seconds to finish
+        the jobs they are ingesting. Jobs still running after that are interrupted at their next
+        batch, rolled back and put back in the queue, so they are resumed by the next worker that starts.
+
+        Args:
+            drain_timeout (float, optional): Seconds to wait for the running jobs. Defaults to 0.
+        """
+        self._draining = True
+        self._wakeup.set()
+        if self._tasks and drain_timeout > 0:
+            _, running = await asyncio.wait(self._tasks, timeout=drain_timeout)
+            if running:
+                logging.info("Interrupting %s ingestion jobs still running after %ss", len(running), drain_timeout)
+        self._stopping = True
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self) -> None:
+        self._wakeup.set()
+
+    async def _maintain(self) -> None:
+        """
+        Puts back in the queue the jobs whose lease expired, at most every INGESTION_MAINTENANCE_INTERVAL
+        seconds across the workers, and cleans up after the stale jobs that were being cancelled.
+        Reject files older than REJECTS_RETENTION_SECONDS and the staging tables left behind by
+        parallel ingestions whose process died are removed as well, and the drop of the replaced
+        datasets left "pending_drop" is retried.
+        """
+        now = time.monotonic()
+        if self._maintained_at is not None and now - self._maintained_at < INGESTION_MAINTENANCE_INTERVAL:
+            return
+        self._maintained_at = now
+        removed = await run_in_threadpool(remove_expired_reject_files)
+        if removed:
+            logging.info("Removed %s expired reject files", removed)
+        try:
+            tables = await self.repository.drop_orphaned_staging_tables()
+            if tables:
+                logging.info("Dropped %s orphaned staging tables", len(tables))
+        except HTTPException as error:
+            logging.error("Failed to drop orphaned staging tables. Error: %s", error.detail)
+        dropped = await drop_pending_datasets(self.repository)
+        if dropped:
+            logging.info("Dropped %s replaced datasets pending their drop", dropped)
+        try:
+            jobs = await self.repository.requeue_stale_ingestion_jobs(INGESTION_JOB_STALE_SECONDS)
+        except HTTPException as error:
+            logging.error("Failed to requeue stale ingestion jobs. Error: %s", error.detail)
+            return
+        for job_id, status, file_path, dataset_id, append in jobs:
+            logging.info("Ingestion job %s lost its worker and is now %s", job_id, status)
+            if status == "cancelled":
+                remove_spool_file(file_path)
+                if dataset_id and not append:
+                    await discard_dataset(self.repository, dataset_id)
+
+    async def _worker(self) -> None:
+        while not self._draining:
+            self._wakeup.clear()
+            await self._maintain()
+            try:
+                job = await self.repository.claim_ingestion_job(self.worker_id)
+            except HTTPException as error:
+                logging.error("Failed to claim ingestion job. Error: %s", error.detail)
+                job = None
+            if job is None:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=INGESTION_POLL_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            job_id, file_name, file_path, engine, content_hash, dataset_id, replaces_dataset_id, append = job
+            try:
+                await self._process(
+                    str(job_id), file_name, file_path, engine, content_hash, dataset_id, replaces_dataset_id, append
+                )
+            except Exception as error:
+                logging.error("Unexpected error while processing ingestion job %s. Error: %s", job_id, error)
+
+    async def _process(
+        self,
+        job_id: str,
+        file_name: str | None,
+        file_path: str,
+        engine: str,
+        content_hash: str | None,
+        dataset_id: int | None = None,
+        replaces_dataset_id: int | None = None,
+        append: bool = False
+    ) -> None:
+        # Jobs queued before datasets existed have none and are ingested into the default dataset.
+        # The dataset of an appending job existed before it and is kept whatever the outcome.
+        logging.info("Processing ingestion job %s", job_id)
+        last_report = [time.monotonic()]
+        heartbeat = JobLeaseHeartbeat(self.repository, job_id, self.worker_id)
+
+        def on_batch(stats: IngestionStats) -> None:
+            if self._stopping or heartbeat.status != "running":
+                raise IngestionCancelled(job_id)
+            now = time.monotonic()
+            if now - last_report[0] < INGESTION_PROGRESS_INTERVAL:
+                return
+            last_report[0] = now
+            heartbeat.update(self.repository.report_ingestion_job_progress(
+                job_id, self.worker_id, stats.rows, stats.rows_rejected, stats.rows_per_second
+            ))
+            if heartbeat.status != "running":
+                raise IngestionCancelled(job_id)
+
+        heartbeat.start()
+        try:
+            stats = await ingest_file(
+                self.repository,
+                file_path,
+                engine,
+                reject_file_path(job_id),
+                self.batch_size,
+                on_batch,
+                dataset_id or DEFAULT_DATASET_ID
+            )
+        except IngestionCancelled:
+            if self._stopping:
+                # The dataset is kept for the worker that resumes the job
+                logging.info("Ingestion job %s interrupted by shutdown, putting it back in the queue", job_id)
+                await self.repository.requeue_ingestion_job(job_id, self.worker_id)
+                return
+            if heartbeat.status == "lost":
+                # The job was put back in the queue: its dataset and file belong to the worker running it now
+                logging.warning("Ingestion job %s was requeued while running, abandoning it", job_id)
+                return
+            await self._finish(job_id, "cancelled")
+            if dataset_id and not append:
+                await discard_dataset(self.repository, dataset_id)
+        except Exception as error:
+            detail = error.detail if isinstance(error, HTTPException) else str(error)
+            if heartbeat.status == "lost":
+                logging.warning("Ingestion job %s failed after it was requeued, abandoning it. Error: %s", job_id, detail)
+                return
+            logging.error("Ingestion job %s failed. Error: %s", job_id, detail)
+            await self._finish(job_id, "failed", error=str(detail))
+            if dataset_id and not append:
+                await discard_dataset(self.repository, dataset_id)
+        else:
+            if heartbeat.status == "lost":
+                # Only possible if the heartbeats failed for a whole lease; upserts make the second run harmless
+                logging.warning("Ingestion job %s was requeued before it committed, leaving it to its new worker", job_id)
+                return
+            warning = None
+            if dataset_id and not append:
+                warning = await complete_dataset(self.repository, dataset_id, replaces_dataset_id)
+            await self._finish(job_id, "succeeded", stats, error=warning)
+            if content_hash:
+                await record_ingested_file(
+                    self.repository, content_hash, job_id, file_name, stats, dataset_id or DEFAULT_DATASET_ID
+                )
+        finally:
+            heartbeat.stop()
+        remove_spool_file(file_path)
+
+    async def _finish(
+        self,
+        job_id: str,
+        status: str,
+        stats: IngestionStats | None = None,
+        error: str | None = None
+    ) -> None:
+        stats = stats or IngestionStats(engine="")
+        try:
+            await self.repository.finish_ingestion_job(
+                job_id,
+                self.worker_id,
+                status,
+                stats.rows,
+                stats.rows_rejected,
+                stats.rows_inserted,
+                stats.rows_updated,
+                stats.rows_per_second if stats.batches else None,
+                error
+            )
+        except HTTPException as finish_error:
+            logging.error("Failed to store the status of ingestion job %s. Error: %s", job_id, finish_error.detail)
+
+
+_job_manager: IngestionJobManager | None = None
+
+
+def get_job_manager() -> IngestionJobManager | None:
+    return _job_manager
+
+
+async def start_job_manager(repository: ResumeConnectionHandler | None = None) -> IngestionJobManager:
+    global _job_manager
+    _job_manager = IngestionJobManager(repository)
+    await _job_manager.start()
+    return _job_manager
+
+
+async def stop_job_manager(drain_timeout: float = 0) -> None:
+    global _job_manager
+    if _job_manager is not None:
+        await _job_manager.stop(drain_timeout)
+        _job_manager = None
+
+
+def new_job_id() -> str:
+    return str(uuid.uuid4())
@@ -0,0 +1,44 @@
+from typing import Any, Dict, List, Sequence
+
+import orjson
+from fastapi.responses import Response
+
+from ..infra.cv_uploader_data_base.querys import ITEM_FIELDS
+
+
+def rows_to_items(rows: Sequence[Sequence]) -> List[Dict[str, Any]]:
+    """
+    Turns rows selected with ITEM_SELECT_COLUMNS into item dictionaries.
+
+    The dates already come formatted from the database, so no per-field conversion is needed.
+    """
+    return [dict(zip(ITEM_FIELDS, row)) for row in rows]
+
+
+def json_response(content: Any, status_code: int = 200) -> Response:
+    """
+    Encodes the content with orjson and returns it as a ready-made response, so FastAPI does not
+    validate and serialize it again.
+    """
+    return Response(content=orjson.dumps(content), status_code=status_code, media_type="application/json")
+
+
+def bulk_result(index: int, status: str, item: Sequence | None = None, item_id: int | None = None, error: str | None = None) -> Dict[str, Any]:
+    """
+    Builds the outcome of one item of a bulk request. item is a row selected with ITEM_SELECT_COLUMNS.
+    """
+    return {
+        "index": index,
+        "status": status,
+        "id": item[0] if item is not None else item_id,
+        "item": dict(zip(ITEM_FIELDS, item)) if item is not None else None,
+        "error": error,
+    }
+
+
+def bulk_response(results: List[Dict[str, Any]], success_status: str) -> Dict[str, Any]:
+    """
+    Wraps the per-item outcomes of a bulk request with the number of items that succeeded and failed.
+    """
+    succeeded = sum(1 for result in results if result["status"] == success_status)
+    return {"succeeded": succeeded, "failed": len(results) - succeeded, "results": results}
@@ -0,0 +1,87 @@
+from typing import Dict, Iterable, List, Tuple
+
+# Dimensions counted by users_data_stats (see users_data_stats_buckets in init.sql)
+STATS_DIMENSIONS = ("nacionalidade", "genero", "birth_year", "data_criacao")
+
+# Dimensions whose buckets are listed in bucket order; the others are listed by count, largest first.
+ORDERED_DIMENSIONS = ("birth_year", "data_criacao")
+
+# Length of the prefix of a YYYY-MM-DD date that identifies its day, month or year
+DATE_GRANULARITIES = {"day": 10, "month": 7, "year": 4}
+
+
+class InvalidStatsQueryError(ValueError):
+    """Raised when a stats dimension, bucket width or granularity is invalid."""
+
+
+def validate_stats_query(dimensions: Iterable[str], birth_year_bucket: int, date_granularity: str) -> List[str]:
+    """
+    Returns:
+        List[str]: The requested dimensions, or all of STATS_DIMENSIONS if none is given.
+
+    Raises:
+        InvalidStatsQueryError: If a dimension, the bucket width or the granularity is invalid.
+    """
+    dimensions = list(dimensions) or list(STATS_DIMENSIONS)
+    for dimension in dimensions:
+        if dimension not in STATS_DIMENSIONS:
+            raise InvalidStatsQueryError(
+                f"Invalid stats dimension '{dimension}'. Available dimensions: {', '.join(STATS_DIMENSIONS)}"
+            )
+    if birth_year_bucket < 1:
+        raise InvalidStatsQueryError("The birth year bucket must be at least 1 year")
+    if date_granularity not in DATE_GRANULARITIES:
+        raise InvalidStatsQueryError(
+            f"Invalid date granularity '{date_granularity}'. "
+            f"Available granularities: {', '.join(DATE_GRANULARITIES)}"
+        )
+    return dimensions
+
+
+def _bucket_label(dimension: str, bucket: str | None, birth_year_bucket: int, date_granularity: str) -> str | None:
+    if bucket is None:
+        return None
+    if dimension == "birth_year" and birth_year_bucket > 1:
+        start = int(bucket) - int(bucket) % birth_year_bucket
+        return f"{start}-{start + birth_year_bucket - 1}"
+    if dimension == "data_criacao":
+        return bucket[:DATE_GRANULARITIES[date_granularity]]
+    return bucket
+
+
+def summarize_stats(
+    stats: Dict[str, Dict[str | None, int]],
+    dimensions: List[str],
+    birth_year_bucket: int = 10,
+    date_granularity: str = "month"
+) -> Dict:
+    """
+    Groups the per-year and per-day buckets kept by the database into the requested widths.
+
+    Args:
+        stats (Dict[str, Dict[str | None, int]]): The bucket counts by dimension, as returned by the repository.
+        dimensions (List[str]): The dimensions to include, already checked with validate_stats_query.
+        birth_year_bucket (int, optional): The width of the birth year buckets, in years. Defaults to 10.
+        date_granularity (str, optional): "day", "month" or "year" buckets of data_criacao. Defaults to "month".
+
+    Returns:
+        Dict: The total number of rows and, by dimension, a list of {"value", "count"} buckets.
+            Rows whose value is empty are counted in a bucket whose value is None.
+    """
+    summary = {}
+    for dimension in dimensions:
+        counts: Dict[str | None, int] = {}
+        for bucket, count in stats.get(dimension, {}).items():
+            label = _bucket_label(dimension, bucket, birth_year_bucket, date_granularity)
+            counts[label] = counts.get(label, 0) + count
+        if dimension in ORDERED_DIMENSIONS:
+            key = lambda item: (item[0] is None, item[0] or "")
+        else:
+            key = lambda item: (-item[1], item[0] is None, item[0] or "")
+        buckets: List[Tuple[str | None, int]] = sorted(counts.items(), key=key)
+        summary[dimension] = [{"value": value, "count": count} for value, count in buckets]
+    return {
+        # Every row is counted once in each dimension
+        "total": sum(stats.get(STATS_DIMENSIONS[0], {}).values()),
+        "dimensions": summary,
+    }
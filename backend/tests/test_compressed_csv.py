@@ -0,0 +1,42 @@
+import gzip
+import zipfile
+
+import pytest
+
+from src.services.compressed_csv import UnsupportedCompressionError, check_compression, open_csv_file
+
+CONTENT = b"nome,genero\nAna,F\n"
+
+
+def write_zip(path, members):
+    with zipfile.ZipFile(path, "w") as archive:
+        for name in members:
+            archive.writestr(name, CONTENT)
+    return str(path)
+
+
+def test_zip_with_more_than_one_file_is_rejected(tmp_path):
+    file_path = write_zip(tmp_path / "upload.zip", ["first.csv", "second.csv"])
+
+    with pytest.raises(UnsupportedCompressionError, match="exactly one CSV file, found 2"):
+        check_compression(file_path)
+    with pytest.raises(UnsupportedCompressionError):
+        with open_csv_file(file_path, "zip"):
+            pass
+
+
+def test_zip_with_one_file_is_read(tmp_path):
+    file_path = write_zip(tmp_path / "upload.zip", ["data.csv"])
+
+    assert check_compression(file_path) == "zip"
+    with open_csv_file(file_path, "zip") as file:
+        assert file.read() == CONTENT
+
+
+def test_declared_encoding_must_match_the_content(tmp_path):
+    path = tmp_path / "upload.csv.gz"
+    path.write_bytes(gzip.compress(CONTENT))
+
+    assert check_compression(str(path), "gzip") == "gzip"
+    with pytest.raises(UnsupportedCompressionError, match="declared as zstd"):
+        check_compression(str(path), "zstd")
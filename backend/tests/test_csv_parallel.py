@@ -0,0 +1,94 @@
+import csv
+import random
+from io import StringIO
+
+import pytest
+
+from src.services.csv_parallel import iter_record_ranges
+
+HEADER = b"first_name,last_name,email\n"
+
+
+def write_csv(tmp_path, content: bytes) -> str:
+    path = tmp_path / "upload.csv"
+    path.write_bytes(content)
+    return str(path)
+
+
+def parse(content: bytes) -> list:
+    return list(csv.reader(StringIO(content.decode("utf-8-sig"), newline="")))
+
+
+def assert_ranges_match_reader(file_path: str, shard_size: int) -> list:
+    with open(file_path, "rb") as file:
+        content = file.read()
+    ranges = list(iter_record_ranges(file_path, shard_size))
+    rows = []
+    for start, end, start_line in ranges:
+        assert start_line == content[:start].count(b"\n") + 1
+        rows.extend(parse(content[start:end]))
+    assert rows == parse(content)[1:]
+    if ranges:
+        assert ranges[-1][1] == len(content)
+        assert all(end == next_start for (_, end, _), (next_start, _, _) in zip(ranges, ranges[1:]))
+    return ranges
+
+
+def test_stray_quote_in_unquoted_field_is_literal(tmp_path):
+    rows = [b'Miles,O"Brien,miles@example.com\n']
+    rows += [b'"Line\none","Two\n""quoted""\nlines",%d@example.com\n' % index for index in range(20)]
+    file_path = write_csv(tmp_path, HEADER + b"".join(rows))
+
+    ranges = assert_ranges_match_reader(file_path, 64)
+
+    assert len(ranges) > 1
+
+
+def test_quoted_newline_at_target_offset_is_not_a_boundary(tmp_path):
+    for padding in range(40):
+        row = b'"%s\n",x,y\n' % (b"a" * padding)
+        file_path = write_csv(tmp_path, HEADER + row * 10)
+        assert_ranges_match_reader(file_path, 16)
+
+
+def test_quote_after_closing_quote_is_literal(tmp_path):
+    rows = b'"ab"c"d,e,f\n' + b'g,"h\ni",j\n' * 10
+    file_path = write_csv(tmp_path, HEADER + rows)
+
+    assert_ranges_match_reader(file_path, 8)
+
+
+@pytest.mark.parametrize("content", [
+    b"",
+    HEADER,
+    HEADER.rstrip(b"\n"),
+    HEADER + b"a,b,c",
+    HEADER.replace(b"\n", b"\r\n") + b'a,"b\r\nc",d\r\n' * 10,
+    b'\xef\xbb\xbf"first_name\n",last_name,email\n' + b"a,b,c\n" * 10,
+])
+def test_edge_cases(tmp_path, content):
+    assert_ranges_match_reader(write_csv(tmp_path, content), 8)
+
+
+def test_random_files_match_csv_reader(tmp_path):
+    generator = random.Random(11)
+    alphabet = ['a', 'b', ',', '"', '\n', ' ', 'ñ']
+    for _ in range(200):
+        buffer = StringIO()
+        writer = csv.writer(buffer, lineterminator="\n")
+        for _ in range(generator.randint(1, 30)):
+            writer.writerow(
+                "".join(generator.choice(alphabet) for _ in range(generator.randint(0, 6)))
+                for _ in range(3)
+            )
+        content = HEADER + buffer.getvalue().encode("utf-8")
+        assert_ranges_match_reader(write_csv(tmp_path, content), generator.randint(1, 64))
+
+
+def test_random_unescaped_files_match_csv_reader(tmp_path):
+    generator = random.Random(7)
+    alphabet = b'ab,"\n'
+    for _ in range(500):
+        body = bytes(generator.choice(alphabet) for _ in range(generator.randint(0, 80)))
+        content = HEADER + body
+        assert_ranges_match_reader(write_csv(tmp_path, content), generator.randint(1, 32))
@@ -0,0 +1,62 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from src.infra.cv_uploader_data_base.datasets import DATASET_MAX_COUNT, DEFAULT_DATASET_ID
+from src.models.payloads.csv_uploader import AddItemPayload
+from src.services.csv_uploader_service import CsvUploaderService
+
+
+class MissingItemRepository:
+    def __init__(self, dataset_count=1):
+        self.dataset_count = dataset_count
+
+    async def update_value_in_db(self, data, item_id, dataset_id):
+        return []
+
+    async def get_datasets(self):
+        return [(dataset_id,) for dataset_id in range(1, self.dataset_count + 1)]
+
+
+def test_update_of_a_missing_item_is_not_found():
+    service = CsvUploaderService(MissingItemRepository())
+    payload = AddItemPayload(
+        nome="Ana",
+        data_nascimento="1990/01/01",
+        genero="F",
+        nacionalidade="Brasileira",
+        data_criacao="2020/01/01",
+        data_atualizacao="2020/01/01",
+    )
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(service.update_item(payload, 404))
+
+    assert error.value.status_code == 404
+
+
+def test_uploads_upsert_into_the_default_dataset_unless_a_new_one_is_asked_for():
+    service = CsvUploaderService(MissingItemRepository())
+
+    assert asyncio.run(service.check_upload_target(None, None)) == DEFAULT_DATASET_ID
+    assert asyncio.run(service.check_upload_target(None, None, new_dataset=True)) is None
+
+
+def test_upload_cannot_both_append_and_create_a_dataset():
+    service = CsvUploaderService(MissingItemRepository())
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(service.check_upload_target(DEFAULT_DATASET_ID, None, new_dataset=True))
+
+    assert error.value.status_code == 400
+
+
+def test_new_dataset_past_the_limit_is_a_conflict():
+    service = CsvUploaderService(MissingItemRepository(dataset_count=DATASET_MAX_COUNT))
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(service.check_upload_target(None, None, new_dataset=True))
+
+    assert error.value.status_code == 409
+    assert asyncio.run(service.check_upload_target(None, None)) == DEFAULT_DATASET_ID
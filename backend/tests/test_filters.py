@@ -0,0 +1,28 @@
+import pytest
+
+from src.infra.cv_uploader_data_base.filters import InvalidFilterError, make_predicate, parse_filters
+
+
+@pytest.mark.parametrize("column", ["password", "id; DROP TABLE users_data", "natural_key", ""])
+def test_column_outside_the_whitelist_is_rejected(column):
+    with pytest.raises(InvalidFilterError, match="Invalid filter field"):
+        make_predicate(column, "eq", "1")
+
+
+def test_unknown_operator_is_rejected():
+    with pytest.raises(InvalidFilterError, match="Invalid filter operator"):
+        make_predicate("nome", "like", "Ana%")
+
+
+def test_invalid_value_is_rejected():
+    with pytest.raises(InvalidFilterError, match="Invalid value"):
+        make_predicate("dataset_id", "eq", "one")
+
+
+def test_parse_filters_converts_values():
+    predicates = parse_filters([("dataset_id", "2"), ("id__in", "1,2,3")])
+
+    assert [(p.column, p.operator, p.value) for p in predicates] == [
+        ("dataset_id", "eq", 2),
+        ("id", "in", [1, 2, 3]),
+    ]
@@ -0,0 +1,98 @@
+import asyncio
+
+from src.infra.cv_uploader_data_base.group_commit import WriteCoalescer
+
+
+class DuplicateKeyError(Exception):
+    pass
+
+
+class PoolExhaustedError(Exception):
+    pass
+
+
+def is_row_error(error: Exception) -> bool:
+    return isinstance(error, DuplicateKeyError)
+
+
+def test_failed_batch_is_retried_one_by_one_with_per_caller_errors():
+    batches = []
+
+    async def write_batch(items):
+        batches.append(list(items))
+        await asyncio.sleep(0)
+        if "duplicate" in items:
+            raise DuplicateKeyError(f"{len(items)} items")
+        return [item.upper() for item in items]
+
+    async def main():
+        coalescer = WriteCoalescer("insert", write_batch, is_row_error=is_row_error, window=0.01)
+        return await asyncio.gather(
+            *(coalescer.submit(item) for item in ("a", "duplicate", "b")), return_exceptions=True
+        )
+
+    results = asyncio.run(main())
+
+    assert results[0] == "A" and results[2] == "B"
+    assert isinstance(results[1], DuplicateKeyError)
+    assert batches[0] == ["a", "duplicate", "b"]
+    assert sorted(batches[1:]) == [["a"], ["b"], ["duplicate"]]
+
+
+def test_failed_batch_without_a_row_error_fails_every_caller_without_retrying():
+    batches = []
+    error = PoolExhaustedError("no connection available")
+
+    async def write_batch(items):
+        batches.append(list(items))
+        await asyncio.sleep(0)
+        raise error
+
+    async def main():
+        coalescer = WriteCoalescer("insert", write_batch, is_row_error=is_row_error, window=0.01)
+        return await asyncio.gather(
+            *(coalescer.submit(item) for item in ("a", "b", "c")), return_exceptions=True
+        )
+
+    results = asyncio.run(main())
+
+    assert results == [error, error, error]
+    assert batches == [["a", "b", "c"]]
+
+
+def test_writes_with_the_same_key_never_share_a_batch():
+    batches = []
+
+    async def write_batch(items):
+        batches.append(list(items))
+        await asyncio.sleep(0)
+        return [value for _, value in items]
+
+    async def main():
+        coalescer = WriteCoalescer("update", write_batch, key=lambda item: item[0], window=0.01)
+        items = [(1, "first"), (2, "other"), (1, "second"), (1, "third")]
+        return await asyncio.gather(*(coalescer.submit(item) for item in items))
+
+    results = asyncio.run(main())
+
+    assert results == ["first", "other", "second", "third"]
+    for batch in batches:
+        keys = [key for key, _ in batch]
+        assert len(keys) == len(set(keys))
+    assert [value for batch in batches for key, value in batch if key == 1] == ["first", "second", "third"]
+    assert len(batches) == 3
+
+
+def test_batches_are_capped_at_max_batch():
+    batches = []
+
+    async def write_batch(items):
+        batches.append(list(items))
+        return list(items)
+
+    async def main():
+        coalescer = WriteCoalescer("insert", write_batch, window=0.01, max_batch=2)
+        return await asyncio.gather(*(coalescer.submit(item) for item in range(5)))
+
+    assert asyncio.run(main()) == [0, 1, 2, 3, 4]
+    assert batches == [[0, 1], [2, 3], [4]]
@@ -0,0 +1,80 @@
+import pytest
+
+from src.infra.cv_uploader_data_base.csv_uploader_repository import ResumeConnectionHandler
+from src.infra.cv_uploader_data_base.datasets import DEFAULT_DATASET_ID
+
+from src.infra.cv_uploader_data_base.pagination import Cursor, InvalidCursorError, decode_cursor, encode_cursor
+
+
+@pytest.mark.parametrize("cursor", [Cursor(1), Cursor(123456789, "prev"), Cursor(0, "next"), Cursor(7, "next", 42)])
+def test_cursor_round_trip(cursor):
+    encoded = encode_cursor(cursor)
+
+    assert "=" not in encoded
+    assert decode_cursor(encoded) == cursor
+
+
+@pytest.mark.parametrize("value", ["", "not a cursor", encode_cursor(Cursor(1, "sideways")), "eyJpZCI6Ing"])
+def test_invalid_cursor_is_rejected(value):
+    with pytest.raises(InvalidCursorError):
+        decode_cursor(value)
+
+
+def test_cursor_without_dataset_points_into_the_default_dataset():
+    # {"id":5,"d":"next"}, as encoded before cursors carried a dataset
+    assert decode_cursor("eyJpZCI6NSwiZCI6Im5leHQifQ") == Cursor(5, "next", DEFAULT_DATASET_ID)
+
+
+class PartitionedCursor:
+    """Answers the queries of ResumeConnectionHandler._fetch_dataset_page from ids kept by dataset."""
+
+    def __init__(self, ids_by_dataset):
+        self.ids_by_dataset = ids_by_dataset
+        self.rows = []
+        self.partition_reads = []
+
+    def execute(self, query, params=None):
+        if params is None:
+            self.rows = [
+                (dataset_id, "ready", None, None, None, len(ids), None, None)
+                for dataset_id, ids in sorted(self.ids_by_dataset.items())
+            ]
+            return
+        dataset_id, *bound, offset, limit = params
+        descending = "DESC" in repr(query)
+        self.partition_reads.append(dataset_id)
+        ids = sorted(self.ids_by_dataset[dataset_id], reverse=descending)
+        if bound:
+            ids = [item_id for item_id in ids if (item_id < bound[0] if descending else item_id > bound[0])]
+        self.rows = [(item_id, dataset_id) for item_id in ids[offset:offset + limit]]
+
+    def fetchall(self):
+        return self.rows
+
+
+def walk(db_cursor, page_number=1, cursor=None):
+    return ResumeConnectionHandler._fetch_dataset_page(db_cursor, page_number, 2, cursor)
+
+
+def test_listing_walks_the_datasets_in_order_both_ways():
+    db_cursor = PartitionedCursor({1: [1, 2, 6], 3: [3, 4], 4: [5]})
+    pages, page = [], walk(db_cursor)
+    while True:
+        pages.append(page.items)
+        if not page.next_cursor:
+            break
+        page = walk(db_cursor, cursor=decode_cursor(page.next_cursor))
+
+    assert pages == [[(1, 1), (2, 1)], [(6, 1), (3, 3)], [(4, 3), (5, 4)]]
+    previous = walk(db_cursor, cursor=decode_cursor(page.prev_cursor))
+    assert previous.items == [(6, 1), (3, 3)]
+    assert walk(db_cursor, page_number=2).items == [(6, 1), (3, 3)]
+
+
+def test_listing_page_only_reads_the_partitions_it_spans():
+    db_cursor = PartitionedCursor({1: [1, 2, 3], 2: [4], 3: [5]})
+
+    walk(db_cursor, page_number=3)
+
+    # Page 3 starts past the 4 rows of datasets 1 and 2, which are skipped by their row counts
+    assert db_cursor.partition_reads == [3]
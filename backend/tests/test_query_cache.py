@@ -0,0 +1,67 @@
+import pytest
+
+from src.infra.query_cache import MemoryQueryCache, SqliteQueryCache
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def cache(request, tmp_path):
+    if request.param == "memory":
+        cache = MemoryQueryCache(ttl=60, max_bytes=1024 * 1024)
+    else:
+        cache = SqliteQueryCache(ttl=60, max_bytes=1024 * 1024, path=str(tmp_path / "cache.sqlite"))
+    yield cache
+    cache.close()
+
+
+def test_set_after_an_invalidation_of_its_scope_is_dropped(cache):
+    generation = cache.generation(1)
+    cache.invalidate([1])
+    cache.set("page", ["stale"], generation, 1)
+
+    assert cache.get("page") is None
+
+    cache.set("page", ["fresh"], cache.generation(1), 1)
+
+    assert cache.get("page") == ["fresh"]
+
+
+def test_invalidation_of_another_dataset_keeps_the_scope(cache):
+    generation = cache.generation(1)
+    cache.set("dataset-1", "kept", generation, 1)
+    cache.set("dataset-2", "dropped", cache.generation(2), 2)
+    cache.set("all", "dropped", cache.generation(), None)
+
+    cache.invalidate([2])
+
+    assert cache.get("dataset-1") == "kept"
+    assert cache.get("dataset-2") is None
+    assert cache.get("all") is None
+    cache.set("late", "kept", generation, 1)
+    assert cache.get("late") == "kept"
+
+
+def test_full_invalidation_rejects_sets_of_every_scope(cache):
+    generations = {dataset_id: cache.generation(dataset_id) for dataset_id in (None, 1)}
+    cache.set("dataset-1", "dropped", generations[1], 1)
+
+    cache.invalidate()
+
+    assert cache.get("dataset-1") is None
+    for dataset_id, generation in generations.items():
+        cache.set(f"stale-{dataset_id}", "stale", generation, dataset_id)
+        assert cache.get(f"stale-{dataset_id}") is None
+
+
+def test_sqlite_generations_are_shared_between_instances(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    reader = SqliteQueryCache(ttl=60, max_bytes=1024 * 1024, path=path)
+    writer = SqliteQueryCache(ttl=60, max_bytes=1024 * 1024, path=path)
+    try:
+        generation = reader.generation(3)
+        writer.invalidate([3])
+        reader.set("page", "stale", generation, 3)
+
+        assert writer.get("page") is None
+    finally:
+        reader.close()
+        writer.close()
@@ -1,3 +1,14 @@
+-- Natural key of a users_data row: the same person (nome, data_nascimento)
+-- registered on the same date (data_criacao). Dates are formatted explicitly,
+-- so the result does not depend on DateStyle and the function is immutable.
+CREATE FUNCTION users_data_natural_key(nome TEXT, data_nascimento DATE, data_criacao DATE) RETURNS UUID AS $$
+  SELECT md5(
+    coalesce(nome, '') || E'\x1f' ||
+    coalesce(to_char(data_nascimento, 'YYYY-MM-DD'), '') || E'\x1f' ||
+    coalesce(to_char(data_criacao, 'YYYY-MM-DD'), '')
+  )::uuid
+$$ LANGUAGE sql IMMUTABLE;
+
 CREATE TABLE users_data (
   id SERIAL PRIMARY KEY,
   nome VARCHAR(100),
@@ -5,5 +16,191 @@ CREATE TABLE users_data (
   genero VARCHAR(100),
   nacionalidade VARCHAR(50),
   data_criacao DATE,
-  data_atualizacao DATE
-);
\ No newline at end of file
+  data_atualizacao DATE,
+  natural_key UUID GENERATED ALWAYS AS (users_data_natural_key(nome, data_nascimento, data_criacao)) STORED
+);
+
+-- Uploads upsert on the natural key, so uploading the same rows twice does not duplicate them.
+CREATE UNIQUE INDEX users_data_natural_key_idx ON users_data (natural_key);
+
+-- Row count of users_data kept up to date by statement-level triggers.
+-- Each statement appends its delta instead of updating a single row, so long
+-- uploads do not block concurrent writers; the deltas are periodically folded
+-- into one row by the backend.
+CREATE TABLE users_data_row_count (
+  delta BIGINT NOT NULL
+);
+
+INSERT INTO users_data_row_count (delta) VALUES (0);
+
+CREATE FUNCTION users_data_row_count_insert() RETURNS TRIGGER AS $$
+BEGIN
+  INSERT INTO users_data_row_count (delta) SELECT COUNT(*) FROM new_rows;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE FUNCTION users_data_row_count_delete() RETURNS TRIGGER AS $$
+BEGIN
+  INSERT INTO users_data_row_count (delta) SELECT -COUNT(*) FROM old_rows;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE FUNCTION users_data_row_count_truncate() RETURNS TRIGGER AS $$
+BEGIN
+  DELETE FROM users_data_row_count;
+  INSERT INTO users_data_row_count (delta) VALUES (0);
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER users_data_row_count_insert
+  AFTER INSERT ON users_data
+  REFERENCING NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION users_data_row_count_insert();
+
+CREATE TRIGGER users_data_row_count_delete
+  AFTER DELETE ON users_data
+  REFERENCING OLD TABLE AS old_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION users_data_row_count_delete();
+
+CREATE TRIGGER users_data_row_count_truncate
+  AFTER TRUNCATE ON users_data
+  FOR EACH STATEMENT EXECUTE FUNCTION users_data_row_count_truncate();
+
+
+-- Row counts of users_data by nacionalidade, genero, birth year and
+-- data_criacao day, kept up to date by statement-level triggers like
+-- users_data_row_count: every statement appends one delta per bucket it
+-- touched, and the deltas are periodically folded by the backend. A NULL
+-- bucket counts the rows whose value is NULL.
+CREATE TABLE users_data_stats (
+  dimension VARCHAR(20) NOT NULL,
+  bucket TEXT,
+  delta BIGINT NOT NULL
+);
+
+-- Buckets a users_data row is counted in, one per dimension.
+CREATE FUNCTION users_data_stats_buckets(nacionalidade TEXT, genero TEXT, data_nascimento DATE, data_criacao DATE)
+RETURNS TABLE (dimension VARCHAR(20), bucket TEXT) AS $$
+  VALUES
+    ('nacionalidade'::VARCHAR(20), nacionalidade),
+    ('genero', genero),
+    ('birth_year', to_char(data_nascimento, 'YYYY')),
+    ('data_criacao', to_char(data_criacao, 'YYYY-MM-DD'))
+$$ LANGUAGE sql IMMUTABLE;
+
+CREATE FUNCTION users_data_stats_insert() RETURNS TRIGGER AS $$
+BEGIN
+  INSERT INTO users_data_stats (dimension, bucket, delta)
+  SELECT b.dimension, b.bucket, COUNT(*)
+  FROM new_rows
+  CROSS JOIN LATERAL users_data_stats_buckets(nacionalidade, genero, data_nascimento, data_criacao) AS b
+  GROUP BY b.dimension, b.bucket;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE FUNCTION users_data_stats_delete() RETURNS TRIGGER AS $$
+BEGIN
+  INSERT INTO users_data_stats (dimension, bucket, delta)
+  SELECT b.dimension, b.bucket, -COUNT(*)
+  FROM old_rows
+  CROSS JOIN LATERAL users_data_stats_buckets(nacionalidade, genero, data_nascimento, data_criacao) AS b
+  GROUP BY b.dimension, b.bucket;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Updates move rows between buckets; buckets whose count did not change get no delta.
+CREATE FUNCTION users_data_stats_update() RETURNS TRIGGER AS $$
+BEGIN
+  INSERT INTO users_data_stats (dimension, bucket, delta)
+  SELECT b.dimension, b.bucket, SUM(changed.sign)
+  FROM (
+    SELECT -1 AS sign, nacionalidade, genero, data_nascimento, data_criacao FROM old_rows
+    UNION ALL
+    SELECT 1, nacionalidade, genero, data_nascimento, data_criacao FROM new_rows
+  ) AS changed
+  CROSS JOIN LATERAL users_data_stats_buckets(nacionalidade, genero, data_nascimento, data_criacao) AS b
+  GROUP BY b.dimension, b.bucket
+  HAVING SUM(changed.sign) <> 0;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE FUNCTION users_data_stats_truncate() RETURNS TRIGGER AS $$
+BEGIN
+  DELETE FROM users_data_stats;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER users_data_stats_insert
+  AFTER INSERT ON users_data
+  REFERENCING NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION users_data_stats_insert();
+
+CREATE TRIGGER users_data_stats_update
+  AFTER UPDATE ON users_data
+  REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION users_data_stats_update();
+
+CREATE TRIGGER users_data_stats_delete
+  AFTER DELETE ON users_data
+  REFERENCING OLD TABLE AS old_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION users_data_stats_delete();
+
+CREATE TRIGGER users_data_stats_truncate
+  AFTER TRUNCATE ON users_data
+  FOR EACH STATEMENT EXECUTE FUNCTION users_data_stats_truncate();
+
+
+-- Indexes for the filterable columns. Each one ends with id so equality
+-- filters can return their matches already in id order for pagination.
+CREATE INDEX users_data_nome_idx ON users_data (nome, id);
+CREATE INDEX users_data_genero_idx ON users_data (genero, id);
+CREATE INDEX users_data_nacionalidade_idx ON users_data (nacionalidade, id);
+CREATE INDEX users_data_data_nascimento_idx ON users_data (data_nascimento, id);
+CREATE INDEX users_data_data_criacao_idx ON users_data (data_criacao, id);
+CREATE INDEX users_data_data_atualizacao_idx ON users_data (data_atualizacao, id);
+
+
+-- Background CSV ingestion jobs. Workers claim queued jobs with
+-- FOR UPDATE SKIP LOCKED and hold them with a lease: worker_id is the
+-- worker running the job, which writes heartbeat_at on a timer. Running jobs
+-- whose heartbeat is older than the lease are put back in the queue.
+CREATE TABLE ingestion_jobs (
+  id UUID PRIMARY KEY,
+  status VARCHAR(20) NOT NULL,
+  file_name VARCHAR(255),
+  file_path TEXT NOT NULL,
+  engine VARCHAR(20) NOT NULL,
+  content_hash CHAR(64),
+  worker_id TEXT,
+  heartbeat_at TIMESTAMPTZ,
+  rows_processed BIGINT NOT NULL DEFAULT 0,
+  rows_rejected BIGINT NOT NULL DEFAULT 0,
+  rows_inserted BIGINT NOT NULL DEFAULT 0,
+  rows_updated BIGINT NOT NULL DEFAULT 0,
+  rows_per_second DOUBLE PRECISION,
+  error TEXT,
+  created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+  started_at TIMESTAMPTZ,
+  finished_at TIMESTAMPTZ,
+  updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+CREATE INDEX ingestion_jobs_queued_idx ON ingestion_jobs (created_at) WHERE status = 'queued';
+
+
+-- SHA-256 of every CSV file ingested successfully, so re-uploading the same
+-- file is detected before it is parsed.
+CREATE TABLE ingested_files (
+  content_hash CHAR(64) PRIMARY KEY,
+  upload_id UUID NOT NULL,
+  file_name VARCHAR(255),
+  rows_processed BIGINT NOT NULL,
+  ingested_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
@@ -0,0 +1,218 @@
+-- Ingestion schema: the natural key of users_data and its unique index, the
+-- maintained row count and stats summary with their triggers, the indexes of
+-- the filterable columns, and the ingestion_jobs and ingested_files tables.
+--
+-- New databases get all of it from init.sql; this file runs after it (see the
+-- Dockerfile) and changes nothing there. On an existing database run it once,
+-- before 01_name_search.sql and 02_datasets.sql and with the backend stopped,
+-- with:
+--   psql -1 -f database/migrations/01_ingestion_schema.sql
+-- Rows that share a natural key are deduplicated first: the one with the
+-- highest id, i.e. the last one written, is kept. Adding the natural key
+-- rewrites users_data, which takes time proportional to the table.
+
+CREATE OR REPLACE FUNCTION users_data_natural_key(nome TEXT, data_nascimento DATE, data_criacao DATE) RETURNS UUID AS $$
+  SELECT md5(
+    coalesce(nome, '') || E'\x1f' ||
+    coalesce(to_char(data_nascimento, 'YYYY-MM-DD'), '') || E'\x1f' ||
+    coalesce(to_char(data_criacao, 'YYYY-MM-DD'), '')
+  )::uuid
+$$ LANGUAGE sql IMMUTABLE;
+
+ALTER TABLE users_data ADD COLUMN IF NOT EXISTS natural_key UUID
+  GENERATED ALWAYS AS (users_data_natural_key(nome, data_nascimento, data_criacao)) STORED;
+
+DELETE FROM users_data AS older
+USING users_data AS newer
+WHERE older.natural_key = newer.natural_key AND older.id < newer.id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS users_data_natural_key_idx ON users_data (natural_key);
+
+
+-- Row count of users_data, seeded with the rows already stored.
+CREATE TABLE IF NOT EXISTS users_data_row_count (
+  delta BIGINT NOT NULL
+);
+
+INSERT INTO users_data_row_count (delta)
+SELECT COUNT(*) FROM users_data
+WHERE NOT EXISTS (SELECT 1 FROM users_data_row_count);
+
+CREATE OR REPLACE FUNCTION users_data_row_count_insert() RETURNS TRIGGER AS $$
+BEGIN
+  INSERT INTO users_data_row_count (delta) SELECT COUNT(*) FROM new_rows;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION users_data_row_count_delete() RETURNS TRIGGER AS $$
+BEGIN
+  INSERT INTO users_data_row_count (delta) SELECT -COUNT(*) FROM old_rows;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION users_data_row_count_truncate() RETURNS TRIGGER AS $$
+BEGIN
+  DELETE FROM users_data_row_count;
+  INSERT INTO users_data_row_count (delta) VALUES (0);
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS users_data_row_count_insert ON users_data;
+CREATE TRIGGER users_data_row_count_insert
+  AFTER INSERT ON users_data
+  REFERENCING NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION users_data_row_count_insert();
+
+DROP TRIGGER IF EXISTS users_data_row_count_delete ON users_data;
+CREATE TRIGGER users_data_row_count_delete
+  AFTER DELETE ON users_data
+  REFERENCING OLD TABLE AS old_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION users_data_row_count_delete();
+
+DROP TRIGGER IF EXISTS users_data_row_count_truncate ON users_data;
+CREATE TRIGGER users_data_row_count_truncate
+  AFTER TRUNCATE ON users_data
+  FOR EACH STATEMENT EXECUTE FUNCTION users_data_row_count_truncate();
+
+
+-- Stats summary of users_data, seeded with the rows already stored.
+CREATE TABLE IF NOT EXISTS users_data_stats (
+  dimension VARCHAR(20) NOT NULL,
+  bucket TEXT,
+  delta BIGINT NOT NULL
+);
+
+CREATE OR REPLACE FUNCTION users_data_stats_buckets(nacionalidade TEXT, genero TEXT, data_nascimento DATE, data_criacao DATE)
+RETURNS TABLE (dimension VARCHAR(20), bucket TEXT) AS $$
+  VALUES
+    ('nacionalidade'::VARCHAR(20), nacionalidade),
+    ('genero', genero),
+    ('birth_year', to_char(data_nascimento, 'YYYY')),
+    ('data_criacao', to_char(data_criacao, 'YYYY-MM-DD'))
+$$ LANGUAGE sql IMMUTABLE;
+
+INSERT INTO users_data_stats (dimension, bucket, delta)
+SELECT b.dimension, b.bucket, COUNT(*)
+FROM users_data
+CROSS JOIN LATERAL users_data_stats_buckets(nacionalidade, genero, data_nascimento, data_criacao) AS b
+WHERE NOT EXISTS (SELECT 1 FROM users_data_stats)
+GROUP BY b.dimension, b.bucket;
+
+CREATE OR REPLACE FUNCTION users_data_stats_insert() RETURNS TRIGGER AS $$
+BEGIN
+  INSERT INTO users_data_stats (dimension, bucket, delta)
+  SELECT b.dimension, b.bucket, COUNT(*)
+  FROM new_rows
+  CROSS JOIN LATERAL users_data_stats_buckets(nacionalidade, genero, data_nascimento, data_criacao) AS b
+  GROUP BY b.dimension, b.bucket;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION users_data_stats_delete() RETURNS TRIGGER AS $$
+BEGIN
+  INSERT INTO users_data_stats (dimension, bucket, delta)
+  SELECT b.dimension, b.bucket, -COUNT(*)
+  FROM old_rows
+  CROSS JOIN LATERAL users_data_stats_buckets(nacionalidade, genero, data_nascimento, data_criacao) AS b
+  GROUP BY b.dimension, b.bucket;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION users_data_stats_update() RETURNS TRIGGER AS $$
+BEGIN
+  INSERT INTO users_data_stats (dimension, bucket, delta)
+  SELECT b.dimension, b.bucket, SUM(changed.sign)
+  FROM (
+    SELECT -1 AS sign, nacionalidade, genero, data_nascimento, data_criacao FROM old_rows
+    UNION ALL
+    SELECT 1, nacionalidade, genero, data_nascimento, data_criacao FROM new_rows
+  ) AS changed
+  CROSS JOIN LATERAL users_data_stats_buckets(nacionalidade, genero, data_nascimento, data_criacao) AS b
+  GROUP BY b.dimension, b.bucket
+  HAVING SUM(changed.sign) <> 0;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION users_data_stats_truncate() RETURNS TRIGGER AS $$
+BEGIN
+  DELETE FROM users_data_stats;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS users_data_stats_insert ON users_data;
+CREATE TRIGGER users_data_stats_insert
+  AFTER INSERT ON users_data
+  REFERENCING NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION users_data_stats_insert();
+
+DROP TRIGGER IF EXISTS users_data_stats_update ON users_data;
+CREATE TRIGGER users_data_stats_update
+  AFTER UPDATE ON users_data
+  REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION users_data_stats_update();
+
+DROP TRIGGER IF EXISTS users_data_stats_delete ON users_data;
+CREATE TRIGGER users_data_stats_delete
+  AFTER DELETE ON users_data
+  REFERENCING OLD TABLE AS old_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION users_data_stats_delete();
+
+DROP TRIGGER IF EXISTS users_data_stats_truncate ON users_data;
+CREATE TRIGGER users_data_stats_truncate
+  AFTER TRUNCATE ON users_data
+  FOR EACH STATEMENT EXECUTE FUNCTION users_data_stats_truncate();
+
+
+CREATE INDEX IF NOT EXISTS users_data_nome_idx ON users_data (nome, id);
+CREATE INDEX IF NOT EXISTS users_data_genero_idx ON users_data (genero, id);
+CREATE INDEX IF NOT EXISTS users_data_nacionalidade_idx ON users_data (nacionalidade, id);
+CREATE INDEX IF NOT EXISTS users_data_data_nascimento_idx ON users_data (data_nascimento, id);
+CREATE INDEX IF NOT EXISTS users_data_data_criacao_idx ON users_data (data_criacao, id);
+CREATE INDEX IF NOT EXISTS users_data_data_atualizacao_idx ON users_data (data_atualizacao, id);
+
+
+-- Tables created by an earlier version of init.sql get the columns added since.
+CREATE TABLE IF NOT EXISTS ingestion_jobs (
+  id UUID PRIMARY KEY,
+  status VARCHAR(20) NOT NULL,
+  file_name VARCHAR(255),
+  file_path TEXT NOT NULL,
+  engine VARCHAR(20) NOT NULL,
+  content_hash CHAR(64),
+  worker_id TEXT,
+  heartbeat_at TIMESTAMPTZ,
+  rows_processed BIGINT NOT NULL DEFAULT 0,
+  rows_rejected BIGINT NOT NULL DEFAULT 0,
+  rows_inserted BIGINT NOT NULL DEFAULT 0,
+  rows_updated BIGINT NOT NULL DEFAULT 0,
+  rows_per_second DOUBLE PRECISION,
+  error TEXT,
+  created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+  started_at TIMESTAMPTZ,
+  finished_at TIMESTAMPTZ,
+  updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+ALTER TABLE ingestion_jobs ADD COLUMN IF NOT EXISTS content_hash CHAR(64);
+ALTER TABLE ingestion_jobs ADD COLUMN IF NOT EXISTS worker_id TEXT;
+ALTER TABLE ingestion_jobs ADD COLUMN IF NOT EXISTS heartbeat_at TIMESTAMPTZ;
+ALTER TABLE ingestion_jobs ADD COLUMN IF NOT EXISTS rows_rejected BIGINT NOT NULL DEFAULT 0;
+ALTER TABLE ingestion_jobs ADD COLUMN IF NOT EXISTS rows_inserted BIGINT NOT NULL DEFAULT 0;
+ALTER TABLE ingestion_jobs ADD COLUMN IF NOT EXISTS rows_updated BIGINT NOT NULL DEFAULT 0;
+
+CREATE INDEX IF NOT EXISTS ingestion_jobs_queued_idx ON ingestion_jobs (created_at) WHERE status = 'queued';
+
+CREATE TABLE IF NOT EXISTS ingested_files (
+  content_hash CHAR(64) PRIMARY KEY,
+  upload_id UUID NOT NULL,
+  file_name VARCHAR(255),
+  rows_processed BIGINT NOT NULL,
+  ingested_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
@@ -0,0 +1,26 @@
+-- Case- and accent-insensitive search on users_data.nome.
+--
+-- New databases run this file after init.sql (see the Dockerfile). On an
+-- existing database run it once, after 01_ingestion_schema.sql, with:
+--   psql -f database/migrations/01_name_search.sql
+-- The indexes are built CONCURRENTLY, so uploads and edits are not blocked
+-- while they are created; do not run the file inside a transaction.
+
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE EXTENSION IF NOT EXISTS unaccent;
+
+-- Text that searches compare: nome lowercased and without accents. unaccent()
+-- is only STABLE because its dictionary could change, so it is wrapped with the
+-- dictionary fixed to be usable in indexes.
+CREATE OR REPLACE FUNCTION users_data_search_text(value TEXT) RETURNS TEXT AS $$
+  SELECT lower(public.unaccent('public.unaccent'::regdictionary, value))
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE STRICT;
+
+-- Substring (LIKE '%...%') and fuzzy (<%) searches.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS users_data_nome_trgm_idx
+  ON users_data USING gin (users_data_search_text(nome) gin_trgm_ops);
+
+-- Prefix searches, which read the matches already in order so typeahead only
+-- touches as many rows as it returns. The C collation lets LIKE 'abc%' use it.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS users_data_nome_prefix_idx
+  ON users_data ((users_data_search_text(nome)) COLLATE "C", id);
@@ -0,0 +1,206 @@
+-- Datasets: the rows of users_data are stored in one partition per dataset.
+-- By default an upload upserts its rows into dataset 1 on the natural key, so
+-- overlapping uploads do not duplicate rows. An upload may instead ask for a
+-- dataset of its own, listed, exported or dropped at once, or append its rows
+-- to an existing dataset, where they are upserted on the natural key too.
+--
+-- New databases run this file after init.sql and the 01_ migrations (see the
+-- Dockerfile). On an existing database run it once, after
+-- 01_ingestion_schema.sql and 01_name_search.sql and with the backend stopped,
+-- with:
+--   psql -1 -f database/migrations/02_datasets.sql
+-- The rows already stored become dataset 1. Their primary key and natural key
+-- index are rebuilt with dataset_id, which takes time proportional to the table.
+
+CREATE TABLE datasets (
+  id BIGSERIAL PRIMARY KEY,
+  status VARCHAR(20) NOT NULL,
+  file_name VARCHAR(255),
+  content_hash CHAR(64),
+  upload_id UUID,
+  created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+  updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+);
+
+-- Dataset 1 holds the rows stored before datasets existed and the items added
+-- one by one through the API. It cannot be dropped.
+INSERT INTO datasets (id, status) VALUES (1, 'ready');
+SELECT setval('datasets_id_seq', 1);
+
+
+-- The triggers move to the partitioned table, which fires them for the rows of
+-- every partition.
+DROP TRIGGER users_data_row_count_insert ON users_data;
+DROP TRIGGER users_data_row_count_delete ON users_data;
+DROP TRIGGER users_data_row_count_truncate ON users_data;
+DROP TRIGGER users_data_stats_insert ON users_data;
+DROP TRIGGER users_data_stats_update ON users_data;
+DROP TRIGGER users_data_stats_delete ON users_data;
+DROP TRIGGER users_data_stats_truncate ON users_data;
+
+-- The existing table becomes the partition of dataset 1. Its indexes are
+-- renamed so the partitioned table can take their names, and are attached to
+-- the indexes of the partitioned table instead of being built again.
+ALTER TABLE users_data RENAME TO users_data_1;
+ALTER TABLE users_data_1 ADD COLUMN dataset_id BIGINT NOT NULL DEFAULT 1;
+
+-- Unique indexes of a partitioned table must include the partition key, so
+-- the same natural key may now appear once per dataset. Uploads that must not
+-- duplicate each other's rows share a dataset, dataset 1 by default.
+ALTER TABLE users_data_1 DROP CONSTRAINT users_data_pkey;
+ALTER TABLE users_data_1 ADD CONSTRAINT users_data_1_pkey PRIMARY KEY (id, dataset_id);
+DROP INDEX users_data_natural_key_idx;
+CREATE UNIQUE INDEX users_data_1_natural_key_idx ON users_data_1 (natural_key, dataset_id);
+
+ALTER INDEX users_data_nome_idx RENAME TO users_data_1_nome_idx;
+ALTER INDEX users_data_genero_idx RENAME TO users_data_1_genero_idx;
+ALTER INDEX users_data_nacionalidade_idx RENAME TO users_data_1_nacionalidade_idx;
+ALTER INDEX users_data_data_nascimento_idx RENAME TO users_data_1_data_nascimento_idx;
+ALTER INDEX users_data_data_criacao_idx RENAME TO users_data_1_data_criacao_idx;
+ALTER INDEX users_data_data_atualizacao_idx RENAME TO users_data_1_data_atualizacao_idx;
+ALTER INDEX IF EXISTS users_data_nome_trgm_idx RENAME TO users_data_1_nome_trgm_idx;
+ALTER INDEX IF EXISTS users_data_nome_prefix_idx RENAME TO users_data_1_nome_prefix_idx;
+
+-- Ids stay unique across datasets: every partition takes them from the same sequence.
+CREATE TABLE users_data (
+  id INTEGER NOT NULL DEFAULT nextval('users_data_id_seq'),
+  nome VARCHAR(100),
+  data_nascimento DATE,
+  genero VARCHAR(100),
+  nacionalidade VARCHAR(50),
+  data_criacao DATE,
+  data_atualizacao DATE,
+  natural_key UUID GENERATED ALWAYS AS (users_data_natural_key(nome, data_nascimento, data_criacao)) STORED,
+  dataset_id BIGINT NOT NULL DEFAULT 1,
+  PRIMARY KEY (id, dataset_id)
+) PARTITION BY LIST (dataset_id);
+
+ALTER SEQUENCE users_data_id_seq OWNED BY users_data.id;
+
+CREATE UNIQUE INDEX users_data_natural_key_idx ON users_data (natural_key, dataset_id);
+CREATE INDEX users_data_nome_idx ON users_data (nome, id);
+CREATE INDEX users_data_genero_idx ON users_data (genero, id);
+CREATE INDEX users_data_nacionalidade_idx ON users_data (nacionalidade, id);
+CREATE INDEX users_data_data_nascimento_idx ON users_data (data_nascimento, id);
+CREATE INDEX users_data_data_criacao_idx ON users_data (data_criacao, id);
+CREATE INDEX users_data_data_atualizacao_idx ON users_data (data_atualizacao, id);
+CREATE INDEX users_data_nome_trgm_idx
+  ON users_data USING gin (users_data_search_text(nome) gin_trgm_ops);
+CREATE INDEX users_data_nome_prefix_idx
+  ON users_data ((users_data_search_text(nome)) COLLATE "C", id);
+
+ALTER TABLE users_data ATTACH PARTITION users_data_1 FOR VALUES IN (1);
+
+
+-- The deltas are kept by dataset, so dropping the partition of a dataset only
+-- has to delete its deltas to keep the counts right.
+ALTER TABLE users_data_row_count ADD COLUMN dataset_id BIGINT NOT NULL DEFAULT 1;
+ALTER TABLE users_data_row_count ALTER COLUMN dataset_id DROP DEFAULT;
+ALTER TABLE users_data_stats ADD COLUMN dataset_id BIGINT NOT NULL DEFAULT 1;
+ALTER TABLE users_data_stats ALTER COLUMN dataset_id DROP DEFAULT;
+
+CREATE OR REPLACE FUNCTION users_data_row_count_insert() RETURNS TRIGGER AS $$
+BEGIN
+  INSERT INTO users_data_row_count (dataset_id, delta)
+  SELECT dataset_id, COUNT(*) FROM new_rows GROUP BY dataset_id;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION users_data_row_count_delete() RETURNS TRIGGER AS $$
+BEGIN
+  INSERT INTO users_data_row_count (dataset_id, delta)
+  SELECT dataset_id, -COUNT(*) FROM old_rows GROUP BY dataset_id;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION users_data_row_count_truncate() RETURNS TRIGGER AS $$
+BEGIN
+  DELETE FROM users_data_row_count;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION users_data_stats_insert() RETURNS TRIGGER AS $$
+BEGIN
+  INSERT INTO users_data_stats (dataset_id, dimension, bucket, delta)
+  SELECT dataset_id, b.dimension, b.bucket, COUNT(*)
+  FROM new_rows
+  CROSS JOIN LATERAL users_data_stats_buckets(nacionalidade, genero, data_nascimento, data_criacao) AS b
+  GROUP BY dataset_id, b.dimension, b.bucket;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION users_data_stats_delete() RETURNS TRIGGER AS $$
+BEGIN
+  INSERT INTO users_data_stats (dataset_id, dimension, bucket, delta)
+  SELECT dataset_id, b.dimension, b.bucket, -COUNT(*)
+  FROM old_rows
+  CROSS JOIN LATERAL users_data_stats_buckets(nacionalidade, genero, data_nascimento, data_criacao) AS b
+  GROUP BY dataset_id, b.dimension, b.bucket;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION users_data_stats_update() RETURNS TRIGGER AS $$
+BEGIN
+  INSERT INTO users_data_stats (dataset_id, dimension, bucket, delta)
+  SELECT changed.dataset_id, b.dimension, b.bucket, SUM(changed.sign)
+  FROM (
+    SELECT -1 AS sign, dataset_id, nacionalidade, genero, data_nascimento, data_criacao FROM old_rows
+    UNION ALL
+    SELECT 1, dataset_id, nacionalidade, genero, data_nascimento, data_criacao FROM new_rows
+  ) AS changed
+  CROSS JOIN LATERAL users_data_stats_buckets(nacionalidade, genero, data_nascimento, data_criacao) AS b
+  GROUP BY changed.dataset_id, b.dimension, b.bucket
+  HAVING SUM(changed.sign) <> 0;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER users_data_row_count_insert
+  AFTER INSERT ON users_data
+  REFERENCING NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION users_data_row_count_insert();
+
+CREATE TRIGGER users_data_row_count_delete
+  AFTER DELETE ON users_data
+  REFERENCING OLD TABLE AS old_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION users_data_row_count_delete();
+
+CREATE TRIGGER users_data_row_count_truncate
+  AFTER TRUNCATE ON users_data
+  FOR EACH STATEMENT EXECUTE FUNCTION users_data_row_count_truncate();
+
+CREATE TRIGGER users_data_stats_insert
+  AFTER INSERT ON users_data
+  REFERENCING NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION users_data_stats_insert();
+
+CREATE TRIGGER users_data_stats_update
+  AFTER UPDATE ON users_data
+  REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION users_data_stats_update();
+
+CREATE TRIGGER users_data_stats_delete
+  AFTER DELETE ON users_data
+  REFERENCING OLD TABLE AS old_rows
+  FOR EACH STATEMENT EXECUTE FUNCTION users_data_stats_delete();
+
+CREATE TRIGGER users_data_stats_truncate
+  AFTER TRUNCATE ON users_data
+  FOR EACH STATEMENT EXECUTE FUNCTION users_data_stats_truncate();
+
+
+-- The dataset a background job ingests into, created when the job is queued,
+-- and the dataset it replaces once it succeeds. A job that appends to an
+-- existing dataset never drops it, even when it fails or is cancelled.
+ALTER TABLE ingestion_jobs ADD COLUMN dataset_id BIGINT;
+ALTER TABLE ingestion_jobs ADD COLUMN replaces_dataset_id BIGINT;
+ALTER TABLE ingestion_jobs ADD COLUMN append BOOLEAN NOT NULL DEFAULT false;
+
+-- The dataset a file was ingested into, so the records of the files appended
+-- to a dataset are deleted with it.
+ALTER TABLE ingested_files ADD COLUMN dataset_id BIGINT;
@@ -27,11 +27,12 @@ const TableCSV = (props: TableCSVProps) => {
     // Chame a função setRedirect para definir o item a ser redirecionado
     setRedirect(item);
     
-    // Acessa o primeiro item do array e extrai o id
+    // Acessa o primeiro item do array e extrai o id; o dataset é o último
     const [firstItem] = item;
+    const datasetId = item[item.length - 1];
     
     try {
-        await axios.delete(`http://localhost:8150/csv-uploader/api/delete/id/${firstItem}`);
+        await axios.delete(`http://localhost:8150/csv-uploader/api/delete/id/${firstItem}`, { params: { dataset_id: datasetId } });
         console.log("Item excluído com sucesso");
         // Lógica adicional para exclusão
     } catch (error) {
@@ -66,6 +67,7 @@ const TableCSV = (props: TableCSVProps) => {
                   <TableCell>genero</TableCell>
                   <TableCell>data_criacao</TableCell>
                   <TableCell>data_atualizacao</TableCell>
+                  <TableCell>dataset_id</TableCell>
                 </>
               )
               }
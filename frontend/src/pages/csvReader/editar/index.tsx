@@ -11,7 +11,7 @@ const EditarCSV = ({ FileCSV, redirect, isAdd, setIsAdd }) => {
 
     useEffect(() => {
         if (redirect.length > 0) {
-            const editarRow = FileCSV?.find(file => file.id === redirect[0]);
+            const editarRow = FileCSV?.find(file => file.id === redirect[0] && file.dataset_id === redirect[redirect.length - 1]);
             if (editarRow) {
                 setInitialValues(editarRow);
             }
@@ -40,8 +40,8 @@ const EditarCSV = ({ FileCSV, redirect, isAdd, setIsAdd }) => {
                     console.log("Item adicionado com sucesso");
                 } else {
                     // Atualizar
-                    const { id, ...payload } = values;
-                    await axios.put(`http://localhost:8150/csv-uploader/api/update/id/${id}`, payload);
+                    const { id, dataset_id, ...payload } = values;
+                    await axios.put(`http://localhost:8150/csv-uploader/api/update/id/${id}`, payload, { params: { dataset_id } });
                     console.log("Item atualizado com sucesso");
                 }
                 window.location.reload(); // Atualiza a página após sucesso